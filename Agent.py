@@ -1,146 +1,429 @@
-import os, json, psutil, socket, time
-from flask import Flask, jsonify, request
+import os, json, psutil, socket, threading, time, zlib, fnmatch
+from flask import Flask, jsonify, request, Response, stream_with_context
 from flask_cors import CORS
-import glob
-from collections import deque
 import shutil
+from collections import deque
+from proc_index import ProcessIndex
+from folder_watch import FolderWatcher
+from slots import SlotSet
+from correlate import FileCorrelator
+from listing import Lister, ListingQuery, ListingError, gzip_responses
+from events import EventBus
+import log_tail
+from segment_index import SegmentIndex
+from log_search import LogSearchIndex
+from kill_jobs import KillJobManager, terminate_and_wait, remove_with_retry
+from transfer import transfer_file, transfer_options, IGNORED_SUFFIXES
+from config_service import get_service
+from instrument import instrument_app, counter, span
+from host_metrics import HostMetrics, columns_to_json, columns_to_bytes
+from trash import TrashReaper
+from retention import RetentionEngine, ARCHIVE_SUFFIX, LOG_MEMBER
+from serve import serve
+import logging
+
+# Parsed once and kept current: edits to config.json are picked up without restarting the agent
+config_service = get_service('config.json', required=('agent_port', 'target_folder', 'queue_folder',
+                                                      'secondary_folder', 'target_user', 'sas_process',
+                                                      'perl_filter'))
+config = config_service.get()
 
-with open('config.json', 'r') as f:
-    config = json.load(f)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 app = Flask(__name__)
 CORS(app)
 
-def is_target_proc(proc, proc_name_filter, cmd_filter=None):
-    """Checks if a process matches the User, Name, and Command Line filter."""
+# /metrics (Prometheus) plus per-endpoint latency; /debug/profile only while "profiling" is true in config.json
+instrument_app(app, "agent", profiling_enabled=lambda: config.get('profiling', False))
+gzip_responses(app)
+DELETES = counter("agent_deletes_total", "Queue files and run folders deleted through the API.", ("kind",))
+
+# Shared process snapshot: one background walk of the process table serves every request
+proc_index = ProcessIndex(interval=config.get('proc_refresh_interval', 2),
+                          min_age=config.get('proc_min_age', 0.5)).start()
+
+# In-memory listings of the watched folders, kept current by change notifications / mtime polling
+def watch_folder(key, kind=None, include_suffixes=()):
+    # Half-transferred files (.part) are not jobs until transfer_file renames them into place
+    return FolderWatcher(config.get(key, ''), kind=kind, interval=config.get('watch_interval', 2),
+                         ignore_suffixes=IGNORED_SUFFIXES, include_suffixes=include_suffixes).start()
+
+# The processing folder as job_slots slots (sub-folders slot1..N when more than one), read like one watcher
+def watch_slot(path):
+    return FolderWatcher(path, interval=config.get('watch_interval', 2), ignore_suffixes=IGNORED_SUFFIXES).start()
+
+target_watch = SlotSet(config.get('target_folder', ''), config.get('job_slots', 1),
+                       config.get('slot_folder_prefix', 'slot'), make_watcher=watch_slot)
+queue_watch = watch_folder('queue_folder', kind="files")
+# Run folders, plus the <run>.zip archives the retention engine leaves in their place
+secondary_watch = watch_folder('secondary_folder', kind="dirs", include_suffixes=(ARCHIVE_SUFFIX,))
+
+# Processing file -> PIDs whose command line mentions it, one automaton pass over all command lines
+file_owners = FileCorrelator(target_watch)
+
+# Sorted/filtered views for the paged listing endpoints (see listing.py)
+target_list = Lister(target_watch)
+queue_list = Lister(queue_watch)
+secondary_list = Lister(secondary_watch)
+
+# Segment -> run folder index over log_search_root, so /get-log never globs the whole root
+segment_index = SegmentIndex(config.get('log_search_root', ''), cache_path=config.get('segment_index_cache'),
+                             interval=config.get('watch_interval', 2)).start()
+
+# Full-text index over every run's proglogs.txt / *_P.log, updated incrementally in the background
+def log_index_roots(cfg):
+    return [cfg.get('secondary_folder'), cfg.get('log_search_root')]
+
+log_index_cfg = config.get('log_index', {})
+log_index = LogSearchIndex(log_index_roots(config), db_path=log_index_cfg.get('path', 'log_index.db'),
+                           interval=log_index_cfg.get('interval', 30),
+                           max_bytes_per_pass=int(log_index_cfg.get('max_mb_per_pass', 64) * 1024 * 1024)).start()
+
+# --- PUSH EVENTS (/events) ---
+event_bus = EventBus()
+DRIVES = ['C:', 'D:']  # Default for disk_mounts
+
+def publish_folder_changes(folder_label):
+    def on_change(watcher, added, removed):
+        for entry in added:
+            event_bus.publish("file_added", {"folder": folder_label, "name": entry["name"]})
+        for entry in removed:
+            event_bus.publish("file_removed", {"folder": folder_label, "name": entry["name"]})
+    return on_change
+
+target_watch.subscribe(publish_folder_changes("processing"))
+queue_watch.subscribe(publish_folder_changes("queue"))
+
+def on_config_change(old, new):
+    """Applies a reloaded config.json: handlers read the new dict, watchers follow moved folders."""
+    global config, segment_index, host_metrics
+    config = new
+    for key, watcher in (('queue_folder', queue_watch), ('secondary_folder', secondary_watch)):
+        if watcher.retarget(new.get(key, '')):
+            logging.info(f"CONFIG: now watching {key} = {watcher.path}")
+    if target_watch.configure(new.get('target_folder', ''), new.get('job_slots', 1), new.get('slot_folder_prefix', 'slot')):
+        logging.info(f"CONFIG: now watching target_folder = {target_watch.root} ({target_watch.count} job slot(s))")
+    if (new.get('log_search_root', ''), new.get('segment_index_cache')) != (segment_index.root, segment_index.cache_path):
+        old_index = segment_index
+        segment_index = SegmentIndex(new.get('log_search_root', ''), cache_path=new.get('segment_index_cache'),
+                                     interval=new.get('watch_interval', 2)).start()
+        old_index.stop()
+    proc_index.interval = new.get('proc_refresh_interval', 2)
+    proc_index.min_age = new.get('proc_min_age', 0.5)
+    log_index.roots = [r for r in dict.fromkeys(log_index_roots(new)) if r]
+    kill_jobs.wait_timeout = new.get('kill_wait_timeout', 10)
+    kill_jobs.delete_deadline = new.get('delete_deadline', 15)
+    trash_reaper.trash_override = new.get('trash_folder')
+    retention.folder = new.get('secondary_folder')
+    if new.get('retention') != old.get('retention'):
+        retention.configure(new.get('retention'))
+    host_metrics.interval = new.get('metrics_interval', 5)
+    if new.get('disk_mounts', DRIVES) != host_metrics.mounts:
+        # The field set follows the mounts, so a new mount list starts a fresh history
+        old_metrics = host_metrics
+        host_metrics = start_host_metrics(new)
+        old_metrics.stop()
+
+config_service.subscribe(on_config_change)
+
+# Both the process refresher and the target folder watcher publish, so the job bookkeeping sits under a lock
+job_lock = threading.Lock()
+job_states = {}
+job_started = {}                    # file -> time it was first seen Processing
+recent_job_seconds = deque(maxlen=20)  # durations of the last finished jobs, for load-aware dispatch
+
+def publish_job_states(snap):
+    """Publishes a job_status event for every processing file that flipped Idle <-> Processing."""
+    active_perl = get_perl_processes(snap)
+    owners = file_owners.owners_map(snap)
+    with job_lock:
+        current = {f: "Processing" if active_perl & owners.get(f, set()) else "Idle"
+                   for f in target_watch.names()}
+        for name, status in current.items():
+            if job_states.get(name) != status:
+                event_bus.publish("job_status", {"name": name, "status": status})
+                if status == "Processing":
+                    job_started.setdefault(name, time.time())
+        for name in list(job_started):
+            if current.get(name) != "Processing":
+                recent_job_seconds.append(time.time() - job_started.pop(name))
+        job_states.clear()
+        job_states.update(current)
+
+proc_index.subscribe(lambda old, new: publish_job_states(new))
+target_watch.subscribe(lambda watcher, added, removed: publish_job_states(proc_index.snapshot()))
+
+def cached_json(etag, build):
+    """Answers 304 if the client already holds this version, otherwise jsonify(build()) tagged with the ETag."""
+    if request.if_none_match.contains(etag) or request.if_none_match.contains(etag + "-gz"):
+        resp = Response(status=304)
+    else:
+        resp = jsonify(build())
+    resp.set_etag(etag)
+    return resp
+
+def listed(lister, base_etag, items_key, payload=None, decorate=None, extra_fields=(), default_fields=("name",),
+           names_only=False):
+    """
+    Paged/sorted/filtered listing response (query parameters in listing.ListingQuery).
+    names_only keeps the old plain list of names unless the caller asks for fields.
+    """
     try:
-        # Windows usernames often come as DOMAIN\user, so we check if 'xyz' is in the string
-        if config['target_user'].lower() not in proc.username().lower():
-            return False
-        
-        if proc_name_filter.lower() not in proc.name().lower():
-            return False
-            
-        if cmd_filter:
-            cmdline = " ".join(proc.info['cmdline'] or [])
-            if cmd_filter not in cmdline:
-                return False
-                
-        return True
-    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-        return False
+        q = ListingQuery(request.args, ("name", "is_dir", "size", "mtime") + tuple(extra_fields), default_fields)
+    except ListingError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
 
-def kill_sequence(filename):
-    """Kill Perl first, then SAS, then verify."""
-    filters = [
-        {"name": "perl", "cmd": config['perl_filter']},
-        {"name": config['sas_process'], "cmd": None}
-    ]
+    def build():
+        page = lister.page(q, decorate)
+        body = dict(payload or {})
+        if "items" in page:
+            items = page.pop("items")
+            body[items_key] = [row["name"] for row in items] if names_only and not q.projected else items
+        body.update(page)
+        return body
+    return cached_json(q.etag(base_etag), build)
+
+def requested_max_age():
+    """Callers can pass ?max_age=<seconds> to force a fresher process snapshot (at least proc_min_age old)."""
+    return request.args.get('max_age', type=float)
+
+def target_procs(snap, proc_name_filter, cmd_filter=None):
+    """Processes of target_user with the given executable name (and cmdline token, if any)."""
+    return snap.find(name=proc_name_filter, user=config['target_user'], token=cmd_filter)
+
+def get_perl_processes(snap):
+    """PIDs of the target user's perl processes running the job script."""
+    return {p.pid for p in target_procs(snap, "perl", config['perl_filter'])}
+
+def kill_targets(filename):
+    """PIDs to stop for a file: its perl job(s) plus the target user's SAS sessions."""
+    # Kills must act on live data, so take a fresh snapshot
+    snap = proc_index.refresh()
+    # Only kill perl processes tied to this specific file
+    perl_pids = get_perl_processes(snap) & file_owners.owners(snap, filename)
+    sas_pids = {p.pid for p in target_procs(snap, config['sas_process'])}
+    if target_watch.count > 1:
+        # The other slots' jobs keep running: only SAS started by this job or working in its slot folder
+        started = snap.descendants(perl_pids)
+        folder = target_watch.folder(target_watch.slot_of(filename))
+        sas_pids = {pid for pid in sas_pids
+                    if pid in started or (folder and folder + os.sep in snap.procs[pid].cmdline)}
+    return perl_pids | sas_pids
+
+def processing_path(filename):
+    return target_watch.path_of(filename)
 
-    # Attempt cleanup loop (3 attempts, 5 seconds apart)
+def kill_sequence(filename):
+    """Kill Perl and SAS, wait for them to exit, then delete the file (synchronous)."""
     for attempt in range(3):
-        found_anything = False
-        
-        for f in filters:
-            for proc in psutil.process_iter(['name', 'username', 'cmdline']):
-                if is_target_proc(proc, f['name'], f['cmd']):
-                    # Additional check: only kill if this process is tied to the specific file
-                    cmdline = " ".join(proc.info['cmdline'] or [])
-                    if filename in cmdline or f['name'] == config['sas_process']:
-                        proc.kill()
-                        found_anything = True
-        
-        if not found_anything and attempt > 0:
+        pids = kill_targets(filename)
+        if not pids:
             break # Everything is dead, we can stop checking
-        
-        time.sleep(5) # Wait 5 seconds before re-checking/re-killing
-    
-    # Finally, delete the file
-    path = os.path.join(config['target_folder'], filename)
-    if os.path.exists(path):
-        try:
-            os.remove(path)
-            return True
-        except:
-            return False
-    return True
+        terminate_and_wait(pids, config.get('kill_wait_timeout', 10))
+
+    # Finally, delete the file (retrying briefly while Windows releases the lock)
+    deleted = remove_with_retry(processing_path(filename), config.get('delete_deadline', 15))
+    target_watch.rescan()
+    return deleted
+
+def on_kill_job_update(job):
+    event_bus.publish("kill_job", job)
+    if job["state"] in ("done", "failed"):
+        target_watch.rescan()
+
+kill_jobs = KillJobManager(kill_targets, processing_path, on_update=on_kill_job_update,
+                           max_workers=config.get('kill_workers', 8),
+                           wait_timeout=config.get('kill_wait_timeout', 10),
+                           delete_deadline=config.get('delete_deadline', 15))
+
+# --- TRASH (batch / background deletes) ---
+def on_trash_update(batch):
+    event_bus.publish("trash_batch", batch)
+
+# Deleted items are renamed into a trash folder next to the watched folder and removed in the background
+trash_reaper = TrashReaper(config.get('trash_folder'), io_workers=config.get('reaper_workers', 4),
+                           on_update=on_trash_update)
+trash_reaper.recover([config.get('queue_folder'), config.get('secondary_folder')])
+
+# --- RETENTION (old run folders compressed in the background, deleted past the limits) ---
+def runs_in_use():
+    """Run folders the current processing files log to; retention never touches them."""
+    folders = (find_job_log(name)[1] for name in target_watch.names())
+    return {os.path.basename(folder) for folder in folders if folder}
+
+def discard_runs(paths):
+    batch = trash_reaper.trash(paths, label="retention")
+    if batch["failed"]:
+        raise OSError("; ".join(f"{name}: {error}" for name, error in batch["failed"].items()))
+    secondary_watch.rescan()
+
+def on_retention_update(event):
+    event_bus.publish("retention", event)
+
+retention = RetentionEngine(config.get('secondary_folder'), config.get('retention'), in_use=runs_in_use,
+                            discard=discard_runs, on_update=on_retention_update).start()
+
+# --- HOST METRICS ---
+def process_counts():
+    snap = proc_index.snapshot()
+    return {"sas_running": len(target_procs(snap, config['sas_process'])),
+            "perl_running": len(get_perl_processes(snap)),
+            "trash_pending": trash_reaper.pending,
+            "trash_freed_gb": round(trash_reaper.bytes_freed / (1024**3), 3)}
+
+disk_above = {}
+
+def publish_disk_thresholds(metrics, ts, sample):
+    """Publishes disk_threshold whenever a drive crosses disk_alert_percent in either direction."""
+    threshold = config.get('disk_alert_percent', 90)
+    for drive in metrics.mounts:
+        usage = metrics.disk(drive)
+        if usage is None:
+            continue
+        is_above = usage["percent"] >= threshold
+        if disk_above.get(drive, False) != is_above:
+            event_bus.publish("disk_threshold", {"drive": drive, "percent": usage["percent"], "above": is_above})
+        disk_above[drive] = is_above
+
+def start_host_metrics(cfg):
+    # One background sampler feeds /disk-usage, /host-metrics and the disk_threshold events
+    sampler = HostMetrics(cfg.get('disk_mounts', DRIVES), interval=cfg.get('metrics_interval', 5),
+                          extra=process_counts,
+                          extra_fields=("sas_running", "perl_running", "trash_pending", "trash_freed_gb"))
+    sampler.subscribe(publish_disk_thresholds)
+    return sampler.start()
+
+host_metrics = start_host_metrics(config)
 
 @app.route('/scan', methods=['GET'])
 def scan():
-    active_perl_cmds = get_perl_processes() # Existing function that looks for perl + ci_job.pl
-    files_list = []
-    
-    if os.path.exists(config['target_folder']):
-        for f in os.listdir(config['target_folder']):
-            # Logic: If the filename is found in any running Perl command line
-            is_busy = any(f in cmd for cmd in active_perl_cmds)
-            files_list.append({
-                "name": f, 
-                "status": "Processing" if is_busy else "Idle"
-            })
-    
-    return jsonify({"server": socket.gethostname(), "files": files_list})
+    snap = proc_index.snapshot(max_age=requested_max_age())
+    active_perl = get_perl_processes(snap)
+    owners = file_owners.owners_map(snap)
+    # Logic: a file is busy if its name appears in the command line of any running Perl job
+    busy = sorted(f for f, pids in owners.items() if active_perl & pids)
+    busy_set = set(busy)
+
+    def with_status(entry):
+        return dict(entry, status="Processing" if entry["name"] in busy_set else "Idle")
+
+    # The response changes when the folder changes or a file flips Idle <-> Processing
+    etag = f"{target_watch.etag()}-{zlib.crc32(json.dumps(busy).encode())}"
+    # With several job slots every file says which slot it is in
+    default_fields = ("name", "status", "slot") if target_watch.count > 1 else ("name", "status")
+    return listed(target_list, etag, "files", {"server": socket.gethostname(), "snapshot_age": round(snap.age(), 2),
+                                               "job_slots": target_watch.count},
+                  decorate=with_status, extra_fields=("status", "slot"), default_fields=default_fields)
+
+@app.route('/file-owner', methods=['GET'])
+def file_owner():
+    """Which processes hold a processing file: ?filename=xyz_abcd123456.zip (&max_age=<seconds>)."""
+    filename = request.args.get('filename', '')
+    if not filename:
+        return jsonify({"status": "error", "message": "filename is required"}), 400
+    snap = proc_index.snapshot(max_age=requested_max_age())
+    active_perl = get_perl_processes(snap)
+    procs = [{"pid": pid, "name": snap.procs[pid].name, "username": snap.procs[pid].username,
+              "cmdline": snap.procs[pid].cmdline, "job": pid in active_perl}
+             for pid in sorted(file_owners.owners(snap, filename)) if pid in snap.procs]
+    return jsonify({"filename": filename, "in_processing": filename in target_watch.entries(),
+                    "slot": target_watch.slot_of(filename),
+                    "status": "Processing" if any(p["job"] for p in procs) else "Idle",
+                    "processes": procs, "snapshot_age": round(snap.age(), 2)})
 
 @app.route('/kill-delete', methods=['POST'])
 def handle_kill():
+    """
+    Queues the kill-and-delete and returns its job id right away (see /kill-status). Only that
+    file's job is stopped; with "slot" the file must be in that slot.
+    """
     filename = request.json.get('filename')
-    success = kill_sequence(filename)
-    return jsonify({"status": "success" if success else "error"})
+    slot = request.json.get('slot')
+    if slot is not None and target_watch.slot_of(filename) != slot:
+        return jsonify({"status": "error", "message": f"{filename} is not in slot {slot}"}), 404
+    job = kill_jobs.submit(filename)
+    return jsonify({"status": "queued", "job_id": job["job_id"], "job": job}), 202
+
+@app.route('/kill-status/<job_id>', methods=['GET'])
+def kill_status(job_id):
+    job = kill_jobs.get(job_id)
+    if not job:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify(job)
 
 @app.route('/folders', methods=['GET'])
 def list_secondary_folders():
-    folder_path = config['secondary_folder']
-    folders = []
-    if os.path.exists(folder_path):
-        # List only directories, not files
-        folders = [d for d in os.listdir(folder_path) if os.path.isdir(os.path.join(folder_path, d))]
-    return jsonify({"server": socket.gethostname(), "folders": folders})
+    # The watcher only tracks directories and run archives (<run>.zip), not other files
+    return listed(secondary_list, secondary_watch.etag(), "folders", {"server": socket.gethostname()}, names_only=True)
 
-@app.route('/get-log', methods=['POST'])
-def get_log():
-    filename = request.json.get('filename') # e.g., xyz_abcd123456.zip
-    try:
-        # 1. Extract segment (assumes format xyz_SEGMENT_numbers.zip)
-        # Using abcd123 logic: split by underscore, take second part
-        parts = filename.split('_')
-        if len(parts) < 2: return jsonify({"log": "Invalid filename format"})
-        segment = parts[1][:7] # Take the 'abcd123' part
+def read_log(log_path, body, member=None):
+    """
+    Last `lines` (default 50) lines of a log, or with "since": <offset> (and the "file_id" from the
+    previous answer) only the bytes appended since then. Either way the answer carries the new
+    offset/file_id, and rotated=True when the client must replace rather than append.
+    With `member`, log_path is a run archive and the log is read from inside it.
+    """
+    if member is not None:
+        if body.get('since') is not None:
+            return log_tail.read_since_archived(log_path, member, int(body['since']), body.get('file_id'))
+        return log_tail.tail_archived(log_path, member, int(body.get('lines', 50)))
+    if body.get('since') is not None:
+        return log_tail.read_since(log_path, int(body['since']), body.get('file_id'))
+    return log_tail.tail(log_path, int(body.get('lines', 50)))
 
-        # 2. Search for folders containing that segment
-        search_path = os.path.join(config['log_search_root'], f"*{segment}*")
-        folders = [d for d in glob.glob(search_path) if os.path.isdir(d)]
+def run_log_source(folder_name):
+    """
+    (path, member) of a run's proglogs.txt: (log file, None) while the run is a folder,
+    (archive, member) once retention has compressed it, (None, None) if neither exists.
+    """
+    run_path = os.path.join(config['secondary_folder'], folder_name)
+    log_path = os.path.join(run_path, "log", "db", "proglogs.txt")
+    if os.path.exists(log_path):
+        return log_path, None
+    # Listings show archived runs by their archive name, older links use the folder name
+    archive = run_path if run_path.endswith(ARCHIVE_SUFFIX) else run_path + ARCHIVE_SUFFIX
+    if os.path.isfile(archive):
+        return archive, LOG_MEMBER
+    return None, None
 
-        if not folders:
-            return jsonify({"log": f"No folder found for segment: {segment}"})
+def find_job_log(filename):
+    """Returns (log_file, run_folder, error) for a processing file such as xyz_abcd123456.zip."""
+    # 1. Extract segment (assumes format xyz_SEGMENT_numbers.zip)
+    # Using abcd123 logic: split by underscore, take second part
+    parts = filename.split('_')
+    if len(parts) < 2: return None, None, "Invalid filename format"
+    segment = parts[1][:7] # Take the 'abcd123' part
 
-        # 3. Get latest folder
-        latest_folder = max(folders, key=os.path.getmtime)
+    # 2. Look up the latest folder containing that segment (index, no directory scan)
+    with span("log_folder_lookup"):
+        latest_folder = segment_index.latest_for(segment)
 
-        # 4. Construct path to proglogs.txt
-        log_file = os.path.join(latest_folder, "log", "db", "proglogs.txt")
+    if not latest_folder:
+        return None, None, f"No folder found for segment: {segment}"
 
-        if not os.path.exists(log_file):
-            return jsonify({"log": f"Log file not found at: {log_file}"})
+    # 4. Construct path to proglogs.txt
+    log_file = os.path.join(latest_folder, "log", "db", "proglogs.txt")
 
-        # 5. Read last 50 lines (or 5-10 for the box)
-        with open(log_file, 'r') as f:
-            lines = deque(f, 50) # Efficiently get last 50 lines
-            return jsonify({"log": "".join(lines), "folder": os.path.basename(latest_folder)})
+    if not os.path.exists(log_file):
+        return None, latest_folder, f"Log file not found at: {log_file}"
+    return log_file, latest_folder, None
+
+@app.route('/get-log', methods=['POST'])
+def get_log():
+    filename = request.json.get('filename') # e.g., xyz_abcd123456.zip
+    try:
+        log_file, latest_folder, error = find_job_log(filename)
+        if error:
+            return jsonify({"log": error})
+
+        # 5. Read last 50 lines, or only what was appended since the client's last offset
+        result = read_log(log_file, request.json)
+        result["folder"] = os.path.basename(latest_folder)
+        return jsonify(result)
 
     except Exception as e:
         return jsonify({"log": f"Error: {str(e)}"})
 
-@app.route('/get-queue', methods=['GET'])
-def get_queue():
-    """Lists files in the separate Queue Folder."""
-    queue_path = config['queue_folder']
-    files = []
-    if os.path.exists(queue_path):
-        for f in os.listdir(queue_path):
-            if os.path.isfile(os.path.join(queue_path, f)):
-                files.append({"name": f})
-    return jsonify({"files": files})
-
 @app.route('/delete-from-queue', methods=['POST'])
 def delete_from_queue():
     """Deletes a file from the separate Queue Folder."""
@@ -150,6 +433,8 @@ def delete_from_queue():
     try:
         if os.path.exists(file_path):
             os.remove(file_path)
+            DELETES.inc(kind="queue_file")
+            queue_watch.rescan()
             return jsonify({"status": "success"})
         return jsonify({"status": "error", "message": "File not found"}), 404
     except Exception as e:
@@ -162,86 +447,270 @@ def delete_folder():
     target_path = os.path.join(config['secondary_folder'], folder_name)
     
     try:
-        if os.path.exists(target_path) and os.path.isdir(target_path):
-            shutil.rmtree(target_path) # Deletes folder and all contents
-            return jsonify({"status": "success"})
+        if os.path.isdir(target_path) or (target_path.endswith(ARCHIVE_SUFFIX) and os.path.isfile(target_path)):
+            # Renamed into the trash right away; the contents are removed in the background
+            batch = trash_reaper.trash([target_path], label="delete-folder")
+            if batch["failed"]:
+                return jsonify({"status": "error", "message": batch["failed"][folder_name]}), 500
+            DELETES.inc(kind="run_folder")
+            secondary_watch.rescan()
+            return jsonify({"status": "success", "batch_id": batch["batch_id"]})
         return jsonify({"status": "error", "message": "Folder not found"}), 404
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
+BATCH_TARGETS = {"queue": ('queue_folder', queue_watch, "queue_file"),
+                 "folders": ('secondary_folder', secondary_watch, "run_folder"),
+                 "processing": ('target_folder', target_watch, None)}
+
+def resolve_batch(watcher, names, patterns):
+    """Names of the watched folder selected by exact names and/or glob patterns, plus unknown names."""
+    entries = watcher.entries()
+    selected, missing = {}, []
+    for name in names:
+        # Plain names only: nothing outside the watched folder can be selected
+        if name in entries and os.path.basename(name) == name:
+            selected[name] = None
+        else:
+            missing.append(name)
+    for pattern in patterns:
+        for name in fnmatch.filter(entries, pattern):
+            selected[name] = None
+    return list(selected), missing
+
+@app.route('/batch-delete', methods=['POST'])
+def batch_delete():
+    """
+    Deletes many items in one call:
+      {"target": "queue"|"folders"|"processing", "names": [...], "patterns": ["xyz_*.zip", ...]}
+    Queue files and run folders are moved into the trash before this returns and removed in the
+    background (progress at /batch-status/<batch_id>); processing files each get a kill-and-delete
+    job (see /kill-status).
+    """
+    body = request.json or {}
+    target = body.get('target')
+    if target not in BATCH_TARGETS:
+        return jsonify({"status": "error", "message": f"target must be one of {', '.join(BATCH_TARGETS)}"}), 400
+    names, patterns = body.get('names') or [], body.get('patterns') or []
+    if not isinstance(names, list) or not isinstance(patterns, list) or not (names or patterns):
+        return jsonify({"status": "error", "message": "names and/or patterns (lists) are required"}), 400
+
+    key, watcher, kind = BATCH_TARGETS[target]
+    selected, missing = resolve_batch(watcher, names, patterns)
+    if target == "processing":
+        jobs = {name: kill_jobs.submit(name)["job_id"] for name in selected}
+        return jsonify({"status": "queued", "jobs": jobs, "missing": missing}), 202
+
+    batch = trash_reaper.trash([os.path.join(config[key], name) for name in selected], label=target)
+    DELETES.inc(len(batch["moved"]), kind=kind)
+    watcher.rescan()
+    return jsonify({"status": "queued", "batch_id": batch["batch_id"], "moved": batch["moved"],
+                    "failed": batch["failed"], "missing": missing, "batch": batch}), 202
+
+@app.route('/batch-status/<batch_id>', methods=['GET'])
+def batch_status(batch_id):
+    batch = trash_reaper.get(batch_id)
+    if not batch:
+        return jsonify({"status": "error", "message": "Unknown batch"}), 404
+    return jsonify(batch)
+
 @app.route('/get-log-from-folder', methods=['POST'])
 def get_log_from_folder():
     folder_name = request.json.get('folder_name')
-    # Path: secondary_folder / folder_name / log / db / proglogs.txt
-    log_path = os.path.join(config['secondary_folder'], folder_name, "log", "db", "proglogs.txt")
+    # Path: secondary_folder / folder_name / log / db / proglogs.txt, or inside secondary_folder / folder_name.zip
+    log_path, member = run_log_source(folder_name)
     
     try:
-        if os.path.exists(log_path):
-            with open(log_path, 'r') as f:
-                lines = deque(f, 50)
-                return jsonify({"log": "".join(lines), "path": log_path})
+        if log_path:
+            # Archived logs are stored uncompressed, so this seeks straight to the tail inside the zip
+            result = read_log(log_path, request.json, member)
+            result["path"] = f"{log_path}!{member}" if member else log_path
+            result["archived"] = member is not None
+            return jsonify(result)
         return jsonify({"log": "proglogs.txt not found in this folder structure."})
+    except KeyError:
+        return jsonify({"log": "proglogs.txt not found in this run archive."})
     except Exception as e:
         return jsonify({"log": f"Error reading log: {str(e)}"})
 
+@app.route('/search-logs', methods=['GET'])
+def search_logs():
+    """
+    Full-text search over the indexed run logs: ?q=<words>&limit=100&context=2&folder=<glob>&exact=1.
+    Every word must appear on the line (case-insensitive); exact=1 also requires the whole phrase.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({"status": "error", "message": "q is required"}), 400
+    started = time.perf_counter()
+    results = log_index.search(query, limit=min(request.args.get('limit', 100, type=int), 1000),
+                               context=max(0, min(request.args.get('context', 2, type=int), 10)),
+                               folder=request.args.get('folder') or None,
+                               exact=request.args.get('exact', '') in ('1', 'true', 'yes'))
+    return jsonify({"server": socket.gethostname(), "query": query, "results": results,
+                    "took_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "index": log_index.stats()})
+
+@app.route('/retention', methods=['GET'])
+def retention_status():
+    """Retention policy in force, the last pass, totals and the latest archived/deleted runs."""
+    return jsonify(retention.status())
+
+@app.route('/retention/run', methods=['POST'])
+def retention_run():
+    """Starts a retention pass now instead of at the next interval."""
+    if not retention.settings["enabled"]:
+        return jsonify({"status": "error", "message": "retention is not enabled in config.json"}), 409
+    retention.run_now()
+    return jsonify({"status": "queued"}), 202
+
 @app.route('/disk-usage', methods=['GET'])
 def disk_usage():
-    stats = {}
-    for drive in ['C:', 'D:']:
-        try:
-            usage = psutil.disk_usage(drive)
-            stats[drive] = {
-                "total": round(usage.total / (1024**3), 1), # GB
-                "used": round(usage.used / (1024**3), 1),   # GB
-                "free": round(usage.free / (1024**3), 1),   # GB
-                "percent": usage.percent
-            }
-        except:
-            stats[drive] = None # Drive might not exist
-    return jsonify(stats)
+    # Latest background sample (GB); None if the drive does not exist
+    usage = {drive: host_metrics.disk(drive) for drive in host_metrics.mounts}
+    for drive, du in usage.items():
+        if du is not None:
+            # Space the trash reaper has released on this drive since the agent started
+            du["trash_freed_gb"] = round(trash_reaper.freed_on(drive) / (1024**3), 3)
+    return jsonify(usage)
+
+@app.route('/host-metrics', methods=['GET'])
+def host_metrics_latest():
+    """Latest sample of every host metric, plus the history tiers available."""
+    ts, sample = host_metrics.latest()
+    return jsonify({"at": ts, "interval": host_metrics.interval,
+                    "values": {k: (None if v != v else round(v, 3)) for k, v in sample.items()},
+                    "tiers": {name: {"step": t.step or host_metrics.interval, "rows": len(t), "capacity": t.capacity}
+                              for name, t in host_metrics.tiers.items()}})
+
+@app.route('/host-metrics/history', methods=['GET'])
+def host_metrics_history():
+    """
+    One history window as columns: ?tier=raw|1m|5m|1h&since=<epoch>&fields=a,b.
+    ?format=binary returns column-major little-endian float64 ("t" first, NaN = no data)
+    with the column order in X-Metrics-Fields and the row count in X-Metrics-Rows.
+    """
+    tier = request.args.get('tier', 'raw')
+    fields = [f for f in request.args.get('fields', '').split(',') if f] or None
+    try:
+        cols = host_metrics.history(tier, request.args.get('since', type=float), fields)
+    except KeyError:
+        return jsonify({"error": f"Unknown tier {tier}", "tiers": list(host_metrics.tiers)}), 400
+    if request.args.get('format') == 'binary':
+        return Response(columns_to_bytes(cols), mimetype='application/octet-stream',
+                        headers={"X-Metrics-Fields": ",".join(cols), "X-Metrics-Rows": str(len(cols["t"]))})
+    return jsonify({"tier": tier, "columns": columns_to_json(cols)})
 
 @app.route('/get-queue', methods=['GET'])
 def get_queue():
-    """Lists files in the separate Queue Folder and returns count."""
-    queue_path = config['queue_folder']
-    files = []
-    if os.path.exists(queue_path):
-        for f in os.listdir(queue_path):
-            if os.path.isfile(os.path.join(queue_path, f)):
-                files.append({"name": f})
-    
-    return jsonify({
-        "files": files,
-        "total_count": len(files)
-    })
+    """Lists files in the separate Queue Folder and returns count (?count_only=1 for just the counts)."""
+    return listed(queue_list, queue_watch.etag(), "files")
 
 import shutil
 
 @app.route('/check-ready', methods=['GET'])
 def check_ready():
-    """Returns true if the target processing folder is empty."""
-    path = config['target_folder']
-    if not os.path.exists(path):
-        return jsonify({"ready": True})
-    # Check if directory is empty
-    is_empty = len(os.listdir(path)) == 0
-    return jsonify({"ready": is_empty})
+    """
+    Free job slots (ready = at least one), each slot's state, plus the live load figures the
+    dispatcher ranks servers by (running jobs/SAS sessions, free disk, recent job durations).
+    With one slot this is the old rule: ready when the processing folder is empty and no job runs.
+    """
+    snap = proc_index.snapshot(max_age=requested_max_age())
+    active_perl = get_perl_processes(snap)
+    jobs_running = len(active_perl)
+    sas_running = len(target_procs(snap, config['sas_process']))
+    owners = file_owners.owners_map(snap)
+    slots = target_watch.status()
+    for slot in slots:
+        if any(active_perl & owners.get(f, set()) for f in slot["files"]):
+            slot["state"] = "processing"
+        else:
+            slot["state"] = "idle" if slot["files"] else "reserved" if slot["reserved"] else "free"
+    # An empty slot whose job is still winding down is not free yet
+    free_slots = max(0, min(len(target_watch.free()), target_watch.count - jobs_running))
+    try:
+        disk_free_gb = round(psutil.disk_usage(config['target_folder']).free / (1024**3), 1)
+    except Exception:
+        disk_free_gb = None
+    durations = list(recent_job_seconds)
+    return jsonify({
+        "ready": free_slots > 0,
+        "job_slots": target_watch.count,
+        "free_slots": free_slots,
+        "slots": slots,
+        "jobs_running": jobs_running,
+        "sas_running": sas_running,
+        "files_in_processing": len(target_watch.entries()),
+        "disk_free_gb": disk_free_gb,
+        "avg_job_seconds": round(sum(durations) / len(durations), 1) if durations else None,
+        "snapshot_age": round(snap.age(), 2)
+    })
 
 @app.route('/receive-push', methods=['POST'])
 def receive_push():
-    """Receives a file moved from the Queue."""
+    """Receives a file moved from the Queue into a free job slot (or the one given as "slot")."""
     data = request.json
     filename = data.get('filename')
     source_path = os.path.join(config['queue_folder'], filename)
-    dest_path = os.path.join(config['target_folder'], filename)
     
     try:
         if os.path.exists(source_path):
-            shutil.move(source_path, dest_path)
-            return jsonify({"success": True, "message": f"Moved to {socket.gethostname()}"})
+            # The slot stays reserved until the file is in it, so concurrent pushes never share one
+            with target_watch.reserve(data.get('slot')) as slot:
+                if slot is None and target_watch.count > 1:
+                    return jsonify({"success": False, "message": "No free job slot"}), 409
+                # A single slot keeps the old behaviour and takes the file even when busy
+                slot = slot or 1
+                # Chunked, checksummed and resumable when queue and processing are on different volumes
+                stats = transfer_file(source_path, target_watch.path_of(filename, slot), **transfer_options(config))
+                queue_watch.rescan()
+                target_watch.rescan()
+            return jsonify({"success": True, "message": f"Moved to {socket.gethostname()}", "slot": slot,
+                            "transfer": stats})
         return jsonify({"success": False, "message": "Source file missing"}), 404
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
 
+def log_follower(log_path):
+    """Returns a callable that yields the lines appended to log_path since the last call."""
+    follower = log_tail.LogFollower(log_path)
+
+    def poll():
+        result = follower.poll()
+        if not result:
+            return []
+        # offset/file_id let the page continue with /get-log "since" from where the stream left off
+        return [("log_lines", {"path": log_path, "lines": result["log"].splitlines(), "rotated": result["rotated"],
+                               "offset": result["offset"], "file_id": result["file_id"]})]
+    return poll
+
+@app.route('/events', methods=['GET'])
+def events():
+    """
+    Server-Sent Events stream: file_added / file_removed (processing and queue folders),
+    job_status, disk_threshold, and - with ?filename= or ?folder_name= - log_lines for that log.
+    """
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    follow = None
+    if request.args.get('filename'):
+        log_file, _, _ = find_job_log(request.args['filename'])
+        if log_file:
+            follow = log_follower(log_file)
+    elif request.args.get('folder_name'):
+        log_path, member = run_log_source(request.args['folder_name'])
+        # An archived run's log no longer grows: nothing to follow
+        if member is None:
+            follow = log_follower(log_path or os.path.join(config['secondary_folder'], request.args['folder_name'],
+                                                           "log", "db", "proglogs.txt"))
+
+    stream = event_bus.stream(last_id, extra=follow)
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=config['agent_port'])
+    # Kills, deletes, transfers and log reads get their own workers so they can't starve the polls
+    serve(app, config['agent_port'], service="agent", settings=config.get('server'),
+          slow_paths=('/kill-delete', '/delete-from-queue', '/delete-folder', '/batch-delete',
+                      '/receive-push', '/get-log', '/get-log-from-folder'),
+          stream_paths=('/events',),
+          ready_check=lambda: target_watch.exists())
@@ -1,7 +1,12 @@
 import os
-import shutil
+import sys
+import time
+import heapq
 import json
 import logging
+from concurrent.futures import ThreadPoolExecutor, wait
+from transfer import transfer_file, transfer_options, remove_abandoned, ABANDONED_AFTER, IGNORED_SUFFIXES
+from slots import slot_folders
 
 CONFIG_FILE = "config.json"
 
@@ -15,13 +20,168 @@ def setup_logging(log_path):
         ]
     )
 
-def distribute():
+def load_config():
     if not os.path.exists(CONFIG_FILE):
         print("Error: config.json not found.")
-        return
-
+        return None
     with open(CONFIG_FILE, 'r') as f:
-        config = json.load(f)
+        return json.load(f)
+
+def slots_for(config, ip):
+    """Job slots of one server: "job_slots" as one number for all, or {"<ip>": n} per server."""
+    slots = config.get('job_slots', 1)
+    if isinstance(slots, dict):
+        slots = slots.get(ip, 1)
+    return max(1, int(slots))
+
+def probe_destination(dest_path, slots=1, prefix="slot", abandoned_after=ABANDONED_AFTER):
+    """
+    Empty job slot folders of a server's share (the share itself for one slot, else its
+    <prefix>1..N sub-folders): [] when every slot holds a file, None when the share is unreachable.
+    Leftovers of a failed transfer untouched for `abandoned_after` seconds are removed, so they
+    do not keep a slot busy; a transfer still writing does.
+    """
+    if not os.path.exists(dest_path):
+        return None
+    free = []
+    for folder in slot_folders(dest_path, slots, prefix).values():
+        try:
+            if not remove_abandoned(folder, abandoned_after):
+                free.append(folder)
+        except FileNotFoundError:
+            continue  # Slot the agent has not created yet
+    return free
+
+def status_of(free):
+    return "offline" if free is None else "free" if free else "busy"
+
+class Prober:
+    """
+    Probes every server's share at the same time. A probe that exceeds `timeout` reports the
+    server as offline; its thread is left to finish on its own (SMB calls cannot be cancelled)
+    and that server is not probed again until it does, so hung shares never pile up threads.
+    """
+
+    def __init__(self, servers, folder, timeout=3.0, slots=None, prefix="slot", abandoned_after=ABANDONED_AFTER):
+        self.servers = servers
+        self.folder = folder
+        self.timeout = timeout
+        self.slots = slots or {}    # ip -> job slots (1 if missing)
+        self.prefix = prefix
+        self.abandoned_after = abandoned_after
+        self.pool = ThreadPoolExecutor(max_workers=len(servers) * 2 or 1, thread_name_prefix="probe")
+        self.pending = {}   # ip -> future still running from an earlier round
+
+    def dest_path(self, ip):
+        return rf"\\{ip}\{self.folder}"
+
+    def probe_all(self):
+        """{ip: free slot folders ([] if all busy), or None if offline}."""
+        futures = {}
+        for ip in self.servers:
+            if ip in self.pending and not self.pending[ip].done():
+                continue  # Previous probe still hanging
+            futures[ip] = self.pool.submit(probe_destination, self.dest_path(ip), self.slots.get(ip, 1), self.prefix,
+                                           self.abandoned_after)
+        wait(futures.values(), timeout=self.timeout)
+
+        status = {}
+        for ip in self.servers:
+            future = futures.get(ip)
+            if future is None or not future.done():
+                self.pending[ip] = future or self.pending[ip]
+                status[ip] = None
+                continue
+            self.pending.pop(ip, None)
+            try:
+                status[ip] = future.result()
+            except Exception as e:
+                logging.error(f"FAILED: Error communicating with {ip}: {str(e)}")
+                status[ip] = None
+        return status
+
+class SourceQueue:
+    """
+    FIFO of source files (oldest creation time first) kept as a heap. The source folder is only
+    re-listed when its mtime changes, and then only new names are pushed. Popped files stay
+    `in_flight` (and are never pushed again) until done() or push_back() is called for them, so
+    a file whose move is still running is not handed out a second time.
+    """
+
+    def __init__(self, src):
+        self.src = src
+        self.heap = []
+        self.known = set()
+        self.in_flight = set()
+        self.dir_mtime = None
+
+    def refresh(self):
+        try:
+            dir_mtime = os.stat(self.src).st_mtime_ns
+        except OSError:
+            return
+        if dir_mtime == self.dir_mtime:
+            return
+        self.dir_mtime = dir_mtime
+        current = set()
+        with os.scandir(self.src) as it:
+            for e in it:
+                if not e.is_file() or e.name.endswith(IGNORED_SUFFIXES):
+                    continue
+                current.add(e.name)
+                if e.name not in self.known and e.name not in self.in_flight:
+                    try:
+                        heapq.heappush(self.heap, (e.stat().st_ctime, e.name))
+                    except OSError:
+                        continue
+        # Names that left the folder are dropped lazily when they reach the top of the heap
+        self.known = current
+
+    def pop(self):
+        """Oldest file still present in the source folder, or None."""
+        while self.heap:
+            ctime, name = heapq.heappop(self.heap)
+            path = os.path.join(self.src, name)
+            if name in self.known and name not in self.in_flight and os.path.exists(path):
+                self.known.discard(name)
+                self.in_flight.add(name)
+                return path
+            self.known.discard(name)
+        return None
+
+    def done(self, path):
+        """The move of a popped file finished (it left the source folder)."""
+        self.in_flight.discard(os.path.basename(path))
+
+    def push_back(self, path):
+        """Returns a file that could not be moved to the front of the queue."""
+        name = os.path.basename(path)
+        self.in_flight.discard(name)
+        try:
+            heapq.heappush(self.heap, (os.path.getctime(path), name))
+            self.known.add(name)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self.known)
+
+def move_file(file_to_move, dest_path, ip, config=None):
+    """Chunked, checksummed move: the server only sees the file once it is complete."""
+    file_name = os.path.basename(file_to_move)
+    transfer_file(file_to_move, os.path.join(dest_path, file_name), **transfer_options(config or {}))
+    logging.info(f"SUCCESS: {file_name} -> {ip}")
+
+def make_prober(config):
+    return Prober(config['servers'], config['target_folder_name'], config.get('probe_timeout', 3.0),
+                  slots={ip: slots_for(config, ip) for ip in config['servers']},
+                  prefix=config.get('slot_folder_prefix', 'slot'),
+                  abandoned_after=config.get('transfer', {}).get('abandoned_after', ABANDONED_AFTER))
+
+def distribute():
+    config = load_config()
+    if config is None:
+        return
 
     setup_logging(config.get('log_file', 'distributor.log'))
     
@@ -34,37 +194,104 @@ def distribute():
         return
 
     # FIFO: Get files sorted by creation time
-    files = sorted([os.path.join(src, f) for f in os.listdir(src) 
-                   if os.path.isfile(os.path.join(src, f))], key=os.path.getctime)
+    queue = SourceQueue(src)
+    queue.refresh()
 
-    if not files:
+    if not len(queue):
         logging.info("No files found in source. Exiting.")
         return
 
-    for ip in servers:
-        if not files:
-            break
-        
-        dest_path = rf"\\{ip}\{folder}"
-        
+    # Probe all servers at once so one unreachable share doesn't delay the others
+    prober = make_prober(config)
+    for ip, free in prober.probe_all().items():
+        status = status_of(free)
+        if status == "free":
+            # One file per empty job slot
+            for dest_path in free:
+                file_to_move = queue.pop()
+                if file_to_move is None:
+                    break
+                try:
+                    move_file(file_to_move, dest_path, ip, config)
+                except Exception as e:
+                    logging.error(f"FAILED: Error communicating with {ip}: {str(e)}")
+            if not len(queue):
+                break
+        elif status == "busy":
+            logging.info(f"SKIP: Server {ip} is currently busy (every job slot holds a file).")
+        else:
+            logging.warning(f"OFFLINE: Cannot reach {prober.dest_path(ip)}")
+
+def run_daemon():
+    """
+    Long-running distributor: every `daemon_interval` seconds (default 1) it probes all servers
+    concurrently and hands the oldest queued file to each free job slot, so a finished job is
+    replaced within about a second instead of at the next scheduled run.
+    """
+    config = load_config()
+    if config is None:
+        return
+
+    setup_logging(config.get('log_file', 'distributor.log'))
+    interval = config.get('daemon_interval', 1.0)
+    queue = SourceQueue(config['source_path'])
+    prober = make_prober(config)
+    movers = ThreadPoolExecutor(max_workers=sum(prober.slots.values()) or 1, thread_name_prefix="move")
+    moving = {}         # slot folder -> future of the move in progress
+    last_status = {}
+
+    logging.info(f"Distributor daemon started for {len(config['servers'])} servers")
+    while True:
+        started = time.monotonic()
         try:
-            # Check if destination is accessible and empty
-            if os.path.exists(dest_path):
-                if not os.listdir(dest_path):
-                    file_to_move = files.pop(0)
-                    file_name = os.path.basename(file_to_move)
-                    
-                    shutil.move(file_to_move, os.path.join(dest_path, file_name))
-                    logging.info(f"SUCCESS: {file_name} -> {ip}")
-                else:
-                    logging.info(f"SKIP: Server {ip} is currently busy (folder not empty).")
-            else:
-                logging.warning(f"OFFLINE: Cannot reach {dest_path}")
+            # Failed moves go back to the front of the queue (heap ops stay on this thread)
+            for dest_path, future in list(moving.items()):
+                if future.done():
+                    del moving[dest_path]
+                    file_to_move, ok = future.result()
+                    if not ok and os.path.exists(file_to_move):
+                        queue.push_back(file_to_move)
+                    else:
+                        queue.done(file_to_move)
+
+            queue.refresh()
+            if queue.heap:
+                for ip, free in prober.probe_all().items():
+                    status = status_of(free)
+                    if status != last_status.get(ip):
+                        logging.info(f"STATUS: {ip} is {status}")
+                        last_status[ip] = status
+                    # Every empty slot that no move is already filling gets the next file
+                    for dest_path in free or ():
+                        if dest_path in moving:
+                            continue
+                        file_to_move = queue.pop()
+                        if file_to_move is None:
+                            break
+                        moving[dest_path] = movers.submit(dispatch, file_to_move, dest_path, ip, config)
         except Exception as e:
-            logging.error(f"FAILED: Error communicating with {ip}: {str(e)}")
+            logging.error(f"Distributor cycle failed: {e}")
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+def dispatch(file_to_move, dest_path, ip, config):
+    """Runs on the mover pool; returns (path, moved_ok)."""
+    try:
+        move_file(file_to_move, dest_path, ip, config)
+        return file_to_move, True
+    except Exception as e:
+        logging.error(f"FAILED: Error communicating with {ip}: {str(e)}")
+        return file_to_move, False
 
 if __name__ == "__main__":
-    distribute()
+    # "python Distribution.py --daemon" keeps running; without it, one pass (Schedule.bat)
+    # "--api" runs the load-aware dispatcher that talks to the agents' HTTP API (dispatcher.py)
+    if "--api" in sys.argv[1:]:
+        import dispatcher
+        dispatcher.run()
+    elif "--daemon" in sys.argv[1:]:
+        run_daemon()
+    else:
+        distribute()
 
 {
     "source_path": "C:/MySourceFiles",
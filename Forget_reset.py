@@ -1,10 +1,19 @@
-import random
-import string
-import smtplib
-from email.mime.text import MIMEText
+import secrets
+from db_pool import SQLitePool
+from mail_queue import MailQueue
+from token_store import token_store_from_config
 
-# Global dictionary to store temporary reset tokens (clears on app restart)
-reset_tokens = {}
+# Reset tokens expire after "ttl" seconds and the store is bounded; "backend": "sqlite" shares
+# them between worker processes and keeps them across restarts (config: "reset_tokens")
+reset_tokens = token_store_from_config(load_config().get('reset_tokens'))
+
+# User/PIN lookups reuse one connection per worker thread instead of opening one per request
+db_pool = SQLitePool(get_db_connection)
+
+# Reset emails are sent in the background, retried, and dead-lettered if undeliverable (config: "mail_queue")
+_smtp = load_config()['smtp_settings']
+mail_queue = MailQueue.from_config(dict(_smtp, starttls=_smtp.get('starttls', False)),  # set true if your relay uses TLS
+                                   load_config().get('mail_queue', {"dead_letter": "mail_dead_letter.jsonl"}))
 
 @app.route('/forgot-pin', methods=['GET', 'POST'])
 def forgot_pin():
@@ -16,34 +25,26 @@ def forgot_pin():
             return render_template('login.html')
 
         user = request.form.get('username').strip().lower()
-        db = get_db_connection()
-        record = db.execute('SELECT email FROM users WHERE username = ?', (user,)).fetchone()
-        db.close()
+        with db_pool.connection() as db:
+            record = db.execute('SELECT email FROM users WHERE username = ?', (user,)).fetchone()
 
         if record and record['email']:
             session['reset_attempts'] = attempts + 1
             
             # Generate 6-digit random token
-            token = ''.join(random.choices(string.digits, k=6))
-            reset_tokens[user] = token
+            token = ''.join(secrets.choice('0123456789') for _ in range(6))
+            reset_tokens.put(user, token)
             
-            # --- SMTP EMAIL SENDING ---
+            # --- EMAIL (queued; delivered in the background) ---
             try:
-                config = load_config()['smtp_settings']
-                msg = MIMEText(f"Hello,\n\nYour 6-digit security token to reset your Process Monitor PIN is: {token}\n\nThis token will expire if the server restarts.")
-                msg['Subject'] = 'PIN Reset Token - Process Monitor'
-                msg['From'] = config['sender']
-                msg['To'] = record['email']
-
-                with smtplib.SMTP(config['server'], config['port']) as server:
-                    # server.starttls() # Uncomment if your relay uses TLS
-                    # server.login("svc_user", "password") # Uncomment if relay requires auth
-                    server.send_message(msg)
+                minutes = max(1, reset_tokens.ttl // 60)
+                mail_queue.enqueue(record['email'], 'PIN Reset Token - Process Monitor',
+                                   f"Hello,\n\nYour 6-digit security token to reset your Process Monitor PIN is: {token}\n\nThis token expires in {minutes} minutes.")
                 
                 flash(f"A 6-digit token has been sent to {record['email']}")
                 return render_template('reset_confirm.html', username=user)
             except Exception as e:
-                print(f"SMTP Error: {e}")
+                print(f"Mail queue error: {e}")
                 flash("Error sending email. Please check server logs.")
         else:
             flash("User ID not found or account never initialized.")
@@ -57,7 +58,7 @@ def reset_confirm():
     new_pin = request.form.get('new_pin').strip()
 
     # Verify Token
-    if reset_tokens.get(user) == token:
+    if reset_tokens.verify(user, token):
         # Check PIN Complexity
         is_ok, err = is_valid_pin_strict(new_pin)
         if not is_ok:
@@ -65,14 +66,12 @@ def reset_confirm():
             return render_template('reset_confirm.html', username=user)
 
         # Update Database
-        db = get_db_connection()
         hashed_pin = hashlib.sha256(new_pin.encode()).hexdigest()
-        db.execute('UPDATE users SET pin_hash = ? WHERE username = ?', (hashed_pin, user))
-        db.commit()
-        db.close()
+        with db_pool.connection() as db:
+            db.execute('UPDATE users SET pin_hash = ? WHERE username = ?', (hashed_pin, user))
         
         # Cleanup
-        reset_tokens.pop(user, None)
+        reset_tokens.discard(user)
         flash("PIN updated successfully! You can now login.")
         return redirect(url_for('login'))
     else:
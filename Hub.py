@@ -1,19 +1,41 @@
 import os
-import json
+import threading
+from contextlib import contextmanager
 import win32api
-import win32security
-from flask import Flask, render_template, g, abort, jsonify
+from flask import Flask, render_template, g, abort, jsonify, request, Response, stream_with_context
+from fleet import FleetClient
+from events import EventBus, EventRelay
+from config_service import get_service
+from listing import gzip_responses
+from instrument import instrument_app
+from serve import serve, PROBE_PATHS
+from authz import Authorizer, TokenBackend, cache_from_config, groups_from_config
 
 app = Flask(__name__)
 
 # --- CONFIGURATION LOADER ---
+# Parsed once, re-read in the background only when the file changes; a bad edit keeps the last good config
+config_service = get_service(os.path.join(os.path.dirname(__file__), 'config.json'), required=('servers',))
+
 def load_config():
-    """Load configuration from the central JSON file."""
-    config_path = os.path.join(os.path.dirname(__file__), 'config.json')
-    with open(config_path, 'r') as f:
-        return json.load(f)
+    """Current configuration from the central JSON file (in memory, no disk read)."""
+    return config_service.get()
+
+# /metrics (Prometheus) plus per-endpoint latency; /debug/profile only while "profiling" is true in config.json
+instrument_app(app, "hub", profiling_enabled=lambda: load_config().get('profiling', False))
+gzip_responses(app)
 
 # --- AD AUTHENTICATION LOGIC ---
+_authorizer = None
+
+def get_authorizer(config):
+    """Shared Authorizer (decision cache + token backend); rebuilt if the group list changes."""
+    global _authorizer
+    groups = groups_from_config(config)
+    if _authorizer is None or _authorizer.groups != groups:
+        _authorizer = Authorizer(TokenBackend(), groups, cache_from_config(config))
+    return _authorizer
+
 def verify_ad_access():
     """
     Check if the current Windows user belongs to the 
@@ -28,27 +50,10 @@ def verify_ad_access():
     try:
         # Get the username of the person accessing the app
         current_user = win32api.GetUserName()
-        authorized_groups = config['auth'].get('ad_groups', [])
-
-        # Open the access token for the current process
-        token = win32security.OpenProcessToken(
-            win32api.GetCurrentProcess(), 
-            win32security.TOKEN_QUERY
-        )
-        
-        # Retrieve all Group SIDs associated with this token
-        groups = win32security.GetTokenInformation(token, win32security.TokenGroups)
-
-        for (sid, attributes) in groups:
-            try:
-                # Convert SID to readable Name and Domain
-                name, domain, type = win32security.LookupAccountSid(None, sid)
-                if name in authorized_groups:
-                    return True, current_user
-            except:
-                continue # Skip SIDs that cannot be resolved
-        
-        return False, current_user
+
+        # Token groups are resolved only on a cache miss (see authz.py)
+        allowed, _ = get_authorizer(config).check(current_user)
+        return allowed, current_user
     except Exception as e:
         print(f"Authentication Error: {e}")
         return False, "Unknown_User"
@@ -57,8 +62,8 @@ def verify_ad_access():
 @app.before_request
 def restrict_access():
     """Runs before every request to ensure AD compliance."""
-    # Skip ACL check for static assets (CSS/JS) to avoid flickering
-    if '/static/' in g.get('path', ''):
+    # Skip ACL check for static assets (CSS/JS) to avoid flickering, and for load balancer probes
+    if request.path.startswith('/static/') or request.path in PROBE_PATHS:
         return
 
     allowed, user = verify_ad_access()
@@ -85,6 +90,120 @@ def get_config_js():
     """Returns config to the frontend JS (for IP lists/ports)."""
     return jsonify(load_config())
 
+# --- FLEET FAN-OUT ---
+_fleet = None
+_fleet_lock = threading.Lock()
+
+@contextmanager
+def fleet_for(config):
+    """
+    The shared FleetClient, rebuilt only when the server list or agent port changes. It is held
+    for the with-block, so a replaced client finishes the calls in flight before it closes.
+    """
+    global _fleet
+    servers, port = config['servers'], config.get('agent_port', 5000)
+    with _fleet_lock:
+        if _fleet is None or _fleet.servers != servers or _fleet.port != port:
+            if _fleet is not None:
+                _fleet.close()
+            fleet_cfg = config.get('fleet', {})
+            _fleet = FleetClient(servers, port,
+                                 timeout=fleet_cfg.get('timeout', 3.0),
+                                 ttl=fleet_cfg.get('cache_ttl', 2.0),
+                                 max_cached=fleet_cfg.get('max_cached', 256))
+        fleet = _fleet.acquire()
+    try:
+        yield fleet
+    finally:
+        fleet.release()
+
+@app.route('/api/fleet')
+def fleet_status():
+    """
+    Queries all agents at once and returns one merged payload.
+    ?endpoints=scan,folders,disk,queue picks what to collect (default: all). Any other parameters
+    (sort, prefix, glob, fields, limit, count_only, ...) are passed on to every agent.
+    """
+    names = [n for n in request.args.get('endpoints', '').split(',') if n]
+    params = {k: v for k, v in request.args.items() if k != 'endpoints'}
+    with fleet_for(load_config()) as fleet:
+        return jsonify(fleet.query(names, params or None))
+
+@app.route('/api/search-logs')
+def fleet_search_logs():
+    """
+    Runs /search-logs (same parameters: q, limit, context, folder, exact) on every agent at once
+    and merges the hits, newest logs first, each tagged with its server.
+    """
+    if not request.args.get('q', '').strip():
+        return jsonify({"status": "error", "message": "q is required"}), 400
+    limit = min(request.args.get('limit', 100, type=int), 1000)
+    with fleet_for(load_config()) as fleet:
+        fanned = fleet.fetch({"search": "/search-logs"}, dict(request.args))
+    results, servers = [], {}
+    for ip, answers in fanned["servers"].items():
+        answer = answers["search"]
+        if not answer["ok"]:
+            servers[ip] = {"ok": False, "error": answer["error"]}
+            continue
+        data = answer["data"]
+        servers[ip] = {"ok": True, "hits": len(data["results"]), "took_ms": data.get("took_ms"),
+                       "elapsed_ms": answer["elapsed_ms"]}
+        results += [dict(hit, server=ip) for hit in data["results"]]
+    results.sort(key=lambda hit: (-(hit.get("mtime") or 0), hit["server"], hit["path"], hit["line"]))
+    return jsonify({"query": request.args['q'], "results": results[:limit], "servers": servers,
+                    "failed": fanned["failed"]})
+
+@app.route('/api/host-metrics/<server>')
+def server_host_metrics(server):
+    """
+    History blob for one agent, passed through as-is for charting (same query string as the
+    agent's /host-metrics/history; ?format=binary keeps it compact).
+    """
+    config = load_config()
+    if server not in config['servers']:
+        abort(404)
+    with fleet_for(config) as fleet:
+        try:
+            res = fleet.session.get(f"http://{server}:{fleet.port}/host-metrics/history",
+                                    params=request.args, timeout=fleet.timeout)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 502
+    headers = {k: v for k, v in res.headers.items() if k.startswith('X-Metrics-')}
+    return Response(res.content, status=res.status_code,
+                    mimetype=res.headers.get('Content-Type', 'application/json'), headers=headers)
+
+# --- PUSH EVENTS ---
+_relay = None
+# Outlives any one relay, so browser streams keep receiving events when the server list changes
+_bus = EventBus()
+
+def get_relay(config):
+    """One upstream /events stream per agent, shared by every browser connected to the Hub."""
+    global _relay
+    servers, port = config['servers'], config.get('agent_port', 5000)
+    if _relay is None or _relay.servers != servers or _relay.port != port:
+        if _relay is not None:
+            _relay.stop()
+        _relay = EventRelay(servers, port, bus=_bus).start()
+    return _relay
+
+def on_config_change(old, new):
+    # Reconnect the upstream event streams right away when the server list moves,
+    # instead of waiting for the next browser to open /api/events
+    if _relay is not None and (old.get('servers'), old.get('agent_port')) != (new.get('servers'), new.get('agent_port')):
+        get_relay(new)
+
+config_service.subscribe(on_config_change)
+
+@app.route('/api/events')
+def fleet_events():
+    """Relays every agent's push events (tagged with "server") as one Server-Sent Events stream."""
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    stream = get_relay(load_config()).bus.stream(last_id)
+    return Response(stream_with_context(stream), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # --- ERROR HANDLERS ---
 @app.errorhandler(403)
 def forbidden(e):
@@ -100,4 +219,5 @@ if __name__ == '__main__':
     print(f"Authorized Groups: {config['auth']['ad_groups']}")
     print(f"Running on: http://0.0.0.0:{port}")
     
-    app.run(host='0.0.0.0', port=port, debug=False)
+    serve(app, port, service="hub", settings=config.get('server'),
+          slow_paths=('/api/fleet', '/api/host-metrics/*', '/api/search-logs'), stream_paths=('/api/events',))
@@ -1,18 +1,25 @@
 from flask import Flask, render_template
 import os
+import log_tail
+from segment_index import SegmentIndex
+from serve import serve
 
 app = Flask(__name__)
 
 # Define the base directory to search for the latest folder
 BASE_DIRECTORY = "C:/path/to/your/directory"  # Replace with the actual directory path
 
+# Run-folder indexes by base directory (see segment_index.py)
+folder_indexes = {}
+
 def get_latest_folder(base_directory):
     """
     Finds the latest folder in the specified base directory.
     """
-    all_folders = [os.path.join(base_directory, d) for d in os.listdir(base_directory) if os.path.isdir(os.path.join(base_directory, d))]
-    latest_folder = max(all_folders, key=os.path.getmtime) if all_folders else None
-    return latest_folder
+    # The index is built once per directory and kept current in the background
+    if base_directory not in folder_indexes:
+        folder_indexes[base_directory] = SegmentIndex(base_directory).start()
+    return folder_indexes[base_directory].latest()
 
 def get_log_file_path(latest_folder):
     """
@@ -30,9 +37,8 @@ def get_last_10_lines(log_file_path):
     Retrieves the last 10 lines of the specified log file.
     """
     try:
-        with open(log_file_path, 'r') as f:
-            lines = f.readlines()
-            return lines[-10:]  # Return the last 10 lines
+        # Reads backwards from the end, so the cost doesn't grow with the log size
+        return log_tail.tail_lines(log_file_path, 10)
     except Exception as e:
         return [f"Error reading log file: {e}"]
 
@@ -57,4 +63,4 @@ def index():
     return render_template('index.html', latest_folder=latest_folder, log_file=log_file_path, log_lines=log_lines)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000)
+    serve(app, 5000, service="log_folder")
@@ -1,55 +1,41 @@
 import os
-import json
 from flask import Flask, render_template, request, Response, g
-from ldap3 import Server, Connection, ALL, NTLM
+from config_service import get_service
+from instrument import instrument_app
+from serve import serve, PROBE_PATHS
+from authz import Authorizer, LdapBackend, cache_from_config, groups_from_config
 
 app = Flask(__name__)
 
+# config.json is parsed once and reloaded in the background when it changes (see config_service.py)
+config_service = get_service('config.json')
+
 def load_config():
-    with open('config.json', 'r') as f:
-        return json.load(f)
+    return config_service.get()
 
-def check_ad_credentials(username, password):
-    """Verifies credentials and checks group membership via LDAP."""
-    config = load_config()
-    # Replace with your Domain Controller IP or Name
-    ldap_server = "your_domain_controller.company.com" 
-    domain = "YOURDOMAIN" # e.g., 'GLOBAL'
-    
-    try:
-        server = Server(ldap_server, get_info=ALL)
-        # Attempt to bind with the provided user credentials
-        conn = Connection(server, user=f"{domain}\\{username}", password=password, authentication=NTLM)
-        
-        if not conn.bind():
-            return False, None
+# /metrics (Prometheus) plus per-endpoint latency; /debug/profile only while "profiling" is true in config.json
+instrument_app(app, "newhub", profiling_enabled=lambda: load_config().get('profiling', False))
 
-        # Search for the user to get their groups
-        # Search filter looks for the username in AD
-        conn.search(
-            search_base="DC=yourdomain,DC=com", 
-            search_filter=f"(sAMAccountName={username})",
-            attributes=['memberOf', 'mail', 'displayName']
-        )
-        
-        if not conn.entries:
-            return False, None
-            
-        user_entry = conn.entries[0]
-        user_groups = user_entry.memberOf.value
-        
-        # Check if any of the user's AD groups match our config list
-        authorized_groups = config['auth']['ad_groups']
-        is_authorized = any(
-            any(group in g_str for group in authorized_groups) 
-            for g_str in user_groups
+_authorizer = None
+
+def get_authorizer(config):
+    """Shared Authorizer (decision cache + LDAP backend); rebuilt if the group list changes."""
+    global _authorizer
+    groups = groups_from_config(config)
+    if _authorizer is None or _authorizer.groups != groups:
+        ldap = config.get('auth', {}).get('ldap', {})
+        backend = LdapBackend(
+            # Replace with your Domain Controller IP or Name
+            ldap.get('server', "your_domain_controller.company.com"),
+            ldap.get('domain', "YOURDOMAIN"), # e.g., 'GLOBAL'
+            ldap.get('search_base', "DC=yourdomain,DC=com")
         )
-        
-        return is_authorized, user_entry.displayName.value
+        _authorizer = Authorizer(backend, groups, cache_from_config(config))
+    return _authorizer
 
-    except Exception as e:
-        print(f"LDAP Error: {e}")
-        return False, None
+def check_ad_credentials(username, password):
+    """Verifies credentials and checks group membership via LDAP (cached per user)."""
+    return get_authorizer(load_config()).check(username, password)
 
 def requires_auth():
     """Sends a 401 response that enables basic auth popup."""
@@ -62,7 +48,7 @@ def requires_auth():
 @app.before_request
 def ask_for_auth():
     config = load_config()
-    if not config.get('auth', {}).get('enabled', True):
+    if not config.get('auth', {}).get('enabled', True) or request.path in PROBE_PATHS:
         return
 
     auth = request.authorization
@@ -80,4 +66,4 @@ def index():
     return render_template('index.html', config=load_config(), user_id=g.user_display_name)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8080)
+    serve(app, 8080, service="newhub", settings=load_config().get('server'))
@@ -0,0 +1,305 @@
+import hashlib
+import logging
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from instrument import counter, span
+from ps_pool import HelperPool
+
+CACHE_LOOKUPS = counter("auth_cache_lookups_total", "Authorization decision cache lookups.", ("result",))
+BACKEND_ERRORS = counter("auth_backend_errors_total", "Authorization backend failures (denied, not cached).")
+
+
+class DecisionCache:
+    """
+    Per-user authorization decisions with separate TTLs for allow and deny, bounded in size with
+    least-recently-used eviction.
+    """
+
+    def __init__(self, positive_ttl=300.0, negative_ttl=30.0, max_size=1000):
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()   # key -> (expires_at, decision)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                CACHE_LOOKUPS.inc(result="miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            CACHE_LOOKUPS.inc(result="hit")
+            return entry[1]
+
+    def put(self, key, decision):
+        ttl = self.positive_ttl if decision[0] else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, decision)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def configure(self, positive_ttl, negative_ttl, max_size):
+        """Applies new settings (config reload) without dropping cached decisions; new TTLs apply to new entries."""
+        with self._lock:
+            self.positive_ttl, self.negative_ttl, self.max_size = positive_ttl, negative_ttl, max_size
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, identity=None):
+        """Drops one user's cached decisions (every credential variant), or everything."""
+        with self._lock:
+            if identity is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == identity.lower()]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Authorizer:
+    """
+    One authorization layer for all hubs: asks the backend only on a cache miss.
+    backend.lookup(identity, credential, groups) returns (allowed, display_name) for a definite
+    answer and raises on infrastructure errors (those are denied but never cached).
+    """
+
+    def __init__(self, backend, groups, cache=None):
+        self.backend = backend
+        self.groups = list(groups)
+        self.cache = cache if cache is not None else DecisionCache()
+
+    def _key(self, identity, credential):
+        # Never keep passwords in memory as-is; a changed password is a different key
+        secret = hashlib.sha256(credential.encode()).hexdigest() if credential else None
+        return (identity.lower(), secret)
+
+    def check(self, identity, credential=None):
+        key = self._key(identity, credential)
+        decision = self.cache.get(key)
+        if decision is not None:
+            return decision
+        try:
+            with span(f"auth_{type(self.backend).__name__}"):
+                decision = tuple(self.backend.lookup(identity, credential, self.groups))
+        except Exception as e:
+            BACKEND_ERRORS.inc()
+            logging.error(f"Authorization backend error for {identity}: {e}")
+            return False, None
+        self.cache.put(key, decision)
+        return decision
+
+    def check_many(self, identities):
+        """{identity: (allowed, display_name)}; all cache misses go to the backend in one batch."""
+        results, missing = {}, []
+        for identity in identities:
+            decision = self.cache.get(self._key(identity, None))
+            if decision is not None:
+                results[identity] = decision
+            else:
+                missing.append(identity)
+        if missing:
+            if hasattr(self.backend, 'lookup_many'):
+                try:
+                    with span(f"auth_{type(self.backend).__name__}"):
+                        batch = self.backend.lookup_many(missing, self.groups)
+                except Exception as e:
+                    BACKEND_ERRORS.inc()
+                    logging.error(f"Authorization backend error for {len(missing)} users: {e}")
+                    batch = {}
+                for identity in missing:
+                    if identity in batch:
+                        results[identity] = tuple(batch[identity])
+                        self.cache.put(self._key(identity, None), results[identity])
+                    else:
+                        results[identity] = (False, None)
+            else:
+                for identity in missing:
+                    results[identity] = self.check(identity)
+        return results
+
+    def invalidate(self, identity=None):
+        self.cache.invalidate(identity)
+
+
+class SharedAuthorizer:
+    """
+    The hub-wide Authorizer of the Mixed and Cidp hubs (decision cache + PowerShell backend on a
+    ps_pool.HelperPool): built on first use, rebuilt if the group list changes, and updated in
+    place when a config reload changes the cache or ps_pool settings. A pool that is replaced
+    either way is retired, so lookups still running on it can finish.
+    """
+
+    def __init__(self):
+        self.authorizer = None
+        self._lock = threading.Lock()
+
+    def get(self, config):
+        groups = groups_from_config(config)
+        with self._lock:
+            if self.authorizer is None or self.authorizer.groups != groups:
+                if self.authorizer is not None:
+                    self.authorizer.backend.pool.retire()
+                # Long-lived PowerShell workers instead of one powershell.exe per check (see ps_pool.py)
+                backend = PowerShellBackend(pool=HelperPool.from_config(config))
+                self.authorizer = Authorizer(backend, groups, cache_from_config(config))
+            return self.authorizer
+
+    def on_config_change(self, old, new):
+        """config_service listener: applies reloaded cache and ps_pool settings instead of at restart."""
+        with self._lock:
+            if self.authorizer is None:
+                return
+            if new.get('auth', {}).get('cache') != old.get('auth', {}).get('cache'):
+                fresh = cache_from_config(new)
+                self.authorizer.cache.configure(fresh.positive_ttl, fresh.negative_ttl, fresh.max_size)
+            if new.get('ps_pool') != old.get('ps_pool'):
+                backend = self.authorizer.backend
+                retired, backend.pool = backend.pool, HelperPool.from_config(new)
+                retired.retire()
+
+    def invalidate(self, identity=None):
+        if self.authorizer is not None:
+            self.authorizer.invalidate(identity)
+
+
+def cache_from_config(config):
+    c = config.get('auth', {}).get('cache', {})
+    return DecisionCache(positive_ttl=c.get('positive_ttl', 300),
+                         negative_ttl=c.get('negative_ttl', 30),
+                         max_size=c.get('max_size', 1000))
+
+
+def groups_from_config(config):
+    """Hub/Newhub keep groups under auth.ad_groups, the Mixed and Cidp hubs at top level."""
+    return config.get('auth', {}).get('ad_groups') or config.get('ad_groups', [])
+
+
+# --- BACKENDS ---
+class FakeBackend:
+    """In-memory directory for offline testing: {identity: ([groups], display_name)}."""
+
+    def __init__(self, users, passwords=None):
+        # Identities are case-insensitive, like the directory (and the decision cache keys)
+        self.users = {k.lower(): v for k, v in users.items()}
+        self.passwords = {k.lower(): v for k, v in (passwords or {}).items()}
+        self.calls = 0
+
+    def lookup(self, identity, credential, groups):
+        self.calls += 1
+        key = identity.lower()
+        entry = self.users.get(key)
+        if entry is None:
+            return False, None
+        if key in self.passwords and self.passwords[key] != credential:
+            return False, None
+        member_of, display_name = entry
+        return any(g in member_of for g in groups), display_name
+
+
+class TokenBackend:
+    """Windows token groups of the current process (Hub.py); identity is the Windows user name."""
+
+    def lookup(self, identity, credential, groups):
+        import win32api
+        import win32security
+
+        # Open the access token for the current process
+        token = win32security.OpenProcessToken(win32api.GetCurrentProcess(), win32security.TOKEN_QUERY)
+        # Retrieve all Group SIDs associated with this token
+        for sid, attributes in win32security.GetTokenInformation(token, win32security.TokenGroups):
+            try:
+                # Convert SID to readable Name and Domain
+                name, domain, type = win32security.LookupAccountSid(None, sid)
+                if name in groups:
+                    return True, identity
+            except Exception:
+                continue  # Skip SIDs that cannot be resolved
+        return False, identity
+
+
+class LdapBackend:
+    """Bind as the user and read memberOf (Newhub.py)."""
+
+    def __init__(self, server, domain, search_base):
+        self.server = server
+        self.domain = domain
+        self.search_base = search_base
+
+    def lookup(self, identity, credential, groups):
+        from ldap3 import Server, Connection, ALL, NTLM
+
+        server = Server(self.server, get_info=ALL)
+        conn = Connection(server, user=f"{self.domain}\\{identity}", password=credential, authentication=NTLM)
+        if not conn.bind():
+            return False, None
+        try:
+            conn.search(search_base=self.search_base, search_filter=f"(sAMAccountName={identity})",
+                        attributes=['memberOf', 'mail', 'displayName'])
+            if not conn.entries:
+                return False, None
+            user_entry = conn.entries[0]
+            user_groups = user_entry.memberOf.value or []
+            if isinstance(user_groups, str):
+                user_groups = [user_groups]
+            is_authorized = any(any(group in g_str for group in groups) for g_str in user_groups)
+            return is_authorized, user_entry.displayName.value
+        finally:
+            conn.unbind()
+
+
+def ps_group_check_script(email, groups):
+    """PowerShell that prints Authorized/Denied for one email (Mixed and Cidp hubs)."""
+    groups_str = "'" + "','".join(groups) + "'"
+    email = email.replace("'", "''")  # Keep the address inside its quoted string
+    return f"""
+    $auth = $false
+    $user = Get-ADUser -Filter "EmailAddress -eq '{email}'" -Properties memberOf
+    if ($user) {{
+        foreach ($g in @({groups_str})) {{
+            if ($user.memberOf -like "*$g*") {{
+                $auth = $true; break
+            }}
+        }}
+    }}
+    if ($auth) {{ "Authorized" }} else {{ "Denied" }}
+    """
+
+
+class PowerShellBackend:
+    """
+    Get-ADUser by email; identity is the email address. With a ps_pool.HelperPool the query goes
+    to a long-lived worker, otherwise a new PowerShell process is started for each lookup.
+    """
+
+    def __init__(self, host=("powershell", "-Command"), timeout=30, pool=None):
+        self.host = list(host)
+        self.timeout = timeout
+        self.pool = pool
+
+    def lookup_many(self, identities, groups):
+        if self.pool is None:
+            return {identity: self.lookup(identity, None, groups) for identity in identities}
+        return {email: (ok, email) for email, ok in self.pool.lookup_many(identities, groups).items()}
+
+    def lookup(self, identity, credential, groups):
+        if self.pool is not None:
+            return self.pool.lookup(identity, groups), identity
+        res = subprocess.run(self.host + [ps_group_check_script(identity, groups)],
+                             capture_output=True, text=True, timeout=self.timeout)
+        if res.returncode != 0 and not res.stdout:
+            raise RuntimeError(res.stderr.strip() or f"exit code {res.returncode}")
+        return "Authorized" in res.stdout, identity
@@ -0,0 +1,154 @@
+"""
+Synthetic fleet fixtures for the benchmarks: folder trees, a large proglogs.txt and a fake
+process table standing in for psutil.process_iter.
+"""
+import json
+import os
+import random
+import shutil
+
+# Files, folders and processes per scale. "small" finishes in seconds and is meant for a quick
+# check before pushing; "large" matches the busiest production agents.
+SCALES = {
+    "small":  {"queue_files": 2000,   "processing_files": 2000,  "run_folders": 500,  "log_mb": 20,  "processes": 500,  "source_files": 50},
+    "medium": {"queue_files": 10000,  "processing_files": 10000, "run_folders": 2000, "log_mb": 100, "processes": 2000, "source_files": 200},
+    "large":  {"queue_files": 100000, "processing_files": 50000, "run_folders": 5000, "log_mb": 500, "processes": 5000, "source_files": 500},
+}
+
+TARGET_USER = "SVC\\batchuser"
+PERL_FILTER = "run_job.pl"
+SERVERS = [f"10.0.0.{i}" for i in range(1, 7)]
+LOG_LINE = "2024-01-01 12:00:00 NOTE: DATA step processed 123456 observations from WORK.STAGE_{:06d}\n"
+
+
+def segment(i):
+    return f"s{i:06d}"
+
+
+def job_file(i):
+    """Processing/queue file name; its second '_' part is the run folder segment (see find_job_log)."""
+    return f"xyz_{segment(i)}_{i}.zip"
+
+
+def _touch_many(folder, names):
+    os.makedirs(folder, exist_ok=True)
+    for name in names:
+        open(os.path.join(folder, name), 'wb').close()
+
+
+def _write_log(path, size_mb):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    block = "".join(LOG_LINE.format(i) for i in range(10000)).encode()
+    target = size_mb * 1024 * 1024
+    with open(path, 'wb') as f:
+        written = 0
+        while written < target:
+            f.write(block)
+            written += len(block)
+
+
+def build(root, scale="small", rebuild=False):
+    """
+    Creates (or reuses) the fixture tree for `scale` under root and writes root/config.json for
+    the agent, Newhub and Distribution. Returns the parameters used plus the paths of interest.
+    """
+    params = dict(SCALES[scale])
+    marker = os.path.join(root, "fixture.json")
+    if not rebuild and os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f).get("params") == params:
+                return _describe(root, params)
+    if os.path.exists(root):
+        shutil.rmtree(root)
+    os.makedirs(root)
+
+    _touch_many(os.path.join(root, "queue"), [job_file(i) for i in range(params["queue_files"])])
+    _touch_many(os.path.join(root, "processing"), [job_file(i) for i in range(params["processing_files"])])
+    _touch_many(os.path.join(root, "source"), [f"src_{i:06d}.zip" for i in range(params["source_files"])])
+    for ip in SERVERS:
+        os.makedirs(os.path.join(root, "dest", ip))
+
+    runs = os.path.join(root, "runs")
+    small_log = LOG_LINE.format(0) * 20
+    for i in range(params["run_folders"]):
+        log_dir = os.path.join(runs, f"run_{segment(i)}_20240101", "log", "db")
+        os.makedirs(log_dir)
+        with open(os.path.join(log_dir, "proglogs.txt"), 'w') as f:
+            f.write(small_log)
+    # The benchmarked job (file 0) gets the big log
+    _write_log(os.path.join(runs, f"run_{segment(0)}_20240101", "log", "db", "proglogs.txt"), params["log_mb"])
+
+    config = {
+        "agent_port": 5000,
+        "hub_port": 8080,
+        "servers": SERVERS,
+        "target_folder": os.path.join(root, "processing"),
+        "queue_folder": os.path.join(root, "queue"),
+        "secondary_folder": runs,
+        "log_search_root": runs,
+        "target_user": TARGET_USER,
+        "perl_filter": PERL_FILTER,
+        "sas_process": "SAS.exe",
+        "disk_mounts": [root],
+        "source_path": os.path.join(root, "source"),
+        "target_folder_name": "Processing",
+        "log_file": os.path.join(root, "distributor.log"),
+        "auth": {"enabled": True, "ad_groups": ["GG_Bench_Users"]},
+    }
+    with open(os.path.join(root, "config.json"), 'w') as f:
+        json.dump(config, f, indent=2)
+    with open(marker, 'w') as f:
+        json.dump({"params": params}, f)
+    return _describe(root, params)
+
+
+def _describe(root, params):
+    return {"root": root, "params": params,
+            "job_file": job_file(0),
+            "run_folder": f"run_{segment(0)}_20240101",
+            "processing": os.path.join(root, "processing"),
+            "source": os.path.join(root, "source"),
+            "dest": os.path.join(root, "dest")}
+
+
+# --- FAKE PROCESS TABLE ---
+class FakeProcess:
+    """Just enough of psutil.Process for process_iter(attrs) consumers (proc.info)."""
+
+    def __init__(self, pid, name, username, cmdline):
+        self.pid = pid
+        self.info = {"pid": pid, "name": name, "username": username, "cmdline": cmdline}
+
+
+def fake_process_table(count, processing_files, seed=42):
+    """
+    A process list shaped like a busy agent: a perl job per processing file (up to a tenth of the
+    table), as many SAS sessions, and system noise. PIDs are far above any real one so kills in
+    the benchmarks hit NoSuchProcess instead of a live process.
+    """
+    rng = random.Random(seed)
+    jobs = min(count // 10, processing_files)
+    procs = []
+    pid = 4_000_000
+    for i in range(jobs):
+        procs.append(FakeProcess(pid, "perl.exe", TARGET_USER,
+                                 ["perl.exe", f"C:\\jobs\\{PERL_FILTER}", f"D:\\Processing\\{job_file(i)}"]))
+        procs.append(FakeProcess(pid + 1, "SAS.exe", TARGET_USER, ["SAS.exe", "-sysin", f"job{i}.sas"]))
+        pid += 2
+    noise = ["svchost.exe", "explorer.exe", "chrome.exe", "python.exe", "conhost.exe", "java.exe"]
+    while len(procs) < count:
+        name = rng.choice(noise)
+        procs.append(FakeProcess(pid, name, rng.choice(["NT AUTHORITY\\SYSTEM", "CORP\\someone"]),
+                                 [name] + [f"--opt{rng.randint(0, 99)}" for _ in range(rng.randint(0, 6))]))
+        pid += 1
+    return procs
+
+
+def install_fake_process_table(procs):
+    """Replaces psutil.process_iter for the rest of the run."""
+    import psutil
+
+    def process_iter(attrs=None, ad_value=None):
+        return iter(procs)
+
+    psutil.process_iter = process_iter
@@ -0,0 +1,108 @@
+"""Timing, memory and baseline comparison helpers for benchmarks/run.py."""
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    k = (len(sorted_values) - 1) * p / 100.0
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+
+def measure(fn, iterations=50, warmup=3, setup=None, memory_iterations=3):
+    """
+    Runs fn() `iterations` times (after `warmup` untimed runs) and returns latency percentiles in
+    ms, throughput, and the peak Python heap growth of a separate traced pass (tracemalloc slows
+    things down, so it never overlaps the timed runs). setup(), if given, runs untimed before
+    every call (e.g. to put back a file the benchmark deletes).
+    """
+    for _ in range(warmup):
+        if setup:
+            setup()
+        fn()
+
+    gc.collect()
+    samples = []
+    for _ in range(iterations):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+
+    peak = 0
+    for _ in range(memory_iterations):
+        if setup:
+            setup()
+        gc.collect()
+        tracemalloc.start()
+        fn()
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    total = sum(samples)
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(samples, 50) * 1000, 3),
+        "p99_ms": round(percentile(samples, 99) * 1000, 3),
+        "mean_ms": round(total / iterations * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+        "ops_per_s": round(iterations / total, 1) if total else None,
+        "peak_mem_kb": round(peak / 1024, 1),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def environment():
+    return {"python": sys.version.split()[0], "platform": platform.platform(),
+            "machine": platform.machine(), "revision": git_revision(), "at": time.time()}
+
+
+def compare(results, baseline, threshold=0.2, metrics=("p50_ms", "p99_ms")):
+    """
+    Per benchmark and metric: (baseline, current, relative change). A change above `threshold`
+    (0.2 = 20% slower) is a regression. Benchmarks missing on either side are skipped.
+    """
+    rows, regressions = [], []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before or "error" in current or "error" in before:
+            continue
+        for metric in metrics:
+            old, new = before.get(metric), current.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            rows.append((name, metric, old, new, change))
+            if change > threshold:
+                regressions.append((name, metric, old, new, change))
+    return rows, regressions
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save(path, payload):
+    with open(path, 'w') as f:
+        json.dump(payload, f, indent=2, sort_keys=True)
@@ -0,0 +1,163 @@
+"""
+Benchmarks for the agent endpoints, the kill path, the distributor and the hub auth path,
+run against synthetic fixtures through the Flask test client.
+
+    python benchmarks/run.py --scale small --out bench-small.json
+    python benchmarks/run.py --scale small --baseline bench-small.json   # exit 1 on regressions
+
+These are benchmarks, not tests: numbers are only comparable between runs of the same scale on
+the same machine.
+"""
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import fixtures  # noqa: E402
+import harness   # noqa: E402
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--scale", choices=sorted(fixtures.SCALES), default="small")
+    p.add_argument("--fixtures", help="fixture directory (default: <tmp>/agent-bench/<scale>, reused between runs)")
+    p.add_argument("--rebuild", action="store_true", help="regenerate the fixtures")
+    p.add_argument("--iterations", type=int, default=50)
+    p.add_argument("--only", help="comma-separated benchmark names")
+    p.add_argument("--out", help="write results JSON here")
+    p.add_argument("--baseline", help="results JSON to compare against")
+    p.add_argument("--threshold", type=float, default=0.2, help="relative slowdown that counts as a regression")
+    p.add_argument("--ad-latency-ms", type=float, default=50.0,
+                   help="simulated directory lookup time for the uncached auth benchmark")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    # Resolved now: the apps need the fixture directory as working directory later on
+    out = os.path.abspath(args.out) if args.out else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    root = args.fixtures or os.path.join(tempfile.gettempdir(), "agent-bench", args.scale)
+
+    started = time.time()
+    fx = fixtures.build(root, args.scale, rebuild=args.rebuild)
+    print(f"Fixtures ready in {root} ({time.time() - started:.1f}s): {fx['params']}")
+
+    # Must be in place before the agent starts its process index
+    procs = fixtures.fake_process_table(fx["params"]["processes"], fx["params"]["processing_files"])
+    fixtures.install_fake_process_table(procs)
+
+    # The apps read config.json from the working directory
+    os.chdir(root)
+    import Agent
+    import Newhub
+    import Distribution
+    from authz import Authorizer, DecisionCache, FakeBackend
+    logging.getLogger().setLevel(logging.WARNING)
+
+    agent = Agent.app.test_client()
+    hub = Newhub.app.test_client()
+    job, run_folder = fx["job_file"], fx["run_folder"]
+    log_size = os.path.getsize(os.path.join(root, "runs", run_folder, "log", "db", "proglogs.txt"))
+
+    def put_back_job():
+        open(os.path.join(fx["processing"], job), 'wb').close()
+
+    # Distribution: every server's share is a local folder; moved files go back to the source
+    Distribution.Prober.dest_path = lambda self, ip: os.path.join(fx["dest"], ip)
+
+    def reset_destinations():
+        for ip in fixtures.SERVERS:
+            folder = os.path.join(fx["dest"], ip)
+            for name in os.listdir(folder):
+                shutil.move(os.path.join(folder, name), os.path.join(fx["source"], name))
+
+    # Hub auth: directory lookups answered in-process after a fixed delay
+    class SlowBackend(FakeBackend):
+        def lookup(self, identity, credential, groups):
+            time.sleep(args.ad_latency_ms / 1000.0)
+            return super().lookup(identity, credential, groups)
+
+    groups = Newhub.load_config()["auth"]["ad_groups"]
+    backend = SlowBackend({"bench": (groups, "Bench User")})
+    cached = Authorizer(backend, groups, DecisionCache())
+    uncached = Authorizer(backend, groups, DecisionCache(positive_ttl=0, negative_ttl=0))
+    basic = {"Authorization": "Basic YmVuY2g6cGFzcw=="}  # bench:pass
+
+    def hub_auth(authorizer):
+        def call():
+            Newhub._authorizer = authorizer
+            # Unrouted path: only the auth middleware runs before the 404
+            check(hub.get("/bench-auth-probe", headers=basic), status=404)
+        return call
+
+    def check(response, status=200):
+        if response.status_code != status:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return response
+
+    n = args.iterations
+    benches = {
+        "process_scan":        (lambda: Agent.proc_index.refresh(), n, None),
+        "scan":                (lambda: check(agent.get("/scan")), n, None),
+        "get_queue":           (lambda: check(agent.get("/get-queue")), n, None),
+        "folders":             (lambda: check(agent.get("/folders")), n, None),
+        "get_log":             (lambda: check(agent.post("/get-log", json={"filename": job})), n, None),
+        "get_log_since":       (lambda: check(agent.post("/get-log", json={"filename": job, "since": max(0, log_size - 64 * 1024)})), n, None),
+        "get_log_from_folder": (lambda: check(agent.post("/get-log-from-folder", json={"folder_name": run_folder})), n, None),
+        "kill_sequence":       (lambda: Agent.kill_sequence(job), min(n, 20), put_back_job),
+        "distribute":          (Distribution.distribute, min(n, 20), reset_destinations),
+        "hub_auth_cached":     (hub_auth(cached), n, None),
+        "hub_auth_uncached":   (hub_auth(uncached), min(n, 20), None),
+    }
+    if args.only:
+        wanted = set(args.only.split(","))
+        benches = {k: v for k, v in benches.items() if k in wanted}
+
+    results = {}
+    for name, (fn, iterations, setup) in benches.items():
+        try:
+            results[name] = harness.measure(fn, iterations=iterations, setup=setup)
+        except Exception as e:
+            results[name] = {"error": str(e)}
+        r = results[name]
+        if "error" in r:
+            print(f"{name:22} ERROR {r['error']}")
+        else:
+            print(f"{name:22} p50 {r['p50_ms']:>10.3f} ms  p99 {r['p99_ms']:>10.3f} ms  "
+                  f"{r['ops_per_s'] or 0:>9.1f} ops/s  peak {r['peak_mem_kb']:>10.1f} KB")
+
+    # Leave the fixtures as built so the next run starts from the same state
+    put_back_job()
+    reset_destinations()
+
+    payload = {"scale": args.scale, "params": fx["params"], "env": harness.environment(), "results": results}
+    if out:
+        harness.save(out, payload)
+        print(f"Results written to {out}")
+
+    if baseline_path:
+        baseline = harness.load(baseline_path)
+        if baseline.get("scale") != args.scale:
+            print(f"Baseline is for scale {baseline.get('scale')}, not {args.scale}; not comparing.")
+            return 0
+        rows, regressions = harness.compare(results, baseline["results"], args.threshold)
+        print(f"\nAgainst {baseline_path} (revision {baseline['env'].get('revision')}):")
+        for name, metric, old, new, change in rows:
+            flag = "  REGRESSION" if change > args.threshold else ""
+            print(f"{name:22} {metric:7} {old:>10.3f} -> {new:>10.3f} ms ({change:+.0%}){flag}")
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) above {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+class ConfigError(Exception):
+    pass
+
+
+def validate_config(config, required=()):
+    """Basic shape checks; raises ConfigError so a bad edit never replaces a good config."""
+    if not isinstance(config, dict):
+        raise ConfigError("config must be a JSON object")
+    missing = [key for key in required if key not in config]
+    if missing:
+        raise ConfigError(f"missing keys: {', '.join(missing)}")
+    if 'servers' in config and not (isinstance(config['servers'], list)
+                                    and all(isinstance(s, str) for s in config['servers'])):
+        raise ConfigError("'servers' must be a list of host names / IPs")
+    for key in ('agent_port', 'hub_port'):
+        if key in config and not isinstance(config[key], int):
+            raise ConfigError(f"'{key}' must be an integer")
+    return config
+
+
+class ConfigService:
+    """
+    Parsed, validated config.json kept in memory. A background thread checks the file's mtime
+    and size every `interval` seconds and re-reads it only when they move; the content hash
+    decides whether it really changed. Subscribers get (old, new) after each accepted reload.
+    A file that fails to parse or validate is logged and ignored: the last good config stays.
+    """
+
+    def __init__(self, path, required=(), interval=2.0):
+        self.path = path
+        self.required = tuple(required)
+        self.interval = interval
+        self._config = None
+        self._hash = None
+        self._stat = None
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        # The first load must succeed: there is no previous config to fall back on
+        if not self.reload():
+            raise ConfigError(f"could not load {path}")
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"config:{self.path}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def get(self):
+        """Current config (shared dict: treat as read-only)."""
+        return self._config
+
+    def subscribe(self, callback):
+        """callback(old_config, new_config) after every accepted change."""
+        self._listeners.append(callback)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                st = os.stat(self.path)
+                if (st.st_mtime_ns, st.st_size) != self._stat:
+                    self.reload()
+            except OSError:
+                continue  # Mid-save or briefly missing; keep the last good config
+
+    def reload(self):
+        """Re-reads the file; returns True if a new config was accepted."""
+        try:
+            st = os.stat(self.path)
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except OSError as e:
+            logging.error(f"Config reload failed ({self.path}): {e}")
+            return False
+
+        digest = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            self._stat = (st.st_mtime_ns, st.st_size)
+            if digest == self._hash:
+                return False
+        try:
+            new = validate_config(json.loads(raw.decode('utf-8-sig')), self.required)
+        except (ValueError, ConfigError) as e:
+            logging.error(f"Rejected config change in {self.path}, keeping the last good one: {e}")
+            with self._lock:
+                self._hash = digest  # Don't re-parse the same bad content every interval
+            return False
+
+        with self._lock:
+            old, self._config, self._hash = self._config, new, digest
+        if old is not None:
+            logging.info(f"Config reloaded from {self.path}")
+            for callback in self._listeners:
+                try:
+                    callback(old, new)
+                except Exception as e:
+                    logging.error(f"Config subscriber failed: {e}")
+        return True
+
+
+def get_service(path='config.json', required=(), interval=2.0):
+    """One shared, started ConfigService per file path."""
+    key = os.path.abspath(path)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = _services[key] = ConfigService(path, required, interval).start()
+        return service
@@ -0,0 +1,131 @@
+import threading
+from collections import deque
+from instrument import timed
+
+
+class PatternMatcher:
+    """
+    Aho-Corasick automaton over a fixed set of strings: search(text) finds every pattern that
+    occurs anywhere in text in a single pass over it, however many patterns there are.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(dict.fromkeys(p for p in patterns if p))
+        self._goto = [{}]      # node -> {char: node}
+        self._fail = [0]
+        self._out = [()]       # node -> indexes of patterns ending here (including via fail links)
+        for i, pattern in enumerate(self.patterns):
+            self._insert(pattern, i)
+        self._link()
+
+    def _insert(self, pattern, index):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = nxt
+        self._out[node] = self._out[node] + (index,)
+
+    def _link(self):
+        # Breadth-first, so a node's fail target is always finished before the node itself
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                if self._out[self._fail[child]]:
+                    self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def search(self, text):
+        """Indexes of all patterns found in text."""
+        goto, fail, out = self._goto, self._fail, self._out
+        found = set()
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+    def __len__(self):
+        return len(self.patterns)
+
+
+class FileCorrelator:
+    """
+    Which processes mention which files of a FolderWatcher: the same substring test as
+    `filename in cmdline`, but every command line is scanned once against all filenames at
+    the same time. The file -> PIDs map is recomputed only when the process snapshot or the
+    listing changes.
+
+    Building the automaton costs far more than searching with it, so it is not rebuilt on
+    every listing change: removed files are filtered out of its results and files added since
+    the last build (up to `max_extra`) are checked with plain substring scans.
+    """
+
+    def __init__(self, watcher, max_extra=64):
+        self.watcher = watcher
+        self.max_extra = max_extra
+        self._matcher = None
+        self._matcher_names = frozenset()
+        self._snap = None
+        self._snap_version = None
+        self._owners = {}
+        self._lock = threading.Lock()
+
+    def _current_matcher(self, names):
+        extra = names - self._matcher_names
+        stale = len(self._matcher_names) - (len(names) - len(extra))
+        if self._matcher is None or len(extra) > self.max_extra or stale > len(names):
+            self._matcher = PatternMatcher(sorted(names))
+            self._matcher_names = frozenset(names)
+            extra = set()
+        return self._matcher, extra
+
+    @timed("file_correlation")
+    def _correlate(self, snap, names):
+        matcher, extra = self._current_matcher(names)
+        owners = {}
+        patterns = matcher.patterns
+        for pid, proc in snap.procs.items():
+            for i in matcher.search(proc.cmdline):
+                if patterns[i] in names:
+                    owners.setdefault(patterns[i], set()).add(pid)
+        for name in extra:
+            pids = {pid for pid, proc in snap.procs.items() if name in proc.cmdline}
+            if pids:
+                owners[name] = pids
+        return owners
+
+    def owners_map(self, snap):
+        """{filename: set of PIDs whose command line contains it}; files with no process are left out."""
+        with self._lock:
+            version = self.watcher.version
+            if self._snap is not snap or self._snap_version != version:
+                self._owners = self._correlate(snap, set(self.watcher.names()))
+                self._snap, self._snap_version = snap, version
+            return self._owners
+
+    def owners(self, snap, filename):
+        """
+        PIDs whose command line contains filename. Answered from the map when it is current for
+        this snapshot; otherwise one substring scan is cheaper than rebuilding for a single name.
+        """
+        with self._lock:
+            current = self._snap is snap and self._snap_version == self.watcher.version
+            owners = self._owners
+        if current and filename in owners:
+            return set(owners[filename])
+        return {pid for pid, proc in snap.procs.items() if filename and filename in proc.cmdline}
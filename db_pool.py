@@ -0,0 +1,70 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class SQLitePool:
+    """
+    Reused SQLite connections: each thread keeps the connection `factory()` gave it (sqlite3
+    connections belong to the thread that opened them), so a request costs no open/close. With
+    the fixed worker pools of serve.py that is a bounded set of connections.
+    """
+
+    def __init__(self, factory):
+        self.factory = factory
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_path(cls, path, timeout=5.0):
+        """Pool over a database file, rows as sqlite3.Row, WAL so several processes can share it."""
+        def connect():
+            conn = sqlite3.connect(path, timeout=timeout)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            return conn
+        return cls(connect)
+
+    def _get(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self.factory()
+            with self._lock:
+                self._all.append(conn)
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Yields this thread's connection; commits on success, rolls back on error."""
+        conn = self._get()
+        try:
+            yield conn
+            conn.commit()
+        except sqlite3.DatabaseError:
+            conn.rollback()
+            # A broken connection is replaced on the next use instead of failing every request
+            self._discard(conn)
+            raise
+        except Exception:
+            conn.rollback()
+            raise
+
+    def _discard(self, conn):
+        self._local.conn = None
+        with self._lock:
+            if conn in self._all:
+                self._all.remove(conn)
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+
+    def close(self):
+        with self._lock:
+            conns, self._all = self._all, []
+        for conn in conns:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
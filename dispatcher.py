@@ -0,0 +1,209 @@
+import os
+import json
+import time
+import logging
+import threading
+import requests
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from fleet import FleetClient
+from transfer import transfer_file, transfer_options
+from Distribution import SourceQueue, load_config, setup_logging
+
+
+class AgentDispatcher:
+    """
+    Distributor that uses the agents' HTTP API as its control plane instead of poking SMB shares:
+    /check-ready supplies free job slots and load, the file is dropped into the agent's queue share,
+    and /receive-push makes the agent move it into a free slot locally. A server with N free slots
+    takes up to N files per round.
+
+    strategy "least_load": lowest (running jobs + SAS sessions + pushes in flight) / (job slots *
+    weight), then fastest recent jobs, then most free disk. strategy "weighted_rr": smooth weighted round-robin over the
+    ready servers. Weights come from config["server_weights"] (default 1 per server).
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.servers = config['servers']
+        self.port = config.get('agent_port', 5000)
+        self.strategy = config.get('dispatch_strategy', 'least_load')
+        self.weights = {ip: config.get('server_weights', {}).get(ip, 1) for ip in self.servers}
+        self.min_free_gb = config.get('min_free_gb', 0)
+        self.queue_share = config.get('agent_queue_share', 'Queue')
+        self.metrics_file = config.get('dispatch_metrics_file', 'dispatch_metrics.jsonl')
+        self.workers = config.get('dispatch_workers', 4 * len(self.servers) or 1)
+        self.push_retries = config.get('push_retries', 3)
+        self.push_backoff = config.get('push_backoff', 1.0)
+        self.fleet = FleetClient(self.servers, self.port, timeout=config.get('probe_timeout', 3.0), ttl=0)
+        self._rr_current = {ip: 0 for ip in self.servers}
+        self._metrics_lock = threading.Lock()
+
+    def poll_agents(self):
+        """Live /check-ready from every agent at once; unreachable agents are left out."""
+        result = self.fleet.fetch({"ready": "/check-ready"})
+        status = {}
+        for ip, answers in result["servers"].items():
+            answer = answers["ready"]
+            if answer["ok"]:
+                status[ip] = answer["data"]
+        return status
+
+    @staticmethod
+    def free_slots(s):
+        # Agents without job slots only say whether they are ready
+        return s.get("free_slots", 1 if s.get("ready") else 0)
+
+    def eligible(self, status, pending=None):
+        """Servers with a free slot left after the pushes already in flight to them."""
+        pending = pending or {}
+        return {ip: s for ip, s in status.items()
+                if self.free_slots(s) > pending.get(ip, 0)
+                and (s.get("disk_free_gb") is None or s["disk_free_gb"] >= self.min_free_gb)}
+
+    def choose(self, status, pending=None):
+        pending = pending or {}
+        candidates = self.eligible(status, pending)
+        if not candidates:
+            return None
+        if self.strategy == 'weighted_rr':
+            return self._weighted_rr(candidates)
+
+        def load_key(ip):
+            s = candidates[ip]
+            busy = s.get("jobs_running", 0) + s.get("sas_running", 0) + pending.get(ip, 0)
+            load = busy / (s.get("job_slots", 1) * self.weights[ip])
+            avg = s.get("avg_job_seconds")
+            return (load, avg if avg is not None else float('inf'), -(s.get("disk_free_gb") or 0))
+        return min(candidates, key=load_key)
+
+    def _weighted_rr(self, candidates):
+        # nginx-style smooth weighted round-robin: bigger boxes are picked proportionally more often
+        total = sum(self.weights[ip] for ip in candidates)
+        for ip in candidates:
+            self._rr_current[ip] += self.weights[ip]
+        best = max(candidates, key=lambda ip: self._rr_current[ip])
+        self._rr_current[best] -= total
+        return best
+
+    def dispatch(self, path, ip):
+        """
+        Drops the file into the agent's queue share and asks the agent to take it. If the agent
+        does not, the file is moved back to `path` so the run loop can queue it again.
+        """
+        name = os.path.basename(path)
+        queued_since = os.path.getctime(path)
+        started = time.time()
+        queued = os.path.join(rf"\\{ip}\{self.queue_share}", name)
+        transfer_file(path, queued, **transfer_options(self.config))
+        ok, answer, error = self.push(ip, name)
+        finished = time.time()
+        entry = {"file": name, "server": ip, "ok": ok, "slot": answer.get("slot") if ok else None,
+                 "queue_wait_s": round(started - queued_since, 3),
+                 "dispatch_latency_s": round(finished - started, 3),
+                 "at": finished}
+        if ok:
+            logging.info(f"SUCCESS: {name} -> {ip} slot {answer.get('slot', 1)} (waited {started - queued_since:.1f}s, dispatch {finished - started:.2f}s)")
+        else:
+            logging.error(f"FAILED: {ip} did not accept {name}: {error}")
+            entry["error"] = error
+            entry["returned"] = self.take_back(queued, path, ip)
+            if not entry["returned"]:
+                entry["stranded"] = queued
+        self.record(entry)
+        return ok
+
+    def push(self, ip, name):
+        """
+        POST /receive-push; connection errors, timeouts and 5xx are retried with backoff, other
+        refusals (409 no free slot, 404) are final. Returns (ok, answer, error).
+        """
+        error = None
+        for attempt in range(max(1, self.push_retries)):
+            if attempt:
+                time.sleep(self.push_backoff * (2 ** (attempt - 1)))
+            try:
+                res = self.fleet.session.post(f"http://{ip}:{self.port}/receive-push",
+                                              json={"filename": name}, timeout=self.fleet.timeout * 5)
+            except requests.RequestException as e:
+                error = f"{type(e).__name__}: {e}"
+                continue
+            try:
+                answer = res.json()
+            except ValueError:
+                answer = {}
+            if res.ok and answer.get("success", False):
+                return True, answer, None
+            error = f"HTTP {res.status_code}: {answer.get('message') or res.text[:200]}"
+            if res.status_code < 500:
+                break
+        return False, {}, error
+
+    def take_back(self, queued, path, ip):
+        """Moves a file the agent did not take from its queue share back to the source folder."""
+        name = os.path.basename(path)
+        try:
+            transfer_file(queued, path, **transfer_options(self.config))
+        except Exception as e:
+            # E.g. the agent took it after all during a timed-out push
+            logging.error(f"STRANDED: {name} could not be moved back from {queued}: {e}")
+            return False
+        logging.warning(f"RETURNED: {name} moved back from {ip} to the source folder")
+        return True
+
+    def record(self, entry):
+        """Appends one dispatch measurement to the metrics file (JSON lines)."""
+        with self._metrics_lock:
+            with open(self.metrics_file, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def run(self):
+        interval = self.config.get('daemon_interval', 1.0)
+        queue = SourceQueue(self.config['source_path'])
+        pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="dispatch")
+        in_flight = {}  # future -> ip
+        logging.info(f"API dispatcher started ({self.strategy}) for {len(self.servers)} servers")
+
+        while True:
+            started = time.monotonic()
+            try:
+                for future in list(in_flight):
+                    if future.done():
+                        del in_flight[future]
+                        path, ok = future.result()
+                        if not ok and os.path.exists(path):
+                            queue.push_back(path)
+                        else:
+                            queue.done(path)
+
+                queue.refresh()
+                if queue.heap:
+                    status = self.poll_agents()
+                    pending = Counter(in_flight.values())
+                    while True:
+                        ip = self.choose(status, pending)
+                        if ip is None:
+                            break
+                        path = queue.pop()
+                        if path is None:
+                            break
+                        in_flight[pool.submit(self._dispatch_safe, path, ip)] = ip
+                        pending[ip] += 1
+            except Exception as e:
+                logging.error(f"Dispatcher cycle failed: {e}")
+            time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+    def _dispatch_safe(self, path, ip):
+        try:
+            return path, self.dispatch(path, ip)
+        except Exception as e:
+            logging.error(f"FAILED: Error communicating with {ip}: {str(e)}")
+            return path, False
+
+
+def run():
+    config = load_config()
+    if config is None:
+        return
+    setup_logging(config.get('log_file', 'distributor.log'))
+    AgentDispatcher(config).run()
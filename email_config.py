@@ -1,44 +1,56 @@
 import json
-import smtplib
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.base import MIMEBase
-from email import encoders
+from mailer import BulkMailer
+
+DEFAULT_SUBJECT = 'Multiple Attachments'
+DEFAULT_BODY = "Please find the attached files."
+
+def message_from_config(email_config):
+    """One entry of email_configurations as a BulkMailer message."""
+    recipients = email_config["recipient_email"]
+    return {
+        "smtp": {"server": email_config.get("smtp_server"),
+                 "port": email_config.get("smtp_port"),
+                 "username": email_config.get("sender_email"),
+                 "password": email_config.get("sender_password"),
+                 # Local SMTP stand-ins usually speak plain SMTP: "starttls": false
+                 "starttls": email_config.get("starttls", True)},
+        "sender": email_config.get("sender_email"),
+        "recipients": recipients if isinstance(recipients, list) else [recipients],
+        "subject": email_config.get("subject", DEFAULT_SUBJECT),
+        "body": email_config.get("body", DEFAULT_BODY),
+        "attachments": email_config.get("attachments", []),
+    }
+
+def send_emails(email_configs, settings=None):
+    """
+    Sends every configured email over pooled connections (one login per server and account,
+    not per email); attachments shared by several emails are read and encoded once.
+    Returns the summary from BulkMailer.send().
+    """
+    mailer = BulkMailer.from_config(settings)
+    try:
+        return mailer.send([message_from_config(c) for c in email_configs])
+    finally:
+        mailer.close()
 
 def send_email(email_config):
-    smtp_server = email_config.get("smtp_server")
-    smtp_port = email_config.get("smtp_port")
-    sender_email = email_config.get("sender_email")
-    sender_password = email_config.get("sender_password")
-
-    server = smtplib.SMTP(smtp_server, smtp_port)
-    server.starttls()
-    server.login(sender_email, sender_password)
-
-    msg = MIMEMultipart()
-    msg['From'] = sender_email
-    msg['To'] = email_config["recipient_email"]
-    msg['Subject'] = 'Multiple Attachments'
-
-    for attachment in email_config["attachments"]:
-        attach_file = open(attachment, 'rb')
-        payload = MIMEBase('application', 'octate-stream')
-        payload.set_payload((attach_file).read())
-        encoders.encode_base64(payload)
-        payload.add_header('Content-Disposition', f'attachment; filename={attachment}')
-        msg.attach(payload)
-
-    text = "Please find the attached files."
-    msg.attach(MIMEText(text, 'plain'))
-
-    server.send_message(msg)
-    del msg
-
-    server.quit()
+    return send_emails([email_config])
+
+def print_summary(summary):
+    print(f"Sent {summary['sent']}/{summary['messages']} emails in {summary['seconds']}s "
+          f"({summary['messages_per_s']} msg/s, {summary['mb_per_s']} MB/s) over "
+          f"{summary['connections_opened']} connection(s), {summary['retries']} retries, "
+          f"{summary['attachments_encoded']} attachment(s) encoded")
+    for rcpt, why in summary["refused"].items():
+        print(f"  Refused {rcpt}: {why}")
+    for failure in summary["failures"]:
+        print(f"  FAILED {', '.join(failure['recipients'] or [])} after {failure['attempts']} attempt(s): {failure['error']}")
 
 if __name__ == "__main__":
     with open('email_config.json') as f:
         email_configs = json.load(f)
 
-    for email_config in email_configs["email_configurations"]:
-        send_email(email_config)
+    # Optional "mailer": {"workers", "per_server", "retries", "backoff", "max_messages_per_connection"}
+    summary = send_emails(email_configs["email_configurations"], email_configs.get("mailer"))
+    print_summary(summary)
+    raise SystemExit(1 if summary["failed"] else 0)
@@ -0,0 +1,154 @@
+import json
+import queue
+import threading
+import time
+from collections import deque
+
+
+def format_sse(event_id, event_type, data):
+    """One Server-Sent Events frame."""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+class EventBus:
+    """
+    In-process publish/subscribe for push updates. Keeps the last `history` events so a
+    reconnecting browser (Last-Event-ID) gets what it missed instead of a full reload.
+    """
+
+    def __init__(self, history=500, subscriber_queue=1000):
+        self._history = deque(maxlen=history)
+        self._subscribers = set()
+        self._queue_size = subscriber_queue
+        self._lock = threading.Lock()
+        self._next_id = 1
+
+    def publish(self, event_type, data):
+        with self._lock:
+            event = (self._next_id, event_type, data)
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # A stalled client must not block publishers; it will resync on reconnect
+                self.unsubscribe(q)
+        return event[0]
+
+    def subscribe(self, last_event_id=None):
+        """Returns a queue of (id, type, data); pre-filled with history newer than last_event_id."""
+        q = queue.Queue(self._queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event[0] > last_event_id:
+                        q.put_nowait(event)
+            self._subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self._lock:
+            self._subscribers.discard(q)
+
+    def is_subscribed(self, q):
+        return q in self._subscribers
+
+    def stream(self, last_event_id=None, heartbeat=15.0, extra=None):
+        """
+        Generator of SSE frames for one client. `extra` is an optional callable polled about once
+        a second that returns a list of (type, data) events private to this client (e.g. log lines).
+        """
+        q = self.subscribe(last_event_id)
+        last_sent = time.monotonic()
+        try:
+            yield "retry: 3000\n\n"
+            while self.is_subscribed(q):
+                try:
+                    event_id, event_type, data = q.get(timeout=1.0)
+                    yield format_sse(event_id, event_type, data)
+                    last_sent = time.monotonic()
+                except queue.Empty:
+                    pass
+                if extra is not None:
+                    for event_type, data in extra():
+                        # Private events are not replayable, so they carry no bus id
+                        yield f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+                        last_sent = time.monotonic()
+                if time.monotonic() - last_sent >= heartbeat:
+                    yield ": keep-alive\n\n"
+                    last_sent = time.monotonic()
+        finally:
+            self.unsubscribe(q)
+
+
+def parse_sse(lines):
+    """Turns an iterable of SSE text lines back into (id, type, data) tuples."""
+    event_id, event_type, data = None, "message", []
+    for line in lines:
+        if not line:
+            if data:
+                yield event_id, event_type, json.loads("\n".join(data))
+            event_id, event_type, data = None, "message", []
+        elif line.startswith(":"):
+            continue
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "id":
+                event_id = int(value)
+            elif field == "event":
+                event_type = value
+            elif field == "data":
+                data.append(value)
+
+
+class EventRelay:
+    """
+    Hub side: keeps one upstream /events connection per agent and republishes everything on a
+    local EventBus (tagged with the server), so any number of browsers cost each agent one stream.
+    Pass `bus` to publish on an existing EventBus, so its subscribers outlive the relay.
+    """
+
+    def __init__(self, servers, port, session=None, retry=5.0, bus=None):
+        import requests  # Only the Hub needs it
+        self.servers = list(servers)
+        self.port = port
+        self.retry = retry
+        self.session = session or requests.Session()
+        self.bus = bus or EventBus()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for ip in self.servers:
+            t = threading.Thread(target=self._follow, args=(ip,), name=f"relay:{ip}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _follow(self, ip):
+        last_id = None
+        while not self._stop.is_set():
+            try:
+                headers = {"Last-Event-ID": str(last_id)} if last_id is not None else {}
+                with self.session.get(f"http://{ip}:{self.port}/events", headers=headers,
+                                      stream=True, timeout=(5, 60)) as res:
+                    res.raise_for_status()
+                    self.bus.publish("server_status", {"server": ip, "online": True})
+                    for event_id, event_type, data in parse_sse(res.iter_lines(decode_unicode=True)):
+                        if self._stop.is_set():
+                            return
+                        if event_id is not None:
+                            last_id = event_id
+                        data = dict(data, server=ip) if isinstance(data, dict) else {"server": ip, "data": data}
+                        self.bus.publish(event_type, data)
+            except Exception as e:
+                if self._stop.is_set():
+                    return  # Replaced; the bus belongs to the next relay now
+                self.bus.publish("server_status", {"server": ip, "online": False, "error": str(e)})
+            self._stop.wait(self.retry)
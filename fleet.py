@@ -0,0 +1,136 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from instrument import timed
+
+# Agent endpoints the dashboard polls, keyed by the name used in /api/fleet?endpoints=...
+ENDPOINTS = {
+    "scan": "/scan",
+    "folders": "/folders",
+    "disk": "/disk-usage",
+    "queue": "/get-queue",
+}
+
+
+class FleetClient:
+    """
+    Queries every agent concurrently over pooled keep-alive connections.
+    Identical requests arriving together share one fan-out (single-flight), and results are
+    reused for `ttl` seconds, so many dashboard viewers cost the agents about as much as one.
+    At most `max_cached` results are kept (least recently used go first).
+
+    Callers that may outlive a config change hold the client with acquire()/release(); close()
+    then waits for the last of them before shutting the connections down.
+    """
+
+    def __init__(self, servers, port, timeout=3.0, ttl=2.0, max_workers=16, max_cached=256):
+        self.servers = list(servers)
+        self.port = port
+        self.timeout = timeout
+        self.ttl = ttl
+        self.max_cached = max_cached
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.servers) or 1, pool_maxsize=max_workers)
+        self.session.mount("http://", adapter)
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fleet")
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # key -> (expires_at, result), least recently used first
+        self._inflight = {}          # key -> {"done": Event, "result": ...} for the request in progress
+        self._users = 0
+        self._closing = False
+
+    def _get(self, ip, path, params=None):
+        started = time.perf_counter()
+        try:
+            res = self.session.get(f"http://{ip}:{self.port}{path}", params=params, timeout=self.timeout)
+            res.raise_for_status()
+            return {"ok": True, "data": res.json(),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+        except Exception as e:
+            return {"ok": False, "error": str(e),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    @timed("fleet_fan_out")
+    def _fan_out(self, paths, params=None):
+        """Runs every (server, path) pair at once and merges them into one payload."""
+        jobs = {(ip, name): self.pool.submit(self._get, ip, path, params)
+                for ip in self.servers for name, path in paths.items()}
+        servers = {ip: {} for ip in self.servers}
+        failed = set()
+        for (ip, name), future in jobs.items():
+            result = future.result()
+            servers[ip][name] = result
+            if not result["ok"]:
+                failed.add(ip)
+        return {"servers": servers, "failed": sorted(failed), "generated_at": time.time()}
+
+    def query(self, names=None, params=None):
+        """Fan-out for the given ENDPOINTS names (all by default), deduplicated and cached."""
+        names = sorted(names or ENDPOINTS)
+        paths = {n: ENDPOINTS[n] for n in names if n in ENDPOINTS}
+        return self.fetch(paths, params)
+
+    def fetch(self, paths, params=None):
+        key = (tuple(sorted(paths.items())), tuple(sorted((params or {}).items())))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached and cached[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                return cached[1]
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = {"done": threading.Event(), "result": None}
+        if not leader:
+            # Someone else is already asking the agents; share their answer
+            flight["done"].wait()
+            if flight["result"] is not None:
+                return flight["result"]
+            return self._fan_out(paths, params)
+        try:
+            result = self._fan_out(paths, params)
+            flight["result"] = result
+            with self._lock:
+                self._remember(key, result)
+            return result
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight["done"].set()
+
+    def _remember(self, key, result):
+        """Caches result (lock held), dropping expired entries and then the least recently used."""
+        now = time.monotonic()
+        for stale in [k for k, (expires, _) in self._cache.items() if expires <= now]:
+            del self._cache[stale]
+        self._cache[key] = (now + self.ttl, result)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_cached:
+            self._cache.popitem(last=False)
+
+    def acquire(self):
+        with self._lock:
+            self._users += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._users -= 1
+            shut = self._closing and not self._users
+        if shut:
+            self._shutdown()
+
+    def close(self):
+        """Shuts down now if nobody holds the client, otherwise when the last holder releases it."""
+        with self._lock:
+            self._closing = True
+            shut = not self._users
+        if shut:
+            self._shutdown()
+
+    def _shutdown(self):
+        self.pool.shutdown(wait=False)
+        self.session.close()
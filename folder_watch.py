@@ -0,0 +1,190 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from instrument import timed
+
+# Native change notifications are only available on Windows with pywin32 installed
+try:
+    import win32file
+    import win32con
+except ImportError:
+    win32file = None
+
+# Changes the etag across agent restarts so browsers never reuse a stale 304
+_INSTANCE = uuid.uuid4().hex[:8]
+
+
+def versioned_etag(version):
+    """ETag of a listing at `version`, for anything that lists like a FolderWatcher."""
+    return f"{_INSTANCE}-{version}"
+
+
+class FolderWatcher:
+    """
+    Keeps an in-memory listing of one folder with a version counter that is bumped on every change.
+    Uses ReadDirectoryChangesW where available, otherwise polls the folder's mtime and only
+    re-lists (with os.scandir) when it moved. A full rescan every `full_rescan` seconds catches
+    size changes and anything a notification missed.
+
+    kind: "files", "dirs" or None for every entry.
+    ignore_suffixes: names ending with any of these are left out (e.g. in-progress transfers).
+    include_suffixes: files ending with any of these are listed even with kind="dirs" (e.g. archived runs).
+    """
+
+    def __init__(self, path, kind=None, interval=2.0, full_rescan=60.0, ignore_suffixes=(), include_suffixes=()):
+        self.path = path
+        self.kind = kind
+        self.ignore_suffixes = tuple(ignore_suffixes)
+        self.include_suffixes = tuple(include_suffixes)
+        self.interval = interval
+        self.full_rescan = full_rescan
+        self.version = 0
+        self._entries = {}
+        self._exists = False
+        self._dir_mtime = None
+        self._last_full = 0
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._listeners = []
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        if self._threads:
+            return self
+        self.rescan()
+        self._spawn(self._poll_loop, "poll")
+        if win32file is not None:
+            self._spawn(self._native_loop, "native")
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _spawn(self, target, suffix):
+        t = threading.Thread(target=target, name=f"watch-{suffix}:{self.path}", daemon=True)
+        t.start()
+        self._threads.append(t)
+
+    def subscribe(self, callback):
+        """callback(watcher, added, removed) is called after every change, with entry dicts."""
+        self._listeners.append(callback)
+
+    def retarget(self, path):
+        """
+        Points the watcher at another folder (config reload) and re-lists it; listeners see the
+        switch as the old entries removed and the new ones added. The native watcher moves over
+        after its next notification, the poll loop covers the new folder in the meantime.
+        """
+        if path == self.path:
+            return False
+        self.path = path
+        return self.rescan()
+
+    # --- Reading ---
+    def entries(self):
+        """Current entries as a name -> {"name", "is_dir", "size", "mtime"} dict (do not mutate)."""
+        return self._entries
+
+    def names(self):
+        return list(self._entries)
+
+    def exists(self):
+        return self._exists
+
+    def etag(self):
+        return versioned_etag(self.version)
+
+    def wait_for_change(self, version, timeout=None):
+        """Blocks until the version moves past `version` (or timeout); returns the current version."""
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    # --- Scanning ---
+    @timed("dir_listing")
+    def _scan(self):
+        entries = {}
+        with os.scandir(self.path) as it:
+            for e in it:
+                if self.ignore_suffixes and e.name.endswith(self.ignore_suffixes):
+                    continue
+                try:
+                    is_dir = e.is_dir()
+                    if self.kind == "files" and is_dir:
+                        continue
+                    if self.kind == "dirs" and not is_dir and not (self.include_suffixes and e.name.endswith(self.include_suffixes)):
+                        continue
+                    st = e.stat()
+                    entries[e.name] = {"name": e.name, "is_dir": is_dir,
+                                       "size": 0 if is_dir else st.st_size, "mtime": st.st_mtime}
+                except OSError:
+                    continue  # Entry vanished between listing and stat
+        return dict(sorted(entries.items()))
+
+    def rescan(self):
+        """Re-lists the folder; bumps the version and notifies listeners if anything differs."""
+        try:
+            dir_mtime = os.stat(self.path).st_mtime_ns
+            entries = self._scan()
+            exists = True
+        except OSError:
+            dir_mtime, entries, exists = None, {}, False
+        self._last_full = time.monotonic()
+
+        with self._lock:
+            old = self._entries
+            self._dir_mtime = dir_mtime
+            if entries == old and exists == self._exists:
+                return False
+            self._entries, self._exists = entries, exists
+            self.version += 1
+            self._changed.notify_all()
+
+        added = [entries[n] for n in entries.keys() - old.keys()]
+        removed = [old[n] for n in old.keys() - entries.keys()]
+        for callback in self._listeners:
+            try:
+                callback(self, added, removed)
+            except Exception as e:
+                logging.error(f"Folder watch listener failed for {self.path}: {e}")
+        return True
+
+    def _poll_loop(self):
+        while not self._stop.wait(self.interval):
+            try:
+                try:
+                    dir_mtime = os.stat(self.path).st_mtime_ns
+                except OSError:
+                    dir_mtime = None
+                stale = time.monotonic() - self._last_full >= self.full_rescan
+                if dir_mtime != self._dir_mtime or stale:
+                    self.rescan()
+            except Exception as e:
+                logging.error(f"Folder watch poll failed for {self.path}: {e}")
+
+    def _native_loop(self):
+        flags = (win32con.FILE_NOTIFY_CHANGE_FILE_NAME | win32con.FILE_NOTIFY_CHANGE_DIR_NAME |
+                 win32con.FILE_NOTIFY_CHANGE_SIZE | win32con.FILE_NOTIFY_CHANGE_LAST_WRITE)
+        while not self._stop.is_set():
+            path = self.path
+            try:
+                handle = win32file.CreateFile(
+                    path, 0x0001,  # FILE_LIST_DIRECTORY
+                    win32con.FILE_SHARE_READ | win32con.FILE_SHARE_WRITE | win32con.FILE_SHARE_DELETE,
+                    None, win32con.OPEN_EXISTING, win32con.FILE_FLAG_BACKUP_SEMANTICS, None)
+            except Exception:
+                # Folder missing or share offline; the poll loop covers it until it comes back
+                self._stop.wait(self.full_rescan)
+                continue
+            try:
+                while not self._stop.is_set() and path == self.path:
+                    # Blocks until something in the folder changes
+                    win32file.ReadDirectoryChangesW(handle, 8192, False, flags, None, None)
+                    self.rescan()
+            except Exception as e:
+                logging.warning(f"Native folder watch stopped for {self.path}: {e}")
+            finally:
+                handle.Close()
@@ -0,0 +1,200 @@
+import logging
+import math
+import re
+import sys
+import threading
+import time
+from array import array
+from bisect import bisect_left
+
+import psutil
+from instrument import timed
+
+# (name, bucket seconds, buckets kept); step 0 is the raw tier that stores every sample
+DEFAULT_TIERS = (("raw", 0, 720), ("1m", 60, 1440), ("5m", 300, 2016), ("1h", 3600, 720))
+NAN = float('nan')
+
+
+def mount_key(mount):
+    """Field-safe name for a mount: 'C:' -> 'C', '/data/x' -> 'data_x', '/' -> 'root'."""
+    return re.sub(r'[^0-9A-Za-z]+', '_', mount).strip('_') or 'root'
+
+
+class Tier:
+    """
+    Fixed-size columnar ring buffer: one array('d') per field plus one for timestamps, sharing a
+    write head. With step > 0 incoming samples are averaged into step-second buckets and one row is
+    written per bucket.
+    """
+
+    def __init__(self, name, step, capacity, fields):
+        self.name = name
+        self.step = step
+        self.capacity = capacity
+        self.fields = tuple(fields)
+        self._t = array('d', [NAN]) * capacity
+        self._cols = {f: array('d', [NAN]) * capacity for f in self.fields}
+        self._head = 0     # next slot to write
+        self._count = 0
+        self._bucket = None
+        self._sums = dict.fromkeys(self.fields, 0.0)
+        self._ns = dict.fromkeys(self.fields, 0)
+        self._lock = threading.Lock()
+
+    def add(self, ts, sample):
+        with self._lock:
+            if not self.step:
+                self._write(ts, sample)
+                return
+            bucket = ts - ts % self.step
+            if self._bucket is not None and bucket != self._bucket:
+                self._flush()
+            self._bucket = bucket
+            for f in self.fields:
+                v = sample.get(f, NAN)
+                if not math.isnan(v):
+                    self._sums[f] += v
+                    self._ns[f] += 1
+
+    def _flush(self):
+        self._write(self._bucket, {f: self._sums[f] / self._ns[f] if self._ns[f] else NAN for f in self.fields})
+        self._sums = dict.fromkeys(self.fields, 0.0)
+        self._ns = dict.fromkeys(self.fields, 0)
+
+    def _write(self, ts, row):
+        i = self._head
+        self._t[i] = ts
+        for f in self.fields:
+            self._cols[f][i] = row.get(f, NAN)
+        self._head = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    def _ordered(self, a):
+        if self._count < self.capacity:
+            return a[:self._count]
+        return a[self._head:] + a[:self._head]
+
+    def window(self, since=None, fields=None):
+        """{"t": array, field: array, ...} oldest first, only rows with t >= since."""
+        fields = [f for f in (fields or self.fields) if f in self._cols]
+        with self._lock:
+            t = self._ordered(self._t)
+            cols = {f: self._ordered(self._cols[f]) for f in fields}
+        start = bisect_left(t, since) if since is not None else 0
+        out = {"t": t[start:]}
+        for f in fields:
+            out[f] = cols[f][start:]
+        return out
+
+    def __len__(self):
+        return self._count
+
+
+def columns_to_json(cols):
+    """Array columns -> JSON-safe lists (NaN, i.e. no data, becomes null)."""
+    return {k: [None if math.isnan(v) else round(v, 3) for v in col] for k, col in cols.items()}
+
+
+def columns_to_bytes(cols):
+    """Column-major little-endian float64: all of "t", then each field in order (NaN = no data)."""
+    out = bytearray()
+    for col in cols.values():
+        if sys.byteorder == 'big':
+            col = array('d', col)
+            col.byteswap()
+        out += col.tobytes()
+    return bytes(out)
+
+
+class HostMetrics:
+    """
+    Samples disk usage for `mounts`, CPU and memory (plus any `extra` counters, e.g. SAS/perl
+    process counts) every `interval` seconds into fixed-size tiers, so the latest values and
+    any history window are served from memory without new syscalls.
+
+    extra: callable returning {name: number} for the names in extra_fields.
+    Subscribers get callback(metrics, ts, sample) after every sample.
+    """
+
+    def __init__(self, mounts, interval=5.0, extra=None, extra_fields=(), tiers=DEFAULT_TIERS):
+        self.mounts = list(mounts)
+        self.interval = interval
+        self.extra = extra
+        self.fields = ["cpu_percent", "mem_percent", "mem_available_gb"]
+        for m in self.mounts:
+            k = mount_key(m)
+            self.fields += [f"disk_{k}_total_gb", f"disk_{k}_used_gb", f"disk_{k}_free_gb", f"disk_{k}_percent"]
+        self.fields += list(extra_fields)
+        self.tiers = {name: Tier(name, step, capacity, self.fields) for name, step, capacity in tiers}
+        self._latest = (None, {})
+        self._listeners = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            psutil.cpu_percent(interval=None)  # Prime the counter; the first reading is always 0
+            self._thread = threading.Thread(target=self._run, name="host-metrics", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.sample()
+            except Exception as e:
+                logging.error(f"Host metrics sample failed: {e}")
+            if self._stop.wait(max(0.0, self.interval - (time.monotonic() - started))):
+                return
+
+    @timed("host_metrics_sample")
+    def sample(self):
+        ts = time.time()
+        mem = psutil.virtual_memory()
+        s = {"cpu_percent": psutil.cpu_percent(interval=None),
+             "mem_percent": mem.percent,
+             "mem_available_gb": mem.available / 1024**3}
+        for m in self.mounts:
+            k = mount_key(m)
+            try:
+                usage = psutil.disk_usage(m)
+                s.update({f"disk_{k}_total_gb": usage.total / 1024**3, f"disk_{k}_used_gb": usage.used / 1024**3,
+                          f"disk_{k}_free_gb": usage.free / 1024**3, f"disk_{k}_percent": usage.percent})
+            except OSError:
+                pass  # Drive missing or offline: stays NaN for this sample
+        if self.extra is not None:
+            s.update(self.extra())
+        for tier in self.tiers.values():
+            tier.add(ts, s)
+        self._latest = (ts, s)
+        for callback in self._listeners:
+            try:
+                callback(self, ts, s)
+            except Exception as e:
+                logging.error(f"Host metrics listener failed: {e}")
+        return s
+
+    def latest(self):
+        """(timestamp, {field: value}) of the last sample; (None, {}) before the first one."""
+        return self._latest
+
+    def disk(self, mount):
+        """Latest {"total", "used", "free", "percent"} for one mount (GB), or None if unavailable."""
+        ts, s = self._latest
+        k = mount_key(mount)
+        if f"disk_{k}_percent" not in s:
+            return None
+        return {"total": round(s[f"disk_{k}_total_gb"], 1), "used": round(s[f"disk_{k}_used_gb"], 1),
+                "free": round(s[f"disk_{k}_free_gb"], 1), "percent": s[f"disk_{k}_percent"]}
+
+    def history(self, tier="raw", since=None, fields=None):
+        if tier not in self.tiers:
+            raise KeyError(tier)
+        return self.tiers[tier].window(since, fields)
@@ -0,0 +1,299 @@
+import collections
+import functools
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers a cached listing (sub-ms) up to a slow AD lookup or share transfer
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(v):
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = collections.defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            self._values[key] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}   # labels -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(n, "") for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = f'le="{_number(bound)}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [le])} {cumulative}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, [inf])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {series[-1]}")
+        return lines
+
+
+class CallbackMetric:
+    """Value read at scrape time: fn() returns a number, or {label value(s): number}."""
+
+    def __init__(self, name, help, fn, type="gauge", labelnames=()):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.type = type
+        self.labelnames = tuple(labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        try:
+            value = self.fn()
+        except Exception:
+            return lines
+        if isinstance(value, dict):
+            for key, v in sorted(value.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(v)}")
+        elif value is not None:
+            lines.append(f"{self.name} {_number(value)}")
+        return lines
+
+
+class Registry:
+    """Process-wide set of metrics; asking twice for the same name returns the same metric."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, name, factory):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = factory()
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(name, lambda: Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(name, lambda: Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name, help, fn, type="gauge", labelnames=()):
+        """Registers (or replaces) a scrape-time metric."""
+        with self._lock:
+            self._metrics[name] = CallbackMetric(name, help, fn, type, labelnames)
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = [self._metrics[n] for n in sorted(self._metrics)]
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+histogram = REGISTRY.histogram
+
+SPANS = histogram("span_duration_seconds", "Time spent in instrumented hot paths.", ("span",))
+
+
+def span(name):
+    """Times a block (`with span("log_read"):`) into span_duration_seconds{span=name}."""
+    return SPANS.time(span=name)
+
+
+def timed(name):
+    """Decorator form of span()."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+# --- SAMPLING PROFILER ---
+class SamplingProfiler:
+    """
+    Samples every thread's stack `hz` times a second and counts them as folded stacks
+    ("root;caller;callee count" per line), the input format of flamegraph.pl / speedscope.
+    Costs nothing while stopped.
+    """
+
+    def __init__(self, hz=100):
+        self.hz = hz
+        self.counts = collections.Counter()
+        self.samples = 0
+        self.started_at = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=None, hz=None):
+        """Starts sampling (from scratch) for `duration` seconds, or until stop()."""
+        with self._lock:
+            if self.running:
+                return False
+            self.hz = hz or self.hz
+            self.counts = collections.Counter()
+            self.samples = 0
+            self.started_at = time.time()
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(duration,), name="profiler", daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run(self, duration):
+        me = threading.get_ident()
+        deadline = time.monotonic() + duration if duration else None
+        names = {}
+        while not self._stop.wait(1.0 / self.hz):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self):
+        return "\n".join(f"{stack} {n}" for stack, n in self.counts.most_common()) + "\n"
+
+    def status(self):
+        return {"running": self.running, "hz": self.hz, "samples": self.samples,
+                "stacks": len(self.counts), "started_at": self.started_at}
+
+
+PROFILER = SamplingProfiler()
+
+
+# --- FLASK ---
+def instrument_app(app, service, profiling_enabled=lambda: False):
+    """
+    Adds per-endpoint latency histograms and request counters to a Flask app and exposes
+    /metrics (Prometheus text). /debug/profile (POST start/stop, GET folded stacks) is
+    available only while profiling_enabled() returns True, so it can be switched on at
+    runtime through config.json.
+    """
+    from flask import request, g, Response, jsonify, abort
+
+    latency = histogram("http_request_duration_seconds", "Request latency by endpoint.",
+                        ("service", "endpoint", "method"))
+    requests_total = counter("http_requests_total", "Requests by endpoint and status.",
+                             ("service", "endpoint", "method", "status"))
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None:
+            # The URL rule, not the raw path, keeps label cardinality bounded
+            endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+            latency.observe(time.perf_counter() - started, service=service, endpoint=endpoint, method=request.method)
+            requests_total.inc(service=service, endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/debug/profile', methods=['GET', 'POST'])
+    def debug_profile():
+        """POST {"action": "start", "seconds": 30, "hz": 100} or {"action": "stop"}; GET ?format=folded."""
+        if not profiling_enabled():
+            abort(404)
+        if request.method == 'POST':
+            body = request.get_json(silent=True) or {}
+            if body.get('action') == 'stop':
+                PROFILER.stop()
+            else:
+                PROFILER.start(duration=body.get('seconds', 30), hz=body.get('hz'))
+            return jsonify(PROFILER.status())
+        if request.args.get('format') == 'folded':
+            return Response(PROFILER.folded(), mimetype='text/plain')
+        return jsonify(PROFILER.status())
+
+    return app
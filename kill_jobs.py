@@ -0,0 +1,162 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import psutil
+from instrument import counter
+
+PROCESSES_KILLED = counter("kill_processes_total", "Processes signalled by kill jobs.", ("how",))
+KILL_ROUNDS = counter("kill_rounds_total", "Terminate-and-wait rounds (more than one per job means retries).")
+DELETES = counter("delete_attempts_total", "File deletes by outcome.", ("result",))
+DELETE_RETRIES = counter("delete_retries_total", "Delete retries while a file was still locked.")
+KILL_JOBS = counter("kill_jobs_total", "Finished kill-and-delete jobs by final state.", ("state",))
+
+
+def terminate_and_wait(pids, timeout=10.0):
+    """
+    Terminates all pids together and waits on their actual exit; whatever is still alive at the
+    deadline is killed. Returns the number of processes that were signalled.
+    """
+    procs = []
+    for pid in pids:
+        try:
+            proc = psutil.Process(pid)
+            proc.terminate()
+            procs.append(proc)
+        except (psutil.NoSuchProcess, psutil.ZombieProcess):
+            continue
+        except psutil.AccessDenied as e:
+            logging.warning(f"Access denied terminating PID {pid}: {e}")
+    if not procs:
+        return 0
+
+    PROCESSES_KILLED.inc(len(procs), how="terminate")
+    gone, alive = psutil.wait_procs(procs, timeout=timeout)
+    if alive:
+        PROCESSES_KILLED.inc(len(alive), how="kill")
+    for proc in alive:
+        try:
+            proc.kill()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            pass
+    if alive:
+        psutil.wait_procs(alive, timeout=min(timeout, 5.0))
+    return len(procs)
+
+
+def remove_with_retry(path, deadline=15.0, first_delay=0.05, max_delay=1.0):
+    """Deletes path, retrying with exponential backoff while Windows still holds the file lock."""
+    delay = first_delay
+    give_up = time.monotonic() + deadline
+    while True:
+        try:
+            os.remove(path)
+            DELETES.inc(result="deleted")
+            return True
+        except FileNotFoundError:
+            DELETES.inc(result="missing")
+            return True
+        except OSError:
+            if time.monotonic() + delay > give_up:
+                DELETES.inc(result="locked")
+                return False
+            DELETE_RETRIES.inc()
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+
+class KillJobManager:
+    """
+    Runs kill-and-delete jobs on a background pool so the HTTP request returns immediately.
+    Jobs for different files run concurrently; a second request for a file whose job is still
+    running gets that job back instead of starting another one.
+
+    find_pids(filename) -> pids to stop; path_for(filename) -> file to delete;
+    on_update(job) is called on every state change (e.g. to publish an event).
+    """
+
+    def __init__(self, find_pids, path_for, on_update=None, max_workers=8,
+                 wait_timeout=10.0, delete_deadline=15.0, rounds=3, keep=200):
+        self.find_pids = find_pids
+        self.path_for = path_for
+        self.on_update = on_update
+        self.wait_timeout = wait_timeout
+        self.delete_deadline = delete_deadline
+        self.rounds = rounds
+        self.keep = keep
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kill")
+        self._jobs = OrderedDict()
+        self._active = {}   # filename -> job_id
+        self._lock = threading.Lock()
+
+    def submit(self, filename):
+        with self._lock:
+            job_id = self._active.get(filename)
+            if job_id:
+                return dict(self._jobs[job_id])
+            job = {"job_id": uuid.uuid4().hex, "filename": filename, "state": "queued",
+                   "killed": 0, "deleted": False, "error": None,
+                   "created": time.time(), "finished": None}
+            self._jobs[job["job_id"]] = job
+            self._active[filename] = job["job_id"]
+            self._evict()
+        self._notify(job)
+        self.pool.submit(self._run, job)
+        return dict(job)
+
+    def _evict(self):
+        # Called with the lock held. Oldest finished jobs go first; queued or running ones are kept
+        # even above `keep`, so /kill-status and repeated submits always find them
+        excess = len(self._jobs) - self.keep
+        if excess <= 0:
+            return
+        active = set(self._active.values())
+        done = [job_id for job_id, job in self._jobs.items()
+                if job["finished"] is not None and job_id not in active]
+        for job_id in done[:excess]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _update(self, job, **changes):
+        with self._lock:
+            job.update(changes)
+        self._notify(job)
+
+    def _notify(self, job):
+        if self.on_update:
+            try:
+                self.on_update(dict(job))
+            except Exception as e:
+                logging.error(f"Kill job listener failed: {e}")
+
+    def _run(self, job):
+        filename = job["filename"]
+        try:
+            self._update(job, state="killing")
+            for _ in range(self.rounds):
+                # Perl and SAS are stopped together; the wait is on their real exit, not a sleep
+                pids = self.find_pids(filename)
+                if not pids:
+                    break
+                KILL_ROUNDS.inc()
+                killed = terminate_and_wait(pids, self.wait_timeout)
+                self._update(job, killed=job["killed"] + killed)
+
+            self._update(job, state="deleting")
+            deleted = remove_with_retry(self.path_for(filename), self.delete_deadline)
+            self._update(job, state="done" if deleted else "failed", deleted=deleted,
+                         error=None if deleted else "File is still locked", finished=time.time())
+        except Exception as e:
+            self._update(job, state="failed", error=str(e), finished=time.time())
+        finally:
+            KILL_JOBS.inc(state=job["state"])
+            with self._lock:
+                self._active.pop(filename, None)
+                self._evict()
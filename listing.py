@@ -0,0 +1,170 @@
+import base64
+import fnmatch
+import gzip
+import json
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+SORT_FIELDS = ("name", "mtime", "size")
+MAX_LIMIT = 5000
+DEFAULT_LIMIT = 500
+
+
+class ListingError(ValueError):
+    pass
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, sort='name'):
+    """The sort key in a next_cursor; ListingError unless it has the shape of a `sort` key."""
+    try:
+        key = tuple(json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))))
+    except (ValueError, TypeError):
+        raise ListingError("invalid cursor")
+    if sort == 'name':
+        valid = len(key) == 1 and isinstance(key[0], str)
+    else:
+        valid = (len(key) == 2 and isinstance(key[0], (int, float)) and not isinstance(key[0], bool)
+                 and isinstance(key[1], str))
+    if not valid:
+        raise ListingError(f"cursor does not match sort={sort}")
+    return key
+
+
+class ListingQuery:
+    """
+    Listing parameters from a query string:
+      sort=name|mtime|size  order=asc|desc  prefix=<str>  glob=<pattern>  fields=a,b
+      limit=<n>  cursor=<next_cursor from the previous page>  count_only=1
+    Without limit/cursor every match is returned (the old unpaged behaviour).
+    """
+
+    def __init__(self, args, fields_available, default_fields):
+        self.sort = args.get('sort', 'name')
+        if self.sort not in SORT_FIELDS:
+            raise ListingError(f"sort must be one of {', '.join(SORT_FIELDS)}")
+        self.order = args.get('order', 'asc')
+        if self.order not in ('asc', 'desc'):
+            raise ListingError("order must be asc or desc")
+        self.prefix = args.get('prefix') or None
+        self.glob = args.get('glob') or None
+        requested = [f for f in args.get('fields', '').split(',') if f]
+        unknown = [f for f in requested if f not in fields_available]
+        if unknown:
+            raise ListingError(f"unknown fields: {', '.join(unknown)}")
+        self.fields = requested or list(default_fields)
+        self.projected = bool(requested)
+        self.cursor = decode_cursor(args['cursor'], self.sort) if args.get('cursor') else None
+        limit = args.get('limit')
+        try:
+            self.limit = min(int(limit), MAX_LIMIT) if limit else (DEFAULT_LIMIT if self.cursor else None)
+        except ValueError:
+            raise ListingError("limit must be an integer")
+        self.count_only = args.get('count_only', '') in ('1', 'true', 'yes')
+        self.key = "&".join(f"{k}={args[k]}" for k in sorted(args) if k != 'max_age')
+
+    def etag(self, base):
+        """Per-query ETag: the listing version plus a hash of the parameters."""
+        return f"{base}-{zlib.crc32(self.key.encode()):08x}" if self.key else base
+
+
+def _sort_key(sort, entry):
+    if sort == 'name':
+        return (entry["name"],)
+    return (entry[sort], entry["name"])
+
+
+class Lister:
+    """
+    Sorted, filtered views of a FolderWatcher listing for paged endpoints. Each distinct
+    (sort, prefix, glob) view is built once per listing version and reused by every page request
+    and every client until the folder changes. Pages are found by binary search on the sort key
+    of the cursor, so they stay stable while files come and go.
+    """
+
+    def __init__(self, watcher, max_views=16):
+        self.watcher = watcher
+        self.max_views = max_views
+        self._views = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _view(self, q):
+        version = self.watcher.version
+        key = (version, q.sort, q.prefix, q.glob)
+        with self._lock:
+            view = self._views.get(key)
+            if view is not None:
+                self._views.move_to_end(key)
+                return view
+        entries = self.watcher.entries().values()
+        if q.prefix:
+            entries = [e for e in entries if e["name"].startswith(q.prefix)]
+        if q.glob:
+            entries = [e for e in entries if fnmatch.fnmatch(e["name"], q.glob)]
+        items = sorted(entries, key=lambda e: _sort_key(q.sort, e))
+        view = (items, [_sort_key(q.sort, e) for e in items])
+        with self._lock:
+            self._views[key] = view
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        return view
+
+    def page(self, q, decorate=None):
+        """
+        {"items", "total_count", "matched_count", "next_cursor"} for one query; items are
+        projected to q.fields after decorate(entry) has added any computed fields (e.g. status).
+        """
+        items, keys = self._view(q)
+        result = {"total_count": len(self.watcher.entries()), "matched_count": len(items)}
+        if q.count_only:
+            return result
+
+        if q.order == 'asc':
+            start = bisect_right(keys, q.cursor) if q.cursor else 0
+            end = start + q.limit if q.limit else len(items)
+            chosen = items[start:end]
+            more = end < len(items)
+        else:
+            end = bisect_left(keys, q.cursor) if q.cursor else len(items)
+            start = max(0, end - q.limit) if q.limit else 0
+            chosen = items[start:end][::-1]
+            more = start > 0
+
+        rows = []
+        for entry in chosen:
+            row = decorate(entry) if decorate else entry
+            rows.append({f: row[f] for f in q.fields if f in row})
+        result["items"] = rows
+        result["next_cursor"] = encode_cursor(_sort_key(q.sort, chosen[-1])) if more and chosen else None
+        return result
+
+
+def gzip_responses(app, min_size=1024, level=5):
+    """Gzips JSON/text responses for clients that accept it (streams such as SSE are left alone)."""
+    from flask import request
+
+    @app.after_request
+    def _compress(response):
+        if (response.status_code < 200 or response.status_code >= 300 or response.is_streamed
+                or response.direct_passthrough or 'Content-Encoding' in response.headers
+                or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()
+                or not (response.mimetype.startswith('text/') or response.mimetype == 'application/json')):
+            return response
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(gzip.compress(data, compresslevel=level))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['Vary'] = 'Accept-Encoding'
+        etag, weak = response.get_etag()
+        if etag:
+            # A compressed body is a different representation; keep its validator distinct
+            response.set_etag(etag + "-gz", weak)
+        return response
+
+    return app
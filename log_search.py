@@ -0,0 +1,393 @@
+import fnmatch
+import logging
+import os
+import re
+import threading
+import time
+from array import array
+from itertools import accumulate, islice
+from db_pool import SQLitePool
+from instrument import timed, counter
+
+TOKEN = re.compile(rb"[A-Za-z0-9_]{2,}")
+QUERY_TOKEN = re.compile(r"[A-Za-z0-9_]{2,}")
+OFFSET_CHUNK = 1024        # line start offsets are stored 1024 lines to a row
+POSTING_BLOCK = 4096       # line numbers per postings row, so a search can stop after a few rows
+MAX_LINE_BYTES = 64 * 1024  # longer lines are indexed by their head only
+
+INDEXED_BYTES = counter("log_index_bytes_total", "Log bytes read into the search index.")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, folder TEXT NOT NULL, name TEXT NOT NULL,
+    file_id TEXT, size INTEGER NOT NULL DEFAULT 0, lines INTEGER NOT NULL DEFAULT 0, mtime REAL);
+CREATE TABLE IF NOT EXISTS line_offsets (
+    file INTEGER NOT NULL, chunk INTEGER NOT NULL, data BLOB NOT NULL,
+    PRIMARY KEY (file, chunk)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS postings (
+    term TEXT NOT NULL, file INTEGER NOT NULL, seq INTEGER NOT NULL, data BLOB NOT NULL,
+    PRIMARY KEY (term, file, seq)) WITHOUT ROWID;
+"""
+
+
+# --- Delta coding (postings and line offsets are increasing integers) ---
+# A blob is one typecode byte plus the deltas as an array of the narrowest type that holds them:
+# mostly 1-2 bytes per entry, and decoded in C (frombytes + accumulate) rather than byte by byte.
+_WIDTHS = (("B", 0xFF), ("H", 0xFFFF), ("I", 0xFFFFFFFF), ("Q", 0xFFFFFFFFFFFFFFFF))
+
+
+def encode_deltas(values, start=0):
+    deltas = [b - a for a, b in zip([start] + list(values[:-1]), values)]
+    top = max(deltas, default=0)
+    code = next(c for c, limit in _WIDTHS if top <= limit)
+    return code.encode() + array(code, deltas).tobytes()
+
+
+def decode_deltas(data, start=0):
+    if not data:
+        return []
+    deltas = array(chr(data[0]))
+    deltas.frombytes(data[1:])
+    return list(accumulate(deltas, initial=start))[1:]
+
+
+def _line_end(f, block_size=64 * 1024):
+    """Offset just past the next newline from f's position, or None if the file ends first."""
+    while True:
+        pos = f.tell()
+        block = f.read(block_size)
+        if not block:
+            return None
+        cut = block.find(b"\n")
+        if cut >= 0:
+            return pos + cut + 1
+
+
+def _run_signature(entry):
+    """mtimes of a run folder and of the two folders its logs live in (None where missing)."""
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+    log_dir = os.path.join(entry.path, "log")
+    return entry.stat().st_mtime_ns, mtime(log_dir), mtime(os.path.join(log_dir, "db"))
+
+
+def run_logs(folder):
+    """The logs of one run folder: log/db/proglogs.txt and log/*_P.log."""
+    log_dir = os.path.join(folder, "log")
+    found = []
+    proglogs = os.path.join(log_dir, "db", "proglogs.txt")
+    if os.path.isfile(proglogs):
+        found.append(proglogs)
+    try:
+        with os.scandir(log_dir) as it:
+            found += [e.path for e in it if e.name.endswith("_P.log") and e.is_file()]
+    except OSError:
+        pass
+    return found
+
+
+class LogSearchIndex:
+    """
+    Inverted index (term -> file, line numbers) over the run logs under `roots`, in one SQLite
+    file. A background thread picks up new run folders and indexes only what was appended to
+    each log since the last pass (from the stored byte size, up to the last complete line);
+    rotated or truncated logs are re-indexed, removed folders dropped.
+
+    Postings and line start offsets are stored as narrow delta arrays, so the index stays a
+    fraction of the log size, and context lines are read with a seek instead of a scan.
+    """
+
+    def __init__(self, roots, db_path="log_index.db", interval=30.0, max_bytes_per_pass=64 * 1024 * 1024):
+        self.roots = [r for r in dict.fromkeys(roots) if r]
+        self.db_path = db_path
+        self.interval = interval
+        self.max_bytes_per_pass = max_bytes_per_pass
+        self.pool = SQLitePool.for_path(db_path)
+        with self.pool.connection() as db:
+            db.executescript(SCHEMA)
+        self._write_lock = threading.Lock()
+        self._runs = {}   # run folder -> (mtime signature, its logs) from the last pass
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_pass = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="log-search-index", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logging.error(f"Log index refresh failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    # --- Indexing ---
+    def _discover(self):
+        """
+        {log path: run folder name} for every log under the roots. A run folder's logs are listed
+        again only when the mtime of the folder, its log/ or log/db/ changed since the last pass.
+        """
+        logs = {}
+        seen = {}
+        # A change in the same mtime tick as the last listing would not show, so recent folders are re-listed
+        settled = time.time_ns() - 2 * 10 ** 9
+        for root in self.roots:
+            try:
+                with os.scandir(root) as it:
+                    folders = [e for e in it if e.is_dir()]
+            except OSError:
+                continue
+            for e in folders:
+                try:
+                    signature = _run_signature(e)
+                except OSError:
+                    continue  # Removed while this pass ran
+                cached = self._runs.get(e.path)
+                found = cached[1] if cached is not None and cached[0] == signature else run_logs(e.path)
+                seen[e.path] = (signature if max(t or 0 for t in signature) < settled else None, found)
+                for path in found:
+                    logs[path] = e.name
+        self._runs = seen
+        return logs
+
+    @timed("log_index_refresh")
+    def refresh(self):
+        """One incremental pass; returns the number of bytes indexed."""
+        with self._write_lock:
+            logs = self._discover()
+            with self.pool.connection() as db:
+                known = {row["path"]: row for row in db.execute("SELECT * FROM files")}
+                for path in known.keys() - logs.keys():
+                    self._drop(db, known[path]["id"])
+            budget = self.max_bytes_per_pass
+            total = 0
+            for path, folder in logs.items():
+                if budget <= 0:
+                    break  # The rest waits for the next pass
+                try:
+                    done = self._index_file(path, folder, known.get(path), budget)
+                except OSError:
+                    continue
+                budget -= done
+                total += done
+            self.last_pass = time.time()
+            return total
+
+    def _drop(self, db, file_id):
+        db.execute("DELETE FROM postings WHERE file = ?", (file_id,))
+        db.execute("DELETE FROM line_offsets WHERE file = ?", (file_id,))
+        db.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def _index_file(self, path, folder, row, budget):
+        st = os.stat(path)
+        identity = f"{st.st_dev}-{st.st_ino}"
+        if row is not None and row["file_id"] == identity and row["size"] == st.st_size:
+            return 0
+        with self.pool.connection() as db:
+            if row is not None and (row["file_id"] != identity or st.st_size < row["size"]):
+                # Rotated or truncated: start over for this file
+                self._drop(db, row["id"])
+                row = None
+            if row is None:
+                cur = db.execute("INSERT INTO files (path, folder, name, file_id, size, lines, mtime) "
+                                 "VALUES (?, ?, ?, ?, 0, 0, ?)",
+                                 (path, folder, os.path.basename(path), identity, st.st_mtime))
+                file_no, start, line_no = cur.lastrowid, 0, 0
+            else:
+                file_no, start, line_no = row["id"], row["size"], row["lines"]
+
+            remaining = st.st_size - start
+            with open(path, "rb") as f:
+                f.seek(start)
+                # At least MAX_LINE_BYTES, so a nearly spent budget cannot mistake a line for an overlong one
+                data = f.read(min(remaining, max(budget, MAX_LINE_BYTES)))
+                # Only whole lines; a half-written last line is picked up complete next time
+                cut = data.rfind(b"\n") + 1
+                if cut:
+                    data, end = data[:cut], start + cut
+                elif len(data) == remaining:
+                    return 0
+                else:
+                    # One overlong line: index its head as the whole line and skip to its end
+                    end = _line_end(f)
+                    if end is None:
+                        return 0
+                    data = data[:MAX_LINE_BYTES] + b"\n"
+
+            terms = {}
+            offsets = []
+            pos = 0
+            # Split on "\n" only, so numbering matches what the tail readers show
+            for line in data[:-1].split(b"\n"):
+                line_no += 1
+                offsets.append(start + pos)
+                pos += len(line) + 1
+                for tok in set(TOKEN.findall(line)):
+                    terms.setdefault(tok.lower(), []).append(line_no)
+
+            first_line = line_no - len(offsets) + 1
+            self._append_offsets(db, file_no, first_line, offsets)
+            # Rows of up to POSTING_BLOCK line numbers, keyed by (and coded relative to) their first line
+            db.executemany("INSERT OR REPLACE INTO postings (term, file, seq, data) VALUES (?, ?, ?, ?)",
+                           [(t.decode("ascii"), file_no, lines[i], encode_deltas(lines[i:i + POSTING_BLOCK], lines[i]))
+                            for t, lines in terms.items() for i in range(0, len(lines), POSTING_BLOCK)])
+            db.execute("UPDATE files SET size = ?, lines = ?, mtime = ?, folder = ? WHERE id = ?",
+                       (end, line_no, st.st_mtime, folder, file_no))
+        INDEXED_BYTES.inc(end - start)
+        return end - start
+
+    def _append_offsets(self, db, file_no, first_line, offsets):
+        # Lines are numbered from 1; line n lives in chunk (n - 1) // OFFSET_CHUNK
+        i = 0
+        line = first_line
+        while i < len(offsets):
+            chunk = (line - 1) // OFFSET_CHUNK
+            room = OFFSET_CHUNK - (line - 1) % OFFSET_CHUNK
+            part = offsets[i:i + room]
+            existing = db.execute("SELECT data FROM line_offsets WHERE file = ? AND chunk = ?",
+                                  (file_no, chunk)).fetchone()
+            # At most OFFSET_CHUNK entries, so re-encoding the whole row is cheap
+            data = encode_deltas((decode_deltas(existing["data"]) if existing else []) + part)
+            db.execute("INSERT OR REPLACE INTO line_offsets (file, chunk, data) VALUES (?, ?, ?)",
+                       (file_no, chunk, data))
+            i += len(part)
+            line += len(part)
+
+    # --- Searching ---
+    def _line_offsets(self, db, file_no, wanted):
+        """{line number: start offset} for the wanted lines that exist, decoding only their chunks."""
+        by_chunk = {}
+        for n in wanted:
+            by_chunk.setdefault((n - 1) // OFFSET_CHUNK, []).append(n)
+        result = {}
+        for chunk, lines in by_chunk.items():
+            row = db.execute("SELECT data FROM line_offsets WHERE file = ? AND chunk = ?", (file_no, chunk)).fetchone()
+            if row is None:
+                continue
+            offsets = decode_deltas(row["data"])
+            for n in lines:
+                i = n - 1 - chunk * OFFSET_CHUNK
+                if i < len(offsets):
+                    result[n] = offsets[i]
+        return result
+
+    def _blocks(self, db, term, file_no):
+        """Line number blocks of one term in one file, in line order."""
+        for row in db.execute("SELECT seq, data FROM postings WHERE term = ? AND file = ? ORDER BY seq",
+                              (term, file_no)):
+            yield decode_deltas(row["data"], row["seq"])
+
+    def _matching_lines(self, db, terms, file_no):
+        """
+        Line numbers (ascending) that contain every term. The rarest term's blocks drive; the
+        other terms' blocks are walked alongside, so nothing past the last line used is decoded.
+        """
+        sizes = dict(db.execute(f"SELECT term, SUM(LENGTH(data)) FROM postings WHERE file = ? AND term IN "
+                                f"({','.join('?' * len(terms))}) GROUP BY term", [file_no] + terms).fetchall())
+        if len(sizes) < len(terms):
+            return
+        order = sorted(terms, key=sizes.get)
+        others = [[self._blocks(db, t, file_no), set(), -1] for t in order[1:]]   # blocks, current, last line
+        for block in self._blocks(db, order[0], file_no):
+            for n in block:
+                for state in others:
+                    while state[2] < n:
+                        lines = next(state[0], None)
+                        if lines is None:
+                            return
+                        state[1], state[2] = set(lines), lines[-1]
+                    if n not in state[1]:
+                        break
+                else:
+                    yield n
+
+    def _texts(self, db, info, lines, context):
+        """{line number: text} for the given lines and `context` lines around each."""
+        wanted = {i for n in lines for i in range(max(1, n - context), min(info["lines"], n + context) + 1)}
+        # A line ends where the next one starts (or at the indexed size for the last line)
+        offsets = self._line_offsets(db, info["id"], wanted | {i + 1 for i in wanted})
+        texts = {}
+        with open(info["path"], "rb") as f:
+            for n in sorted(wanted):
+                if n not in offsets:
+                    continue
+                end = offsets.get(n + 1, info["size"])
+                f.seek(offsets[n])
+                texts[n] = f.read(max(0, min(end - offsets[n], MAX_LINE_BYTES))).decode("utf-8", "replace").rstrip("\r\n")
+        return texts
+
+    @timed("log_search")
+    def search(self, query, limit=100, context=2, folder=None, exact=False, max_exact_scan=20000):
+        """
+        Lines containing every word of `query` (case-insensitive), newest logs first:
+        [{"folder", "file", "path", "mtime", "line", "text", "before": [...], "after": [...]}].
+        exact=True also requires the query as one substring of the line; that means reading
+        candidate lines, so at most `max_exact_scan` of them are checked. `folder` is a glob on
+        the run folder name.
+        """
+        terms = sorted({t.lower() for t in QUERY_TOKEN.findall(query)})
+        if not terms:
+            return []
+        needle = query.lower()
+        results = []
+        scan_budget = max_exact_scan
+        with self.pool.connection() as db:
+            # Files that have every term somewhere, newest first
+            marks = ",".join("?" * len(terms))
+            files = db.execute(
+                f"SELECT f.* FROM files f JOIN (SELECT file FROM postings WHERE term IN ({marks}) "
+                f"GROUP BY file HAVING COUNT(DISTINCT term) = ?) p ON p.file = f.id "
+                f"ORDER BY f.mtime DESC, f.path", terms + [len(terms)]).fetchall()
+            for info in files:
+                if folder and not fnmatch.fnmatch(info["folder"], folder):
+                    continue
+                matches = self._matching_lines(db, terms, info["id"])
+                while len(results) < limit:
+                    batch = list(islice(matches, 256 if exact else limit - len(results)))
+                    if not batch:
+                        break
+                    try:
+                        texts = self._texts(db, info, batch, context)
+                    except OSError:
+                        break
+                    for n in batch:
+                        text = texts.get(n, "")
+                        if exact and needle not in text.lower():
+                            continue
+                        results.append({"folder": info["folder"], "file": info["name"], "path": info["path"],
+                                        "mtime": info["mtime"], "line": n, "text": text,
+                                        "before": [texts.get(i, "") for i in range(max(1, n - context), n)],
+                                        "after": [texts.get(i, "") for i in range(n + 1, min(info["lines"], n + context) + 1)]})
+                        if len(results) >= limit:
+                            break
+                    if exact:
+                        scan_budget -= len(batch)
+                        if scan_budget <= 0:
+                            return results
+                if len(results) >= limit:
+                    break
+        return results
+
+    def stats(self):
+        with self.pool.connection() as db:
+            files, lines, size = db.execute("SELECT COUNT(*), COALESCE(SUM(lines), 0), COALESCE(SUM(size), 0) "
+                                            "FROM files").fetchone()
+        db_size = 0
+        for path in (self.db_path, self.db_path + "-wal"):
+            try:
+                db_size += os.path.getsize(path)
+            except OSError:
+                pass
+        return {"files": files, "lines": lines, "indexed_bytes": size, "index_bytes": db_size,
+                "last_pass": self.last_pass, "roots": self.roots}
@@ -0,0 +1,160 @@
+import io
+import os
+import struct
+import zipfile
+from contextlib import contextmanager
+from instrument import timed
+
+BLOCK_SIZE = 64 * 1024
+MAX_LINES = 5000  # cap on the lines a tail returns, whatever the client asks for
+
+
+def file_id(path):
+    """Identity of the file behind `path`; changes when the log is rotated or re-created."""
+    st = os.stat(path)
+    return f"{st.st_dev}-{st.st_ino}"
+
+
+def _tail_bytes(f, size, n, block_size=BLOCK_SIZE):
+    """Seeks backwards from `size` in blocks until n (at most MAX_LINES) lines are found; returns the raw bytes."""
+    n = min(n, MAX_LINES)
+    end = size
+    chunks = []
+    newlines = 0
+    # A trailing newline ends the last line, it does not start a new one
+    want = n + 1
+    while end > 0 and newlines < want:
+        start = max(0, end - block_size)
+        f.seek(start)
+        chunk = f.read(end - start)
+        chunks.append(chunk)
+        newlines += chunk.count(b"\n")
+        end = start
+    data = b"".join(reversed(chunks))
+    lines = data.splitlines(keepends=True)
+    return b"".join(lines[-n:]) if n > 0 else b""
+
+
+def _decode(data):
+    return data.decode("utf-8", "replace")
+
+
+@timed("log_read")
+def tail_lines(path, n=50, block_size=BLOCK_SIZE):
+    """Last n lines of a text file, read from the end (cost ~ size of those lines, not the file)."""
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        return _decode(_tail_bytes(f, size, n, block_size)).splitlines(keepends=True)
+
+
+def _tail_result(f, size, n, current_id):
+    return {"log": _decode(_tail_bytes(f, size, n)), "offset": size, "file_id": current_id, "rotated": False}
+
+
+def _read_since(f, size, current_id, offset, known_file_id, max_bytes, n_on_reset):
+    if (known_file_id and known_file_id != current_id) or offset is None or offset > size:
+        data = _tail_bytes(f, size, n_on_reset)
+        return {"log": _decode(data), "offset": size, "file_id": current_id, "rotated": True}
+
+    f.seek(offset)
+    data = f.read(min(size - offset, max_bytes))
+    cut = data.rfind(b"\n") + 1
+    # A line longer than max_bytes is delivered in pieces; only a short unfinished line waits
+    if cut or len(data) < max_bytes:
+        data = data[:cut]
+    return {"log": _decode(data), "offset": offset + len(data), "file_id": current_id, "rotated": False}
+
+
+@timed("log_read")
+def tail(path, n=50):
+    """Last n lines plus the offset/file_id a client needs for a later read_since() call."""
+    with open(path, "rb") as f:
+        return _tail_result(f, os.fstat(f.fileno()).st_size, n, file_id(path))
+
+
+@timed("log_read")
+def read_since(path, offset, known_file_id=None, max_bytes=1024 * 1024, n_on_reset=50):
+    """
+    Returns only what was appended after `offset`. Stops at the last complete line so a
+    half-written line is delivered whole on the next call (a line longer than max_bytes comes
+    in max_bytes pieces). If the file was rotated (different
+    file_id) or truncated (smaller than offset), falls back to the last `n_on_reset` lines with
+    rotated=True so the client replaces its view instead of appending.
+    """
+    current_id = file_id(path)
+    with open(path, "rb") as f:
+        return _read_since(f, os.fstat(f.fileno()).st_size, current_id, offset, known_file_id, max_bytes, n_on_reset)
+
+
+# --- Logs inside run archives (see retention.py) ---
+class _Window:
+    """Bytes [base, base + size) of an open file, addressed from 0, for _tail_bytes/_read_since."""
+
+    def __init__(self, f, base):
+        self.f = f
+        self.base = base
+
+    def seek(self, pos):
+        self.f.seek(self.base + pos)
+
+    def read(self, n):
+        return self.f.read(n)
+
+
+def _data_offset(f, info):
+    # The local header's extra field can differ from the central directory's, so use its own lengths
+    f.seek(info.header_offset)
+    header = f.read(30)
+    if header[:4] != b"PK\x03\x04":
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    name_len, extra_len = struct.unpack("<HH", header[26:30])
+    return info.header_offset + 30 + name_len + extra_len
+
+
+@contextmanager
+def _archived(archive, member):
+    """
+    Yields (reader, size, file_id) for one member of a zip archive. Stored members are read in
+    place with seeks, so a tail costs the same as on the plain file; compressed ones are inflated.
+    """
+    with open(archive, "rb") as f:
+        with zipfile.ZipFile(f) as zf:
+            info = zf.getinfo(member)
+            if info.compress_type == zipfile.ZIP_STORED:
+                reader = _Window(f, _data_offset(f, info))
+            else:
+                reader = io.BytesIO(zf.read(info))
+            yield reader, info.file_size, f"{file_id(archive)}:{member}"
+
+
+@timed("log_read")
+def tail_archived(archive, member, n=50):
+    """tail() for a log inside a zip archive; KeyError if the archive has no such member."""
+    with _archived(archive, member) as (reader, size, current_id):
+        return _tail_result(reader, size, n, current_id)
+
+
+@timed("log_read")
+def read_since_archived(archive, member, offset, known_file_id=None, max_bytes=1024 * 1024, n_on_reset=50):
+    """read_since() for a log inside a zip archive (which no longer grows)."""
+    with _archived(archive, member) as (reader, size, current_id):
+        return _read_since(reader, size, current_id, offset, known_file_id, max_bytes, n_on_reset)
+
+
+class LogFollower:
+    """Stateful read_since() for one log, for push streams: each poll() returns the new lines."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.offset, self.file_id = os.path.getsize(path), file_id(path)
+        except OSError:
+            self.offset, self.file_id = 0, None
+
+    def poll(self):
+        try:
+            result = read_since(self.path, self.offset, self.file_id)
+        except OSError:
+            return None
+        self.offset, self.file_id = result["offset"], result["file_id"]
+        return result if result["log"] else None
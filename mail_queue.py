@@ -0,0 +1,129 @@
+import heapq
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque
+from instrument import counter
+from mailer import SMTPPool, build_parts, send_parts, is_transient
+
+QUEUED = counter("mail_queue_total", "Queued mail by outcome.", ("result",))
+
+
+class MailQueue:
+    """
+    Background delivery for mail sent from request handlers: enqueue() returns at once and
+    `workers` threads send over pooled SMTP connections. Transient failures are retried with
+    exponential backoff up to `max_attempts`; after that, or on a permanent (5xx) failure, the
+    message goes to the dead-letter file (one JSON object per line) and the `dead` list.
+    """
+
+    def __init__(self, smtp_settings, workers=2, max_attempts=5, backoff=2.0, max_backoff=300.0,
+                 dead_letter=None, keep_dead=100, pool=None):
+        self.smtp_settings = smtp_settings
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dead_letter = dead_letter
+        self.dead = deque(maxlen=keep_dead)
+        self.pool = pool or SMTPPool(per_server=workers)
+        self._heap = []                 # (due, seq, item)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stop = False
+        self._threads = [threading.Thread(target=self._run, name=f"mail-queue-{i}", daemon=True)
+                         for i in range(workers)]
+        for t in self._threads:
+            t.start()
+
+    @classmethod
+    def from_config(cls, smtp_settings, settings=None):
+        """settings: {"workers", "max_attempts", "backoff", "max_backoff", "dead_letter"}."""
+        settings = settings or {}
+        keys = ("workers", "max_attempts", "backoff", "max_backoff", "dead_letter")
+        return cls(smtp_settings, **{k: settings[k] for k in keys if k in settings})
+
+    def enqueue(self, recipients, subject, body, sender=None):
+        """Queues a plain-text message; returns its id."""
+        item = {"id": f"{int(time.time() * 1000)}-{next(self._seq)}", "sender": sender or self.smtp_settings['sender'],
+                "recipients": recipients if isinstance(recipients, list) else [recipients],
+                "subject": subject, "body": body, "attempts": 0, "errors": [], "queued": time.time()}
+        self._push(time.monotonic(), item)
+        QUEUED.inc(result="queued")
+        return item["id"]
+
+    def _push(self, due, item):
+        with self._cond:
+            heapq.heappush(self._heap, (due, next(self._seq), item))
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._heap)
+
+    def _next(self):
+        with self._cond:
+            while not self._stop:
+                if self._heap and self._heap[0][0] <= time.monotonic():
+                    return heapq.heappop(self._heap)[2]
+                timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                self._cond.wait(timeout)
+            return None
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            self._deliver(item)
+
+    def _deliver(self, item):
+        item["attempts"] += 1
+        conn = None
+        try:
+            conn = self.pool.acquire(self.smtp_settings)
+            send_parts(conn.smtp, item["sender"], item["recipients"], build_parts(item, []))
+            conn.sent += 1
+            self.pool.release(conn)
+            QUEUED.inc(result="sent")
+            return
+        except Exception as e:
+            if conn is not None:
+                self.pool.release(conn, broken=True)
+            item["errors"].append(f"{type(e).__name__}: {e}")
+            transient = is_transient(e)
+        if transient and item["attempts"] < self.max_attempts:
+            QUEUED.inc(result="retried")
+            delay = min(self.max_backoff, self.backoff * (2 ** (item["attempts"] - 1)))
+            self._push(time.monotonic() + delay, item)
+        else:
+            self._bury(item)
+
+    def _bury(self, item):
+        QUEUED.inc(result="dead")
+        item["dead_at"] = time.time()
+        self.dead.append(item)
+        logging.error(f"Mail to {', '.join(item['recipients'])} undeliverable after {item['attempts']} attempt(s): "
+                      f"{item['errors'][-1]}")
+        if self.dead_letter:
+            try:
+                with open(self.dead_letter, 'a') as f:
+                    f.write(json.dumps(item) + "\n")
+            except OSError as e:
+                logging.error(f"Could not write dead letter: {e}")
+
+    def stop(self, timeout=10.0):
+        """Stops the workers once everything due now has been tried (later retries are left)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self._cond:
+                if not self._heap or self._heap[0][0] > time.monotonic():
+                    break
+            time.sleep(0.05)
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self.pool.close()
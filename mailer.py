@@ -0,0 +1,350 @@
+import base64
+import os
+import random
+import smtplib
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from email.header import Header
+from email.utils import formatdate, make_msgid, formataddr
+from instrument import counter, span
+
+MESSAGES = counter("mail_messages_total", "Mail messages by outcome.", ("result",))
+RETRIES = counter("mail_retries_total", "Mail send attempts that were retried.")
+CONNECTIONS = counter("smtp_connections_total", "SMTP connections opened (connect + STARTTLS + login).")
+
+CHUNK = 57 * 1024          # multiple of 57 bytes -> whole 76-character base64 lines
+SEND_CHUNK = 64 * 1024
+
+
+class EncodedAttachment:
+    """
+    A file attachment streamed as base64 CRLF lines: chunks() reads and encodes CHUNK bytes at a
+    time while the message is written into DATA, so an attachment is never held in memory whole.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.size = os.path.getsize(path)  # a missing file fails here, before any message is sent
+
+    def chunks(self):
+        with open(self.path, 'rb') as f:
+            while True:
+                chunk = f.read(CHUNK)
+                if not chunk:
+                    return
+                encoded = base64.b64encode(chunk)
+                yield b"".join(encoded[i:i + 76] + b"\r\n" for i in range(0, len(encoded), 76))
+
+    def headers(self):
+        name = self.filename.replace('"', '')
+        return (f'Content-Type: application/octet-stream; name="{name}"\r\n'
+                f'Content-Transfer-Encoding: base64\r\n'
+                f'Content-Disposition: attachment; filename="{name}"\r\n\r\n').encode()
+
+
+class AttachmentCache:
+    """Looks each attachment path up once per bulk run; every message that uses it shares the entry."""
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        key = os.path.abspath(path)
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                item = self._items[key] = EncodedAttachment(path)
+            return item
+
+    def __len__(self):
+        return len(self._items)
+
+
+def _dot_stuff(data):
+    # RFC 5321 transparency: a line starting with "." gets a second one
+    data = data.replace(b"\r\n.", b"\r\n..")
+    return b"." + data if data.startswith(b".") else data
+
+
+def _text(value):
+    return value if isinstance(value, str) else "" if value is None else str(value)
+
+
+def build_parts(message, attachments):
+    """
+    The message as a list of parts to write after DATA: byte strings for the headers and text
+    part (dot-stuffed), and the EncodedAttachment itself for each attachment body, which is
+    encoded from its file while it is sent. Base64 lines never start with ".", so attachment
+    bytes go out as they are.
+    """
+    boundary = f"=_{uuid.uuid4().hex}"
+    recipients = message["recipients"]
+    head = [
+        f"From: {formataddr((message.get('sender_name') or '', message['sender']))}",
+        f"To: {', '.join(recipients)}",
+        f"Subject: {Header(_text(message.get('subject')), 'utf-8').encode()}",
+        f"Date: {formatdate(localtime=True)}",
+        f"Message-ID: {make_msgid()}",
+        "MIME-Version: 1.0",
+        f'Content-Type: multipart/mixed; boundary="{boundary}"',
+        "",
+        f"--{boundary}",
+        'Content-Type: text/plain; charset="utf-8"',
+        "Content-Transfer-Encoding: base64",
+        "",
+    ]
+    body = base64.encodebytes(_text(message.get('body')).encode('utf-8')).replace(b"\n", b"\r\n")
+    parts = [_dot_stuff("\r\n".join(head).encode() + b"\r\n" + body)]
+    for item in attachments:
+        parts.append(f"--{boundary}\r\n".encode() + item.headers())
+        parts.append(item)
+    parts.append(f"--{boundary}--\r\n".encode())
+    return parts
+
+
+class PooledConnection:
+    def __init__(self, smtp, key):
+        self.smtp = smtp
+        self.key = key
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+
+class SMTPPool:
+    """
+    Logged-in SMTP connections kept open between messages, keyed by (server, port, user).
+    At most `per_server` connections per key; a connection is retired after `max_messages`
+    and checked with NOOP before reuse once it has been idle for `idle_check` seconds.
+    """
+
+    def __init__(self, per_server=4, max_messages=100, idle_check=30.0, timeout=60.0):
+        self.per_server = per_server
+        self.max_messages = max_messages
+        self.idle_check = idle_check
+        self.timeout = timeout
+        self.opened = 0
+        self._idle = {}          # key -> [PooledConnection]
+        self._slots = {}         # key -> BoundedSemaphore
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(settings):
+        return (settings["server"], int(settings.get("port") or 25), settings.get("username") or "")
+
+    def _connect(self, settings, key):
+        smtp = smtplib.SMTP(key[0], key[1], timeout=self.timeout)
+        try:
+            if settings.get("starttls", True):
+                smtp.starttls()
+            if settings.get("username") and settings.get("password"):
+                smtp.login(settings["username"], settings["password"])
+        except Exception:
+            smtp.close()
+            raise
+        with self._lock:
+            self.opened += 1
+        CONNECTIONS.inc()
+        return PooledConnection(smtp, key)
+
+    def acquire(self, settings):
+        key = self.key_for(settings)
+        with self._lock:
+            slots = self._slots.setdefault(key, threading.BoundedSemaphore(self.per_server))
+        slots.acquire()
+        try:
+            while True:
+                with self._lock:
+                    idle = self._idle.get(key)
+                    conn = idle.pop() if idle else None
+                if conn is None:
+                    return self._connect(settings, key)
+                if time.monotonic() - conn.last_used < self.idle_check:
+                    return conn
+                try:
+                    if conn.smtp.noop()[0] == 250:
+                        return conn
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._close(conn)
+        except BaseException:
+            slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        if broken or conn.sent >= self.max_messages:
+            self._close(conn, polite=not broken)
+        else:
+            conn.last_used = time.monotonic()
+            with self._lock:
+                self._idle.setdefault(conn.key, []).append(conn)
+        self._slots[conn.key].release()
+
+    def _close(self, conn, polite=False):
+        try:
+            if polite:
+                conn.smtp.quit()
+            else:
+                conn.smtp.close()
+        except (smtplib.SMTPException, OSError):
+            conn.smtp.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                self._close(conn, polite=True)
+
+
+def _pieces(parts):
+    for part in parts:
+        if isinstance(part, EncodedAttachment):
+            yield from part.chunks()
+        else:
+            yield part
+
+
+def send_parts(smtp, sender, recipients, parts):
+    """MAIL/RCPT/DATA with the body written chunk by chunk (attachments straight from their files)."""
+    code, resp = smtp.mail(sender)
+    if code != 250:
+        raise smtplib.SMTPSenderRefused(code, resp, sender)
+    refused = {}
+    for rcpt in recipients:
+        code, resp = smtp.rcpt(rcpt)
+        if code not in (250, 251):
+            refused[rcpt] = (code, resp)
+    if len(refused) == len(recipients):
+        smtp.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    code, resp = smtp.docmd("data")
+    if code != 354:
+        smtp.rset()
+        raise smtplib.SMTPDataError(code, resp)
+    sent = 0
+    last = b""
+    for piece in _pieces(parts):
+        view = memoryview(piece)
+        for i in range(0, len(view), SEND_CHUNK):
+            smtp.sock.sendall(view[i:i + SEND_CHUNK])
+        sent += len(piece)
+        last = piece or last
+    smtp.sock.sendall(b".\r\n" if last.endswith(b"\r\n") else b"\r\n.\r\n")
+    code, resp = smtp.getreply()
+    if code != 250:
+        raise smtplib.SMTPDataError(code, resp)
+    return refused, sent
+
+
+def is_transient(error):
+    """4xx replies, dropped connections and network errors are worth retrying; 5xx are not."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    # Everything else smtplib raises is an OSError too: dropped connections, timeouts, refused connects
+    return isinstance(error, OSError)
+
+
+class BulkMailer:
+    """
+    Sends many messages over pooled connections with `workers` concurrent senders. A message is
+    a dict: {"smtp": {"server", "port", "username", "password", "starttls"}, "sender",
+    "recipients": [...], "subject", "body", "attachments": [paths]}. Each message is retried
+    `retries` times with exponential backoff on transient failures; send() returns a summary.
+    """
+
+    def __init__(self, workers=8, per_server=4, retries=3, backoff=1.0, max_backoff=30.0,
+                 max_messages_per_connection=100, pool=None):
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool = pool or SMTPPool(per_server=per_server, max_messages=max_messages_per_connection)
+
+    @classmethod
+    def from_config(cls, settings):
+        """Builds a mailer from a "mailer" config section (missing keys keep the defaults)."""
+        settings = settings or {}
+        keys = ("workers", "per_server", "retries", "backoff", "max_backoff", "max_messages_per_connection")
+        return cls(**{k: settings[k] for k in keys if k in settings})
+
+    def send_one(self, message, parts):
+        """Sends one message with retries; returns {"recipients", "ok", "attempts", "bytes", "error", "refused"}."""
+        result = {"recipients": message["recipients"], "ok": False, "attempts": 0, "bytes": 0,
+                  "error": None, "refused": {}}
+        for attempt in range(self.retries + 1):
+            result["attempts"] = attempt + 1
+            conn = None
+            try:
+                conn = self.pool.acquire(message["smtp"])
+                with span("smtp_send"):
+                    refused, sent = send_parts(conn.smtp, message["sender"], message["recipients"], parts)
+                conn.sent += 1
+                self.pool.release(conn)
+                result.update(ok=True, bytes=sent, error=None,
+                              refused={r: f"{c} {m.decode(errors='replace') if isinstance(m, bytes) else m}"
+                                       for r, (c, m) in refused.items()})
+                return result
+            except Exception as e:
+                if conn is not None:
+                    # After a failure mid-transaction the session state is unknown; don't reuse it
+                    self.pool.release(conn, broken=True)
+                result["error"] = f"{type(e).__name__}: {e}"
+                if not is_transient(e) or attempt == self.retries:
+                    return result
+            RETRIES.inc()
+            delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+            time.sleep(delay * random.uniform(0.5, 1.0))
+        return result
+
+    def send(self, messages):
+        """
+        Sends every message and returns {"messages", "sent", "failed", "retries", "bytes",
+        "seconds", "messages_per_s", "mb_per_s", "connections_opened", "failures": [...]}.
+        """
+        started = time.monotonic()
+        opened_before = self.pool.opened
+        cache = AttachmentCache()
+        failures = []
+        prepared = []
+        for message in messages:
+            try:
+                attachments = [cache.get(p) for p in message.get("attachments") or []]
+                prepared.append((message, build_parts(message, attachments)))
+            except OSError as e:
+                # A missing attachment fails only the messages that use it
+                failures.append({"recipients": message.get("recipients"), "attempts": 0,
+                                 "error": f"attachment: {e}"})
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="mailer") as pool:
+            results = list(pool.map(lambda mp: self.send_one(*mp), prepared))
+
+        sent = [r for r in results if r["ok"]]
+        failures += [{"recipients": r["recipients"], "attempts": r["attempts"], "error": r["error"]}
+                     for r in results if not r["ok"]]
+        MESSAGES.inc(len(sent), result="sent")
+        MESSAGES.inc(len(failures), result="failed")
+        seconds = time.monotonic() - started
+        total_bytes = sum(r["bytes"] for r in sent)
+        return {
+            "messages": len(messages),
+            "sent": len(sent),
+            "failed": len(failures),
+            "retries": sum(r["attempts"] - 1 for r in results),
+            "bytes": total_bytes,
+            "seconds": round(seconds, 3),
+            "messages_per_s": round(len(sent) / seconds, 2) if seconds else None,
+            "mb_per_s": round(total_bytes / seconds / 1024 / 1024, 2) if seconds else None,
+            "connections_opened": self.pool.opened - opened_before,
+            "attachments_encoded": len(cache),
+            "refused": {rcpt: why for r in sent for rcpt, why in r["refused"].items()},
+            "failures": failures,
+        }
+
+    def close(self):
+        self.pool.close()
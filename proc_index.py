@@ -0,0 +1,187 @@
+import logging
+import os
+import threading
+import time
+import psutil
+from instrument import span
+
+
+def _cmd_tokens(cmdline):
+    """Every argument plus its basename, so 'C:\\jobs\\ci_job.pl' is found as 'ci_job.pl'."""
+    tokens = set()
+    for arg in cmdline or []:
+        if not arg:
+            continue
+        tokens.add(arg)
+        tokens.add(os.path.basename(arg.replace("\\", "/")))
+    return tokens
+
+
+class ProcInfo:
+    __slots__ = ("pid", "name", "username", "cmdline", "ppid")
+
+    def __init__(self, pid, name, username, cmdline, ppid=None):
+        self.pid = pid
+        self.ppid = ppid
+        self.name = name or ""
+        self.username = username or ""
+        self.cmdline = " ".join(cmdline or [])
+
+
+class ProcSnapshot:
+    """One immutable pass over the process table, indexed by lower-cased name and user and by cmdline token."""
+
+    def __init__(self, procs, taken_at):
+        self.procs = {}
+        self.by_name = {}
+        self.by_user = {}
+        self.by_token = {}
+        self.taken_at = taken_at
+        self._token_hits = {}
+
+        for info, args in procs:
+            self.procs[info.pid] = info
+            self.by_name.setdefault(info.name.lower(), set()).add(info.pid)
+            self.by_user.setdefault(info.username.lower(), set()).add(info.pid)
+            for token in _cmd_tokens(args):
+                self.by_token.setdefault(token, set()).add(info.pid)
+
+    def age(self):
+        return time.time() - self.taken_at
+
+    def descendants(self, pids):
+        """Every process started (directly or through others) by one of pids."""
+        children = {}
+        for info in self.procs.values():
+            if info.ppid is not None:
+                children.setdefault(info.ppid, []).append(info.pid)
+        found = set()
+        stack = list(pids)
+        while stack:
+            for child in children.get(stack.pop(), ()):
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return found
+
+    @staticmethod
+    def _containing(index, needle):
+        """PIDs under every index key that contains needle."""
+        pids = set()
+        for key, matched in index.items():
+            if needle in key:
+                pids |= matched
+        return pids
+
+    def _with_token(self, token):
+        """
+        PIDs whose command line contains token, cached per snapshot. A token without spaces lies
+        inside one argument, so it is matched against the distinct argument keys (shared by every
+        process running the same script); only a token spanning arguments scans the command lines.
+        """
+        pids = self._token_hits.get(token)
+        if pids is None:
+            if " " in token:
+                pids = {pid for pid, info in self.procs.items() if token in info.cmdline}
+            else:
+                pids = self._containing(self.by_token, token)
+            self._token_hits[token] = pids
+        return pids
+
+    def find(self, name=None, user=None, token=None):
+        """
+        Returns the ProcInfo list matching every given filter, as substrings like the per-process
+        checks did: name and user case-insensitively ('sas' finds SAS.exe, 'xyz' finds DOMAIN\\xyz),
+        token case-sensitively anywhere in the command line. Every filter is answered from the
+        index keys, not by checking each process.
+        """
+        pids = None
+        if name is not None:
+            pids = self._containing(self.by_name, name.lower())
+        if user is not None:
+            matched = self._containing(self.by_user, user.lower())
+            pids = matched if pids is None else pids & matched
+        if token is not None:
+            matched = self._with_token(token)
+            pids = matched if pids is None else pids & matched
+        if pids is None:
+            pids = self.procs.keys()
+        return [self.procs[pid] for pid in pids]
+
+
+class ProcessIndex:
+    """
+    Agent-wide process snapshot, refreshed by a background thread every `interval` seconds.
+    Callers read `snapshot()`; pass `max_age` to force a fresh walk when the cached one is too old
+    (never younger than `min_age`, so callers cannot make every request walk the process table).
+    Listeners only hear about the background refreshes.
+    """
+
+    def __init__(self, interval=2.0, min_age=0.5):
+        self.interval = interval
+        self.min_age = min_age
+        self._snapshot = ProcSnapshot([], 0)
+        self._lock = threading.Lock()
+        self._walk_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._listeners = []
+
+    def start(self):
+        if self._thread is None:
+            self.refresh()
+            self._thread = threading.Thread(target=self._run, name="proc-index", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def subscribe(self, callback):
+        """callback(old_snapshot, new_snapshot) is called after every background refresh."""
+        self._listeners.append(callback)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh(notify=True)
+            except Exception as e:
+                logging.error(f"Process index refresh failed: {e}")
+
+    def refresh(self, notify=False, max_age=None):
+        """
+        Walks the process table and swaps in the new snapshot, one walk at a time. With max_age, a
+        snapshot that another caller took while this one waited is used if it is young enough.
+        """
+        with self._walk_lock:
+            if max_age is not None and self._snapshot.age() <= max_age:
+                return self._snapshot
+            procs = []
+            with span("process_scan"):
+                for proc in psutil.process_iter(['pid', 'name', 'username', 'cmdline', 'ppid']):
+                    info = proc.info
+                    args = info.get('cmdline')
+                    procs.append((ProcInfo(info['pid'], info.get('name'), info.get('username'), args,
+                                           info.get('ppid')), args))
+                new = ProcSnapshot(procs, time.time())
+
+            with self._lock:
+                old, self._snapshot = self._snapshot, new
+        if notify:
+            for callback in self._listeners:
+                try:
+                    callback(old, new)
+                except Exception as e:
+                    logging.error(f"Process index listener failed: {e}")
+        return new
+
+    def snapshot(self, max_age=None):
+        snap = self._snapshot
+        if max_age is not None:
+            max_age = max(max_age, self.min_age)
+            if snap.age() > max_age:
+                snap = self.refresh(max_age=max_age)
+        return snap
+
+    def age(self):
+        return self._snapshot.age()
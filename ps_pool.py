@@ -0,0 +1,196 @@
+import atexit
+import itertools
+import json
+import logging
+import os
+import queue
+import subprocess
+import tempfile
+import threading
+from instrument import counter, span
+
+WORKER_RESTARTS = counter("ps_helper_restarts_total", "AD helper workers replaced after a hang or crash.")
+
+# Long-lived PowerShell worker: one JSON request per input line, one JSON answer per output line.
+# Request:  {"id": 1, "emails": ["a@x.com", ...], "groups": ["GG_App_Users", ...]}
+# Answer:   {"id": 1, "results": {"a@x.com": true, ...}}
+WORKER_SCRIPT = r"""
+$ErrorActionPreference = 'Stop'
+Import-Module ActiveDirectory
+while ($true) {
+    $line = [Console]::In.ReadLine()
+    if ($line -eq $null) { break }
+    $req = $line | ConvertFrom-Json
+    $results = @{}
+    foreach ($email in $req.emails) {
+        $ok = $false
+        try {
+            $safe = $email -replace "'", "''"
+            $user = Get-ADUser -Filter "EmailAddress -eq '$safe'" -Properties memberOf
+            if ($user) {
+                foreach ($g in $req.groups) {
+                    if ($user.memberOf -like "*$g*") { $ok = $true; break }
+                }
+            }
+        } catch { $ok = $false }
+        $results[$email] = $ok
+    }
+    [Console]::Out.WriteLine((@{ id = $req.id; results = $results } | ConvertTo-Json -Compress))
+    [Console]::Out.Flush()
+}
+"""
+
+DEFAULT_HOST = ["powershell", "-NoProfile", "-NonInteractive", "-ExecutionPolicy", "Bypass", "-File", "{script}"]
+
+
+class WorkerError(Exception):
+    pass
+
+
+class _Worker:
+    """One helper process plus a reader thread that turns its stdout into a queue of lines."""
+
+    def __init__(self, command):
+        self.proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            self.lines.put(line)
+        self.lines.put(None)  # EOF: the process exited
+
+    def call(self, request, timeout):
+        try:
+            self.proc.stdin.write(json.dumps(request) + "\n")
+            self.proc.stdin.flush()
+        except OSError as e:
+            raise WorkerError(f"worker stdin closed: {e}")
+        while True:
+            try:
+                line = self.lines.get(timeout=timeout)
+            except queue.Empty:
+                raise WorkerError(f"worker did not answer within {timeout}s")
+            if line is None:
+                raise WorkerError("worker exited unexpectedly")
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                answer = json.loads(line)
+            except ValueError:
+                continue  # Stray output (banners, warnings); keep waiting for our answer
+            if answer.get("id") == request["id"]:
+                return answer
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        try:
+            self.proc.kill()
+            self.proc.wait(timeout=5)
+        except Exception:
+            pass
+
+
+class HelperPool:
+    """
+    Small pool of long-lived helper processes for AD lookups, so a login burst costs one
+    PowerShell start-up per worker instead of one per check.
+
+    `host` is the command line; "{script}" in it is replaced by the path of the PowerShell worker
+    script, so a stand-in (e.g. ["python3", "fake_ad.py"]) can replace PowerShell in tests.
+    At most `size` calls run at once. A worker that crashes or exceeds `timeout` is killed and
+    replaced on the next call.
+    """
+
+    def __init__(self, host=None, size=2, timeout=30.0):
+        self.host = list(host or DEFAULT_HOST)
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(size)
+        self._ids = itertools.count(1)
+        self._script_path = None
+        self._all = set()
+        self._lock = threading.Lock()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, config):
+        c = config.get('ps_pool', {})
+        return cls(host=c.get('host'), size=c.get('size', 2), timeout=c.get('timeout', 30.0))
+
+    def _command(self):
+        if any("{script}" in part for part in self.host) and self._script_path is None:
+            fd, path = tempfile.mkstemp(prefix="ad_worker_", suffix=".ps1")
+            with os.fdopen(fd, 'w') as f:
+                f.write(WORKER_SCRIPT)
+            self._script_path = path
+        return [part.replace("{script}", self._script_path or "") for part in self.host]
+
+    def _spawn(self):
+        worker = _Worker(self._command())
+        with self._lock:
+            self._all.add(worker)
+        return worker
+
+    def _discard(self, worker):
+        worker.kill()
+        with self._lock:
+            self._all.discard(worker)
+
+    def _take(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return self._spawn()
+            if worker.alive():
+                return worker
+            self._discard(worker)
+
+    def lookup_many(self, emails, groups):
+        """{email: bool} for all emails in one round trip to one worker."""
+        request = {"id": next(self._ids), "emails": list(emails), "groups": list(groups)}
+        with self._slots:
+            for attempt in range(2):
+                worker = self._take()
+                try:
+                    with span("ps_helper_call"):
+                        answer = worker.call(request, self.timeout)
+                except WorkerError as e:
+                    # Hung or crashed: replace it, and retry once on a fresh worker
+                    WORKER_RESTARTS.inc()
+                    self._discard(worker)
+                    if attempt == 1:
+                        raise
+                    logging.warning(f"AD helper restarted: {e}")
+                    continue
+                self._idle.put(worker)
+                return {email: bool(answer.get("results", {}).get(email)) for email in request["emails"]}
+
+    def lookup(self, email, groups):
+        return self.lookup_many([email], groups)[email]
+
+    def retire(self):
+        """
+        Closes the pool once it has been replaced: a call may still be running on it (two attempts
+        at most), so the workers are only killed after twice the timeout.
+        """
+        closer = threading.Timer(2 * self.timeout, self.close)
+        closer.daemon = True  # atexit closes it anyway
+        closer.start()
+
+    def close(self):
+        with self._lock:
+            workers, self._all = list(self._all), set()
+        for worker in workers:
+            worker.kill()
+        if self._script_path and os.path.exists(self._script_path):
+            try:
+                os.remove(self._script_path)
+            except OSError:
+                pass
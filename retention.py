@@ -0,0 +1,384 @@
+import logging
+import os
+import shutil
+import threading
+import time
+import zipfile
+from collections import deque
+from instrument import counter
+from transfer import PART_SUFFIX
+
+ARCHIVE_SUFFIX = ".zip"
+LOG_MEMBER = "log/db/proglogs.txt"
+CHUNK = 1024 * 1024
+
+COMPRESSION = {"deflate": zipfile.ZIP_DEFLATED, "bzip2": zipfile.ZIP_BZIP2, "lzma": zipfile.ZIP_LZMA}
+
+DEFAULTS = {
+    "enabled": False,
+    "interval": 600,            # seconds between passes
+    "archive_after_days": 7,    # runs idle this long are compressed
+    "min_idle_hours": 24,       # nothing newer is touched, even to get under a size limit
+    "keep_latest": 3,           # the newest runs always stay as folders
+    "max_total_gb": None,       # above this (runs + archives), older idle runs are compressed early
+    "delete_after_days": None,  # archives older than this are deleted
+    "hard_limit_gb": None,      # above this, the oldest archives (then idle runs) are deleted
+    "compression": "deflate",   # deflate | bzip2 | lzma
+    "level": None,              # compressor level, None = its default
+    "max_mb_per_s": 20,         # read rate while compressing, so running jobs keep the disk
+    "max_runs_per_pass": 20,
+}
+
+RUNS = counter("retention_runs_total", "Run folders handled by the retention engine, by action.", ("action",))
+SAVED = counter("retention_saved_bytes_total", "Bytes released by compressing run folders.")
+
+
+class Cancelled(Exception):
+    pass
+
+
+def is_log_member(arcname):
+    """proglogs.txt and log/*_P.log: stored uncompressed so log_tail can seek into them."""
+    return arcname == LOG_MEMBER or (arcname.startswith("log/") and arcname.count("/") == 1
+                                     and arcname.endswith("_P.log"))
+
+
+def archive_for(run_folder):
+    return run_folder.rstrip("/\\") + ARCHIVE_SUFFIX
+
+
+def last_activity(run_folder):
+    """Newest mtime of the folder, its log folder and its logs (a job writes there until it ends)."""
+    newest = 0.0
+    log_dir = os.path.join(run_folder, "log")
+    for path in (run_folder, log_dir, os.path.join(log_dir, "db"), os.path.join(log_dir, "db", "proglogs.txt")):
+        try:
+            newest = max(newest, os.stat(path).st_mtime)
+        except OSError:
+            pass
+    try:
+        with os.scandir(log_dir) as it:
+            for e in it:
+                if e.name.endswith("_P.log"):
+                    newest = max(newest, e.stat().st_mtime)
+    except OSError:
+        pass
+    return newest
+
+
+def folder_size(path):
+    total = 0
+    stack = [path]
+    while stack:
+        try:
+            with os.scandir(stack.pop()) as it:
+                for e in it:
+                    try:
+                        if e.is_dir(follow_symlinks=False):
+                            stack.append(e.path)
+                        else:
+                            total += e.stat(follow_symlinks=False).st_size
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+    return total
+
+
+class Throttle:
+    """Caps a byte rate with one second of burst; bytes_per_s None or 0 means unlimited."""
+
+    def __init__(self, bytes_per_s):
+        self.rate = bytes_per_s
+        self._allowance = 0.0
+        self._last = time.monotonic()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        now = time.monotonic()
+        self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate) - n
+        self._last = now
+        if self._allowance < 0:
+            time.sleep(-self._allowance / self.rate)
+
+
+def _members(src):
+    """(path, arcname) for every file under src, plus empty folders so the layout survives."""
+    for root, dirs, files in os.walk(src):
+        dirs.sort()
+        rel = os.path.relpath(root, src).replace(os.sep, "/")
+        prefix = "" if rel == "." else rel + "/"
+        if not dirs and not files and prefix:
+            yield root, prefix
+        for name in sorted(files):
+            yield os.path.join(root, name), prefix + name
+
+
+def _copy_member(zf, path, info, throttle, should_stop, src):
+    """Streams one file into the archive in CHUNK reads, throttled and cancellable; returns its size."""
+    copied = 0
+    with open(path, "rb") as f, zf.open(info, "w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT) as out:
+        while True:
+            if should_stop is not None and should_stop():
+                raise Cancelled(src)
+            chunk = f.read(CHUNK)
+            if not chunk:
+                return copied
+            if throttle is not None:
+                throttle.consume(len(chunk))
+            out.write(chunk)
+            copied += len(chunk)
+
+
+def compress_folder(src, dest, compression=zipfile.ZIP_DEFLATED, level=None, throttle=None, should_stop=None):
+    """
+    Writes the folder `src` to the zip archive `dest` (built as dest.part and renamed once complete,
+    so a half-written archive is never mistaken for a run). Logs are stored, everything else is
+    compressed. Returns (bytes read, archive size).
+    """
+    part = dest + PART_SUFFIX
+    total = 0
+    try:
+        with zipfile.ZipFile(part, "w", compression, compresslevel=level, strict_timestamps=False) as zf:
+            for path, arcname in _members(src):
+                info = zipfile.ZipInfo.from_file(path, arcname, strict_timestamps=False)
+                if info.is_dir():
+                    zf.writestr(info, b"")
+                    continue
+                info.compress_type = zipfile.ZIP_STORED if is_log_member(arcname) else compression
+                leveled = level is not None and info.compress_type != zipfile.ZIP_STORED
+                if leveled and not hasattr(info, "compress_level"):
+                    # Before Python 3.13 a member's level can only be passed to write(), which reads the file itself
+                    if should_stop is not None and should_stop():
+                        raise Cancelled(src)
+                    if throttle is not None:
+                        throttle.consume(info.file_size)
+                    zf.write(path, arcname, compression, level)
+                    total += info.file_size
+                    continue
+                if leveled:
+                    info.compress_level = level
+                total += _copy_member(zf, path, info, throttle, should_stop, src)
+        os.replace(part, dest)
+    except BaseException:
+        try:
+            os.remove(part)
+        except OSError:
+            pass
+        raise
+    return total, os.path.getsize(dest)
+
+
+class RetentionEngine:
+    """
+    Keeps the run folders of one folder (the agent's secondary_folder) within age and size limits,
+    one background pass every `interval` seconds:
+      1. idle runs older than archive_after_days - or the oldest idle runs while the folder is over
+         max_total_gb - are compressed to <run>.zip next to them, then the folder is discarded;
+      2. archives older than delete_after_days are deleted, and while the folder is over
+         hard_limit_gb the oldest archives, then the oldest idle runs, are deleted too.
+    A run is idle when nothing in it changed for min_idle_hours, it is not among the keep_latest
+    newest and in_use() does not name it. discard(paths) removes folders (e.g. TrashReaper.trash);
+    on_update(event) gets one dict per archived/deleted/failed run.
+    """
+
+    def __init__(self, folder, settings=None, in_use=None, discard=None, on_update=None, keep=100):
+        self.folder = folder
+        self.settings = dict(DEFAULTS, **(settings or {}))
+        self.in_use = in_use or (lambda: set())
+        self.discard = discard
+        self.on_update = on_update
+        self.current = None
+        self.last_pass = None
+        self.totals = {"archived": 0, "deleted": 0, "failed": 0, "bytes_in": 0, "bytes_out": 0}
+        self.recent = deque(maxlen=keep)
+        self._sizes = {}                # run folder -> (last activity, bytes), runs do not change once idle
+        self._pass_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="retention", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def configure(self, settings):
+        """Applies a reloaded "retention" block; takes effect from the next pass."""
+        self.settings = dict(DEFAULTS, **(settings or {}))
+        self._wake.set()
+
+    def run_now(self):
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.settings["enabled"] and self.folder:
+                try:
+                    self.run_pass()
+                except Exception as e:
+                    logging.error(f"Retention pass failed: {e}")
+            self._wake.wait(self.settings["interval"])
+            self._wake.clear()
+
+    # --- Inventory ---
+    def _inventory(self):
+        """Runs and archives of the folder, each {"name", "path", "archive", "activity", "size"}."""
+        items = []
+        try:
+            with os.scandir(self.folder) as it:
+                entries = list(it)
+        except OSError:
+            return items
+        need_sizes = self.settings["max_total_gb"] is not None or self.settings["hard_limit_gb"] is not None
+        for e in entries:
+            try:
+                if e.is_dir():
+                    activity = last_activity(e.path)
+                    size = None
+                    if need_sizes:
+                        cached = self._sizes.get(e.path)
+                        size = cached[1] if cached and cached[0] == activity else folder_size(e.path)
+                        self._sizes[e.path] = (activity, size)
+                    items.append({"name": e.name, "path": e.path, "archive": False, "activity": activity, "size": size})
+                elif e.name.endswith(ARCHIVE_SUFFIX):
+                    st = e.stat()
+                    items.append({"name": e.name, "path": e.path, "archive": True, "activity": st.st_mtime,
+                                  "size": st.st_size})
+            except OSError:
+                continue
+        live = {item["path"] for item in items}
+        for path in [p for p in self._sizes if p not in live]:
+            del self._sizes[path]
+        items.sort(key=lambda item: item["activity"])
+        return items
+
+    # --- One pass ---
+    def run_pass(self):
+        with self._pass_lock:
+            return self._pass()
+
+    def _pass(self):
+        s = self.settings
+        now = time.time()
+        started = time.monotonic()
+        items = self._inventory()
+        runs = [item for item in items if not item["archive"]]
+        protected = {item["name"] for item in runs[-s["keep_latest"]:]} if s["keep_latest"] else set()
+        protected |= set(self.in_use())
+        idle_cutoff = now - s["min_idle_hours"] * 3600
+        idle = [item for item in runs if item["name"] not in protected and item["activity"] < idle_cutoff
+                and not os.path.exists(archive_for(item["path"]))]
+
+        sized = s["max_total_gb"] is not None or s["hard_limit_gb"] is not None
+        total = sum(item["size"] or 0 for item in items)
+        max_total = s["max_total_gb"] * 1024**3 if s["max_total_gb"] is not None else None
+        age_cutoff = now - s["archive_after_days"] * 86400 if s["archive_after_days"] is not None else None
+        compression = COMPRESSION.get(s["compression"], zipfile.ZIP_DEFLATED)
+        throttle = Throttle((s["max_mb_per_s"] or 0) * 1024 * 1024)
+
+        archived = 0
+        for item in idle:
+            if self._stop.is_set() or archived >= s["max_runs_per_pass"]:
+                break
+            too_old = age_cutoff is not None and item["activity"] < age_cutoff
+            too_big = max_total is not None and total > max_total
+            if not (too_old or too_big):
+                continue
+            result = self._archive(item, compression, s["level"], throttle)
+            if result:
+                if sized:
+                    total -= item["size"] - result[1]
+                item.update(path=archive_for(item["path"]), name=item["name"] + ARCHIVE_SUFFIX,
+                            archive=True, size=result[1])
+                archived += 1
+
+        deleted = self._expire(items, protected, idle_cutoff, total, now)
+        self.last_pass = {"at": now, "seconds": round(time.monotonic() - started, 2), "archived": archived,
+                          "deleted": deleted, "runs": len(runs),
+                          "total_gb": round(total / 1024**3, 3) if sized else None}
+        return self.last_pass
+
+    def _archive(self, item, compression, level, throttle):
+        src = item["path"]
+        dest = archive_for(src)
+        self.current = item["name"]
+        try:
+            bytes_in, bytes_out = compress_folder(src, dest, compression, level, throttle,
+                                                  should_stop=self._stop.is_set)
+            # The archive carries the run's age, so listings sort it where the folder was
+            os.utime(dest, (item["activity"], item["activity"]))
+            self._discard([src])
+        except Cancelled:
+            return None
+        except Exception as e:
+            self._record("failed", item["name"], error=f"{type(e).__name__}: {e}")
+            return None
+        finally:
+            self.current = None
+        self.totals["bytes_in"] += bytes_in
+        self.totals["bytes_out"] += bytes_out
+        SAVED.inc(max(0, bytes_in - bytes_out))
+        self._record("archived", item["name"], archive=os.path.basename(dest), bytes_in=bytes_in, bytes_out=bytes_out)
+        return bytes_in, bytes_out
+
+    def _expire(self, items, protected, idle_cutoff, total, now):
+        s = self.settings
+        doomed = []
+        if s["delete_after_days"] is not None:
+            cutoff = now - s["delete_after_days"] * 86400
+            doomed += [item for item in items if item["archive"] and item["activity"] < cutoff]
+        if s["hard_limit_gb"] is not None:
+            limit = s["hard_limit_gb"] * 1024**3
+            total -= sum(item["size"] or 0 for item in doomed)
+            # Archives first (oldest first), idle run folders only if that is not enough
+            candidates = [item for item in items if item["archive"]] + \
+                         [item for item in items if not item["archive"] and item["name"] not in protected
+                          and item["activity"] < idle_cutoff]
+            for item in candidates:
+                if total <= limit:
+                    break
+                if item not in doomed:
+                    doomed.append(item)
+                    total -= item["size"] or 0
+        for item in doomed:
+            try:
+                self._discard([item["path"]])
+                self._record("deleted", item["name"], bytes=item["size"])
+            except Exception as e:
+                self._record("failed", item["name"], error=f"{type(e).__name__}: {e}")
+        return len(doomed)
+
+    def _discard(self, paths):
+        if self.discard is not None:
+            self.discard(paths)
+            return
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+
+    def _record(self, action, name, **details):
+        RUNS.inc(action=action)
+        self.totals[action] += 1
+        event = dict(details, action=action, name=name, at=time.time())
+        self.recent.append(event)
+        if action == "failed":
+            logging.error(f"Retention: {name}: {details.get('error')}")
+        if self.on_update:
+            try:
+                self.on_update(event)
+            except Exception:
+                pass
+
+    def status(self):
+        return {"enabled": self.settings["enabled"], "folder": self.folder, "settings": self.settings,
+                "current": self.current, "last_pass": self.last_pass, "totals": dict(self.totals),
+                "recent": list(self.recent)}
@@ -0,0 +1,176 @@
+import heapq
+import json
+import logging
+import os
+import threading
+import time
+from instrument import timed
+
+
+class SegmentIndex:
+    """
+    Maps run-folder name segments (every `segment_len`-character slice of a folder name, which is
+    what a `*{segment}*` glob matches) to the folders under `root`, with their mtimes.
+
+    Built once at start (or loaded from `cache_path`), then kept current by a background thread
+    that re-lists `root` only when its mtime moves. Lookups re-stat just the few candidates, so
+    the answer is as fresh as a glob + max(getmtime) without scanning the whole root.
+    """
+
+    def __init__(self, root, segment_len=7, cache_path=None, interval=5.0, full_rescan=300.0):
+        self.root = root
+        self.segment_len = segment_len
+        self.cache_path = cache_path
+        self.interval = interval
+        self.full_rescan = full_rescan
+        self._folders = {}      # folder name -> mtime
+        self._by_segment = {}   # segment -> set of folder names
+        self._root_mtime = None
+        self._last_full = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            if not self._load():
+                self.rescan()
+            self._thread = threading.Thread(target=self._run, name=f"segment-index:{self.root}", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _segments(self, name):
+        n = self.segment_len
+        return {name[i:i + n] for i in range(len(name) - n + 1)}
+
+    def _add(self, name, mtime):
+        if name not in self._folders:
+            for seg in self._segments(name):
+                self._by_segment.setdefault(seg, set()).add(name)
+        self._folders[name] = mtime
+
+    def _remove(self, name):
+        self._folders.pop(name, None)
+        for seg in self._segments(name):
+            names = self._by_segment.get(seg)
+            if names:
+                names.discard(name)
+                if not names:
+                    del self._by_segment[seg]
+
+    # --- Maintenance ---
+    @timed("segment_index_scan")
+    def rescan(self):
+        """Lists `root` once and applies the difference (new, removed and re-dated folders)."""
+        try:
+            root_mtime = os.stat(self.root).st_mtime
+            current = {}
+            with os.scandir(self.root) as it:
+                for e in it:
+                    try:
+                        if e.is_dir():
+                            current[e.name] = e.stat().st_mtime
+                    except OSError:
+                        continue
+        except OSError:
+            root_mtime, current = None, {}
+
+        with self._lock:
+            for name in self._folders.keys() - current.keys():
+                self._remove(name)
+                self._dirty = True
+            for name, mtime in current.items():
+                if self._folders.get(name) != mtime:
+                    self._add(name, mtime)
+                    self._dirty = True
+            if root_mtime != self._root_mtime:
+                self._root_mtime = root_mtime
+                self._dirty = True
+            self._last_full = time.monotonic()
+        self._save()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                try:
+                    root_mtime = os.stat(self.root).st_mtime
+                except OSError:
+                    root_mtime = None
+                if root_mtime != self._root_mtime or time.monotonic() - self._last_full >= self.full_rescan:
+                    self.rescan()
+            except Exception as e:
+                logging.error(f"Segment index refresh failed for {self.root}: {e}")
+
+    # --- Persistence ---
+    def _load(self):
+        """Loads a saved index; returns False if there is none or the root changed since."""
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, 'r') as f:
+                saved = json.load(f)
+            if saved.get("root") != self.root or saved.get("segment_len") != self.segment_len:
+                return False
+            with self._lock:
+                for name, mtime in saved["folders"].items():
+                    self._add(name, mtime)
+                self._root_mtime = saved.get("root_mtime")
+                self._last_full = time.monotonic()
+            # The background loop rescans on its own if root changed while we were down
+            return True
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable segment index cache {self.cache_path}: {e}")
+            return False
+
+    def _save(self):
+        if not self.cache_path or not self._dirty:
+            return
+        with self._lock:
+            saved = {"root": self.root, "segment_len": self.segment_len,
+                     "root_mtime": self._root_mtime, "folders": dict(self._folders)}
+            self._dirty = False
+        tmp = self.cache_path + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(saved, f)
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            logging.warning(f"Could not save segment index to {self.cache_path}: {e}")
+
+    # --- Lookups ---
+    def _fresh(self, names):
+        """Re-stats the candidate folders so the ordering reflects their current mtimes."""
+        result = []
+        for name in names:
+            path = os.path.join(self.root, name)
+            try:
+                result.append((os.path.getmtime(path), path))
+            except OSError:
+                continue  # Deleted since the last refresh
+        result.sort(reverse=True)
+        return [path for _, path in result]
+
+    def lookup(self, segment):
+        """Full paths of every folder whose name contains `segment`, newest first."""
+        with self._lock:
+            if len(segment) == self.segment_len:
+                names = list(self._by_segment.get(segment, ()))
+            else:
+                # Odd-length segment: still no disk scan, just a pass over the names in memory
+                names = [n for n in self._folders if segment in n]
+        return self._fresh(names)
+
+    def latest_for(self, segment):
+        folders = self.lookup(segment)
+        return folders[0] if folders else None
+
+    def latest(self, candidates=5):
+        """Most recently modified folder under root (re-checks the top few indexed ones)."""
+        with self._lock:
+            names = heapq.nlargest(candidates, self._folders, key=self._folders.get)
+        folders = self._fresh(names)
+        return folders[0] if folders else None
@@ -0,0 +1,476 @@
+import fnmatch
+import io
+import json
+import queue
+import selectors
+import signal
+import socket
+import threading
+import time
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+from instrument import REGISTRY, counter
+
+PROBE_PATHS = ("/healthz", "/readyz")
+MAX_DISCARD = 10 * 1024 * 1024  # unread request body skipped to keep a connection open
+
+DEFAULTS = {
+    "workers": 16,            # fast pool: reads, listings, status polls
+    "queue_size": 64,         # connections waiting for a fast worker before 503
+    "slow_workers": 4,        # kill / delete / transfer / log reads
+    "slow_queue_size": 32,
+    "stream_workers": 32,     # long-lived SSE connections
+    "retry_after": 5,         # seconds, sent with 503
+    "socket_timeout": 5,      # seconds a read or write on a connection may block mid-request
+    "keepalive_idle": 30,     # seconds a connection may wait for its (next) request, holding no worker
+    "drain_timeout": 30,      # seconds to finish in-flight requests on shutdown
+    "default_pool": "slow",   # pool for requests whose path had not fully arrived when classified
+}
+
+REJECTED = counter("http_rejected_total", "Connections answered 503 because a worker queue was full.",
+                   ("service", "pool"))
+
+
+class WorkerPool:
+    """Fixed number of threads fed by a bounded queue; submit() returns False instead of blocking when full."""
+
+    def __init__(self, name, workers, queue_size, handle):
+        self.name = name
+        self.handle = handle
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.busy = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.threads = [threading.Thread(target=self._run, name=f"{name}-worker-{i}", daemon=True)
+                        for i in range(workers)]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, item):
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            with self._lock:
+                self.busy += 1
+            try:
+                self.handle(*item)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+                    self._idle.notify_all()
+
+    def in_flight(self):
+        return self.busy + self.queue.qsize()
+
+    def saturated(self):
+        return self.queue.full()
+
+    def drain(self, deadline):
+        """Waits until queued and running requests are done or the deadline passes; True if drained."""
+        with self._lock:
+            while self.busy or not self.queue.empty():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._idle.wait(min(remaining, 0.5))
+        return True
+
+
+class BodyReader(io.RawIOBase):
+    """
+    One request's body on a kept-alive connection: reads stop at Content-Length, so neither the
+    app nor werkzeug's post-response drain can swallow the next request from the shared buffer.
+    """
+
+    def __init__(self, rfile, length):
+        self.rfile = rfile
+        self.remaining = length
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.read(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+    def readinto(self, b):
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+    def readline(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.rfile.readline(size) if size else b""
+        self.remaining -= len(data)
+        return data
+
+
+class Connection:
+    """An accepted socket and its read buffer, which outlives each request on a keep-alive connection."""
+
+    __slots__ = ("sock", "address", "rfile")
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.rfile = sock.makefile("rb")
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def peek(self):
+        """What the client has sent that no request has read yet, without blocking; b"" if nothing (or EOF)."""
+        self.sock.settimeout(0)
+        try:
+            return self.rfile.peek(1024)[:1024]
+        except OSError:
+            return b""
+        finally:
+            self.sock.settimeout(None)
+
+
+class PooledHandler(WSGIRequestHandler):
+    """
+    HTTP/1.1 with keep-alive, one request per hand-off: after each response a persistent
+    connection goes back to the classifier, so its next request is routed on its own path and
+    an idle client holds no worker. The connection closes on errors, when the client asks, on
+    chunked uploads (no length to stop at) and while the server drains.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        self.conn = self.request
+        self.request = self.conn.sock
+        super().setup()
+        self.rfile.close()
+        self.rfile = self.conn.rfile  # may already hold the start of this request
+
+    def handle(self):
+        self.close_connection = True
+        try:
+            self.handle_one_request()
+        except (ConnectionError, socket.timeout) as e:
+            self.connection_dropped(e)
+            self.close_connection = True
+
+    def run_wsgi(self):
+        if self.headers.get("Transfer-Encoding", "").strip().lower() == "chunked":
+            self.close_connection = True
+            return super().run_wsgi()
+        try:
+            length = max(0, int(self.headers.get("Content-Length") or 0))
+        except ValueError:
+            self.close_connection = True
+            length = 0
+        body = BodyReader(self.conn.rfile, length)
+        self.rfile = body
+        try:
+            super().run_wsgi()
+        finally:
+            self.rfile = self.conn.rfile
+        # The next request line is behind whatever body the app did not read: skip a small rest,
+        # close rather than read a large one
+        try:
+            while 0 < body.remaining <= MAX_DISCARD and body.read(65536):
+                pass
+        except OSError:
+            pass
+        if body.remaining:
+            self.close_connection = True
+
+    def send_header(self, keyword, value):
+        # werkzeug >= 2.1 closes every connection; persistence is decided here instead
+        if (keyword.lower() == "connection" and value.lower() == "close"
+                and not self.close_connection and not self.server.draining):
+            return
+        super().send_header(keyword, value)
+
+    def finish(self):
+        self.rfile = io.BytesIO()  # the connection's buffer is closed with the connection, not here
+        super().finish()
+
+
+class Classifier:
+    """
+    Holds connections until a request starts arriving, then calls route(conn, path), with path
+    None if only part of the request line is there. One selector waits on all of them, so a
+    slow client never holds up the accept loop or the clients behind it, and an idle one holds
+    no worker. A connection that sends nothing for `idle_timeout`, or hangs up, is closed.
+    """
+
+    def __init__(self, route, close, idle_timeout):
+        self.route = route
+        self.close = close
+        self.idle_timeout = idle_timeout
+        self.selector = selectors.DefaultSelector()
+        self._incoming = queue.SimpleQueue()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ)
+        self._pending = {}  # conn -> deadline
+        self._stopped = False
+        threading.Thread(target=self._run, name="classifier", daemon=True).start()
+
+    def add(self, conn):
+        self._incoming.put(conn)
+        self._wake()
+
+    def stop(self):
+        self._stopped = True
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except OSError:
+            pass  # the buffer is full of wake-ups already
+
+    def _run(self):
+        while not self._stopped:
+            wait = min(self._pending.values(), default=None)
+            if wait is not None:
+                wait = max(0, wait - time.monotonic())
+            for key, _ in self.selector.select(wait):
+                if key.fileobj is self._wake_r:
+                    self._take_incoming()
+                else:
+                    self._classify(key.fileobj)
+            now = time.monotonic()
+            for conn in [c for c, d in self._pending.items() if d <= now]:
+                self._drop(conn)
+        for conn in list(self._pending):
+            self._drop(conn)
+        while True:
+            try:
+                conn = self._incoming.get_nowait()
+            except queue.Empty:
+                break
+            self.close(conn)
+        self.selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
+
+    def _take_incoming(self):
+        try:
+            while self._wake_r.recv(1024):
+                pass
+        except OSError:
+            pass
+        while True:
+            try:
+                conn = self._incoming.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                self.selector.register(conn, selectors.EVENT_READ)
+            except (OSError, ValueError):
+                self.close(conn)
+                continue
+            self._pending[conn] = time.monotonic() + self.idle_timeout
+            if conn.peek():
+                self._classify(conn)  # pipelined: the next request is already in the buffer
+
+    def _classify(self, conn):
+        # Readable, so this is the start of a request, or b"" if the client hung up
+        data = conn.peek()
+        if not data:
+            self._drop(conn)
+            return
+        self._dispatch(conn, request_target(data)[1])
+
+    def _drop(self, conn):
+        self.selector.unregister(conn)
+        del self._pending[conn]
+        self.close(conn)
+
+    def _dispatch(self, conn, path):
+        self.selector.unregister(conn)
+        del self._pending[conn]
+        try:
+            self.route(conn, path)
+        except Exception:
+            self.close(conn)
+
+
+def request_target(data):
+    """
+    (method, path) from the start of a raw HTTP request, or (None, None) while the path may still
+    be arriving (it ends at a space, "?" or the end of the request line).
+    """
+    line, end, _ = data.partition(b"\r\n")
+    parts = line.decode("latin-1", "replace").split(" ")
+    if len(parts) < 2 or (len(parts) == 2 and not end and "?" not in parts[1]):
+        return None, None
+    return parts[0], parts[1].split("?", 1)[0]
+
+
+class PooledWSGIServer(BaseWSGIServer):
+    """
+    Werkzeug's WSGI server with the thread-per-connection model replaced by fixed pools:
+    the accept loop hands each connection to the classifier, which peeks at its request line
+    and passes it to the stream, slow or fast pool (probes get their own small pool so they
+    answer while the others are busy). Keep-alive connections go back to the classifier after
+    every response, so each request is classified on its own. A request whose path had only
+    partly arrived goes to the default pool. A full pool queue is answered 503 + Retry-After
+    right away instead of piling up threads.
+    """
+
+    multithread = True
+
+    def __init__(self, host, port, app, service, settings, slow_paths=(), stream_paths=()):
+        self.service = service
+        self.settings = settings
+        self.slow_paths = tuple(slow_paths)
+        self.stream_paths = tuple(stream_paths)
+        self.draining = False
+        handler = type("Handler", (PooledHandler,), {"timeout": settings["socket_timeout"]})
+        super().__init__(host, port, app, handler=handler)
+        self.pools = {
+            "fast": WorkerPool("fast", settings["workers"], settings["queue_size"], self._handle),
+            "slow": WorkerPool("slow", settings["slow_workers"], settings["slow_queue_size"], self._handle),
+            "stream": WorkerPool("stream", settings["stream_workers"], settings["stream_workers"], self._handle),
+            "probe": WorkerPool("probe", 2, 16, self._handle),
+        }
+        REGISTRY.callback("http_pool_in_flight", "Requests queued or running per worker pool.",
+                          lambda: {(service, name): p.in_flight() for name, p in self.pools.items()},
+                          labelnames=("service", "pool"))
+        self.classifier = Classifier(self._route, self._close, settings["keepalive_idle"])
+
+    def _matches(self, path, patterns):
+        return any(fnmatch.fnmatchcase(path, p) if "*" in p else path == p for p in patterns)
+
+    def classify(self, path):
+        if path is None:
+            return self.settings["default_pool"]
+        if path in PROBE_PATHS:
+            return "probe"
+        if self._matches(path, self.stream_paths):
+            return "stream"
+        if self._matches(path, self.slow_paths):
+            return "slow"
+        return "fast"
+
+    def process_request(self, request, client_address):
+        self.classifier.add(Connection(request, client_address))
+
+    def _route(self, conn, path):
+        pool = self.pools[self.classify(path)]
+        if not pool.submit((conn,)):
+            REJECTED.inc(service=self.service, pool=pool.name)
+            self._reject(conn)
+
+    def _reject(self, conn):
+        body = json.dumps({"status": "error", "message": "Server busy, retry later"}).encode()
+        head = (f"HTTP/1.1 503 Service Unavailable\r\nRetry-After: {self.settings['retry_after']}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n")
+        try:
+            conn.sock.sendall(head.encode() + body)
+        except OSError:
+            pass
+        self._close(conn)
+
+    def _handle(self, conn):
+        keep = False
+        try:
+            handler = self.RequestHandlerClass(conn, conn.address, self)
+            keep = not handler.close_connection and not self.draining
+        except Exception:
+            self.handle_error(conn.sock, conn.address)
+        finally:
+            if keep:
+                self.classifier.add(conn)
+            else:
+                self._close(conn)
+
+    def _close(self, conn):
+        conn.rfile.close()
+        self.shutdown_request(conn.sock)
+
+    def ready(self):
+        return not self.draining and not self.pools["fast"].saturated()
+
+    def drain(self):
+        """Waits for in-flight requests (streams excepted) up to drain_timeout; True if all finished."""
+        self.draining = True
+        self.classifier.stop()
+        deadline = time.monotonic() + self.settings["drain_timeout"]
+        return all([self.pools[name].drain(deadline) for name in ("fast", "slow")])
+
+
+def add_probe_routes(app, server_ref, ready_check=None):
+    """
+    /healthz: the process is up and serving. /readyz: 503 while draining, while the fast
+    pool's queue is full, or while ready_check() (the app's own readiness) returns False.
+    """
+    from flask import jsonify
+
+    @app.route('/healthz')
+    def healthz():
+        return jsonify({"status": "ok"})
+
+    @app.route('/readyz')
+    def readyz():
+        server = server_ref()
+        reasons = []
+        if server is not None and server.draining:
+            reasons.append("draining")
+        elif server is not None and not server.ready():
+            reasons.append("saturated")
+        if ready_check is not None:
+            try:
+                ok = ready_check()
+            except Exception as e:
+                ok, reasons = False, reasons + [f"check failed: {e}"]
+            if not ok:
+                reasons.append("not ready")
+        if reasons:
+            return jsonify({"status": "unavailable", "reasons": reasons}), 503
+        return jsonify({"status": "ready", "in_flight": {name: p.in_flight() for name, p in server.pools.items()}
+                        if server is not None else {}})
+
+    return app
+
+
+def serve(app, port, host='0.0.0.0', service="app", settings=None, slow_paths=(), stream_paths=(),
+          ready_check=None):
+    """
+    Runs app on a pooled server until SIGINT/SIGTERM (SIGBREAK on Windows), then stops accepting
+    new connections and drains in-flight requests. `settings` overrides DEFAULTS (usually the
+    "server" section of config.json); slow_paths/stream_paths are URL paths, "*" allowed.
+    """
+    settings = dict(settings or {})
+    if "keepalive_timeout" in settings:  # the old name of socket_timeout
+        settings.setdefault("socket_timeout", settings.pop("keepalive_timeout"))
+    settings = dict(DEFAULTS, **settings)
+    holder = {}
+    add_probe_routes(app, lambda: holder.get("server"), ready_check)
+    server = PooledWSGIServer(host, port, app, service, settings, slow_paths, stream_paths)
+    holder["server"] = server
+
+    def stop(signum, frame):
+        print(f"Signal {signum}: draining {service} ...")
+        server.draining = True
+        # shutdown() waits for serve_forever to return, so it cannot run on the main thread
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    for name in ("SIGINT", "SIGTERM", "SIGBREAK"):
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), stop)
+
+    print(f"{service}: serving on http://{host}:{server.port} ({settings['workers']} workers, "
+          f"{settings['slow_workers']} slow, queue {settings['queue_size']})")
+    server.serve_forever()  # closes the listening socket when it returns
+    if server.drain():
+        print(f"{service}: drained, exiting")
+    else:
+        print(f"{service}: drain timeout after {settings['drain_timeout']}s, exiting with requests in flight")
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from folder_watch import versioned_etag
+
+
+def slot_folders(root, count, prefix="slot"):
+    """{slot number: folder}: the folder itself for one slot, else sub-folders <prefix>1..<prefix>N."""
+    if count <= 1:
+        return {1: root}
+    return {i: os.path.join(root, f"{prefix}{i}") for i in range(1, count + 1)}
+
+
+class SlotSet:
+    """
+    The processing folder as job slots, one job per slot. With job_slots 1 the slot is the folder
+    itself (the original layout); with more, each slot is a sub-folder (slot1, slot2, ...) that the
+    job runner for that slot picks files up from.
+
+    Reads like a single FolderWatcher over all slots - entries(), names(), version, etag(),
+    subscribe(), rescan() - with a "slot" number on every entry, so listings, file correlation and
+    job events work unchanged. File names are assumed unique across slots.
+
+    make_watcher(path) returns a started FolderWatcher for one slot folder.
+    """
+
+    def __init__(self, root, count=1, prefix="slot", make_watcher=None):
+        self.make_watcher = make_watcher
+        self.root = None
+        self.count = 0
+        self.prefix = prefix
+        self._watchers = {}             # slot -> FolderWatcher
+        self._listeners = []
+        self._base = 0                  # bumped on reconfigure so the version never repeats
+        self._merged = (None, {})       # (version, entries)
+        self._reserved = set()          # slots a transfer is filling right now
+        self._lock = threading.Lock()
+        self.configure(root, count, prefix)
+
+    def configure(self, root, count, prefix=None):
+        """Applies root/slot count (config reload); returns True if the slots changed."""
+        prefix = prefix or self.prefix
+        count = max(1, int(count or 1))
+        if (root, count, prefix) == (self.root, self.count, self.prefix):
+            return False
+        folders = slot_folders(root, count, prefix)
+        if count > 1:
+            for folder in folders.values():
+                try:
+                    os.makedirs(folder, exist_ok=True)
+                except OSError as e:
+                    logging.error(f"Cannot create job slot {folder}: {e}")
+        with self._lock:
+            old = self._watchers
+            self._base = self.version + 1
+            watchers = {}
+            for slot, folder in folders.items():
+                watcher = self.make_watcher(folder)
+                watcher.subscribe(self._relay(slot))
+                watchers[slot] = watcher
+            self.root, self.count, self.prefix = root, count, prefix
+            self._watchers = watchers
+            self._reserved &= set(watchers)
+        for watcher in old.values():
+            watcher.stop()
+        return True
+
+    def _relay(self, slot):
+        def on_change(watcher, added, removed):
+            if self._watchers.get(slot) is not watcher:
+                return  # A slot dropped by configure()
+            added = [dict(e, slot=slot) for e in added]
+            removed = [dict(e, slot=slot) for e in removed]
+            for callback in self._listeners:
+                callback(self, added, removed)
+        return on_change
+
+    # --- FolderWatcher reading interface ---
+    @property
+    def version(self):
+        return self._base + sum(w.version for w in self._watchers.values())
+
+    @property
+    def path(self):
+        return self.root
+
+    def subscribe(self, callback):
+        """callback(slot_set, added, removed), entries carrying their "slot"."""
+        self._listeners.append(callback)
+
+    def entries(self):
+        """name -> entry dict with "slot", over every slot (do not mutate)."""
+        version, merged = self._merged
+        current = self.version
+        if version != current:
+            merged = {}
+            for slot, watcher in self._watchers.items():
+                for name, entry in watcher.entries().items():
+                    merged[name] = dict(entry, slot=slot)
+            merged = dict(sorted(merged.items()))
+            self._merged = (current, merged)
+        return merged
+
+    def names(self):
+        return list(self.entries())
+
+    def exists(self):
+        return bool(self._watchers) and all(w.exists() for w in self._watchers.values())
+
+    def etag(self):
+        return versioned_etag(self.version)
+
+    def rescan(self):
+        changed = False
+        for watcher in list(self._watchers.values()):
+            changed = watcher.rescan() or changed
+        return changed
+
+    # --- Slots ---
+    def folder(self, slot):
+        watcher = self._watchers.get(slot)
+        return watcher.path if watcher else None
+
+    def slot_of(self, filename):
+        entry = self.entries().get(filename)
+        return entry["slot"] if entry else None
+
+    def path_of(self, filename, slot=None):
+        """Path of a processing file: in the given slot, the slot holding it, or slot 1."""
+        slot = slot or self.slot_of(filename) or 1
+        return os.path.join(self.folder(slot) or self.root, filename)
+
+    def free(self):
+        """Slots with no file in them and no transfer filling them, lowest first."""
+        with self._lock:
+            return [slot for slot, w in sorted(self._watchers.items())
+                    if not w.entries() and slot not in self._reserved]
+
+    @contextmanager
+    def reserve(self, slot=None):
+        """
+        Holds a free slot (the given one, or the lowest free) while a file is moved into it, so
+        concurrent pushes never pick the same slot. Yields the slot number, or None if none is free.
+        """
+        with self._lock:
+            candidates = [slot] if slot else sorted(self._watchers)
+            chosen = next((s for s in candidates if s in self._watchers and s not in self._reserved
+                           and not self._watchers[s].entries()), None)
+            if chosen is not None:
+                self._reserved.add(chosen)
+        try:
+            yield chosen
+        finally:
+            if chosen is not None:
+                with self._lock:
+                    self._reserved.discard(chosen)
+
+    def status(self):
+        """One {"slot", "folder", "files", "reserved"} per slot."""
+        with self._lock:
+            reserved = set(self._reserved)
+            watchers = sorted(self._watchers.items())
+        return [{"slot": slot, "folder": w.path, "files": w.names(), "reserved": slot in reserved}
+                for slot, w in watchers]
@@ -0,0 +1,143 @@
+import pytest
+import authz
+from authz import Authorizer, DecisionCache, FakeBackend
+
+GROUPS = ["APP_Monitor_Users", "APP_Monitor_Admins"]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Controls time.monotonic() as seen by the decision cache."""
+    now = [1000.0]
+    monkeypatch.setattr(authz.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_backend():
+    return FakeBackend({"alice": (["APP_Monitor_Users"], "Alice A."),
+                        "bob": (["Other_Group"], "Bob B.")},
+                       passwords={"alice": "s3cret"})
+
+
+def test_member_of_a_group_is_allowed():
+    auth = Authorizer(make_backend(), GROUPS)
+    assert auth.check("alice", "s3cret") == (True, "Alice A.")
+
+
+def test_non_member_and_unknown_user_are_denied():
+    auth = Authorizer(make_backend(), GROUPS)
+    assert auth.check("bob") == (False, "Bob B.")
+    assert auth.check("mallory") == (False, None)
+
+
+def test_wrong_password_is_denied():
+    auth = Authorizer(make_backend(), GROUPS)
+    assert auth.check("alice", "guess") == (False, None)
+    assert auth.check("alice", None) == (False, None)
+
+
+def test_identity_case_does_not_bypass_the_password():
+    auth = Authorizer(make_backend(), GROUPS)
+    assert auth.check("Alice", "guess") == (False, None)
+    assert auth.check("ALICE", None) == (False, None)
+    assert auth.check("Alice", "s3cret") == (True, "Alice A.")
+
+
+def test_password_keys_are_case_insensitive():
+    backend = FakeBackend({"Carol": (["APP_Monitor_Admins"], "Carol C.")}, passwords={"CAROL": "pw"})
+    auth = Authorizer(backend, GROUPS)
+    assert auth.check("carol", "pw") == (True, "Carol C.")
+    assert auth.check("carol", "nope") == (False, None)
+
+
+def test_decisions_are_cached_until_their_ttl(clock):
+    backend = make_backend()
+    auth = Authorizer(backend, GROUPS, DecisionCache(positive_ttl=60, negative_ttl=5))
+    assert auth.check("alice", "s3cret")[0]
+    assert auth.check("Alice", "s3cret")[0]
+    assert backend.calls == 1
+
+    clock[0] += 59
+    auth.check("alice", "s3cret")
+    assert backend.calls == 1
+    clock[0] += 2
+    auth.check("alice", "s3cret")
+    assert backend.calls == 2
+
+
+def test_denials_use_the_shorter_ttl(clock):
+    backend = make_backend()
+    auth = Authorizer(backend, GROUPS, DecisionCache(positive_ttl=60, negative_ttl=5))
+    assert not auth.check("bob")[0]
+    clock[0] += 4
+    auth.check("bob")
+    assert backend.calls == 1
+    clock[0] += 2
+    auth.check("bob")
+    assert backend.calls == 2
+
+
+def test_backend_errors_are_denied_and_not_cached():
+    class Broken:
+        calls = 0
+
+        def lookup(self, identity, credential, groups):
+            self.calls += 1
+            raise RuntimeError("directory unreachable")
+
+    backend = Broken()
+    auth = Authorizer(backend, GROUPS)
+    assert auth.check("alice") == (False, None)
+    assert auth.check("alice") == (False, None)
+    assert backend.calls == 2
+
+
+def test_invalidate_forgets_every_variant_of_a_user():
+    backend = make_backend()
+    auth = Authorizer(backend, GROUPS)
+    auth.check("alice", "s3cret")
+    auth.check("alice", "guess")
+    auth.invalidate("ALICE")
+    auth.check("alice", "s3cret")
+    assert backend.calls == 3
+
+
+def test_configure_keeps_cached_decisions_and_applies_new_ttls(clock):
+    backend = make_backend()
+    cache = DecisionCache(positive_ttl=60, negative_ttl=5, max_size=10)
+    auth = Authorizer(backend, GROUPS, cache)
+    auth.check("alice", "s3cret")
+    cache.configure(positive_ttl=600, negative_ttl=5, max_size=10)
+    auth.check("alice", "s3cret")
+    assert backend.calls == 1
+    auth.check("bob")
+    clock[0] += 61
+    auth.check("alice", "s3cret")
+    assert backend.calls == 3  # the old entry kept its 60s; the refreshed one gets 600s
+    clock[0] += 500
+    auth.check("alice", "s3cret")
+    assert backend.calls == 3
+
+
+def test_configure_shrinks_the_cache_to_max_size():
+    cache = DecisionCache(max_size=10)
+    for user in "abcde":
+        cache.put((user, None), (True, user))
+    cache.configure(positive_ttl=300, negative_ttl=30, max_size=2)
+    assert len(cache) == 2
+    assert cache.get(("e", None)) == (True, "e")
+
+
+def test_shared_authorizer_retires_replaced_pools(monkeypatch):
+    retired, closed = [], []
+    monkeypatch.setattr(authz.HelperPool, "retire", lambda pool: retired.append(pool))
+    monkeypatch.setattr(authz.HelperPool, "close", lambda pool: closed.append(pool))
+    shared = authz.SharedAuthorizer()
+    config = {"ad_groups": GROUPS, "ps_pool": {"size": 1}}
+    first = shared.get(config)
+    pool = first.backend.pool
+    shared.on_config_change(config, dict(config, ps_pool={"size": 3}))
+    assert retired == [pool] and first.backend.pool.size == 3
+    second = shared.get(dict(config, ad_groups=["Other_Group"]))
+    assert second is not first and retired == [pool, first.backend.pool]
+    assert not closed
@@ -0,0 +1,63 @@
+import fleet
+from fleet import FleetClient
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_client(monkeypatch, **kwargs):
+    client = FleetClient(["a", "b"], 5000, **kwargs)
+    client.calls = 0
+
+    def fake_get(ip, path, params=None):
+        client.calls += 1
+        return {"ok": True, "data": {"ip": ip, "params": params}, "elapsed_ms": 0}
+
+    monkeypatch.setattr(client, "_get", fake_get)
+    return client
+
+
+def test_results_are_cached_for_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fleet.time, "monotonic", clock)
+    client = make_client(monkeypatch, ttl=2.0)
+    client.query(["scan"])
+    client.query(["scan"])
+    assert client.calls == 2  # one per server
+    clock.now += 3
+    client.query(["scan"])
+    assert client.calls == 4
+    client.close()
+
+
+def test_cache_is_bounded_and_drops_expired_entries(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(fleet.time, "monotonic", clock)
+    client = make_client(monkeypatch, ttl=2.0, max_cached=3)
+    for q in range(10):
+        client.query(["scan"], {"q": str(q)})
+    assert len(client._cache) == 3
+    assert [dict(k[1])["q"] for k in client._cache] == ["7", "8", "9"]
+    clock.now += 3
+    client.query(["scan"], {"q": "fresh"})
+    assert len(client._cache) == 1
+    client.close()
+
+
+def test_close_waits_for_the_last_holder(monkeypatch):
+    client = make_client(monkeypatch)
+    shut = []
+    monkeypatch.setattr(client, "_shutdown", lambda: shut.append(True))
+    client.acquire()
+    client.acquire()
+    client.close()
+    assert not shut
+    client.release()
+    assert not shut
+    client.release()
+    assert shut == [True]
@@ -0,0 +1,39 @@
+import pytest
+from listing import Lister, ListingError, ListingQuery, encode_cursor, decode_cursor
+
+FIELDS = ("name", "is_dir", "size", "mtime")
+
+
+class Watcher:
+    version = 1
+
+    def __init__(self, names):
+        self._entries = {n: {"name": n, "is_dir": False, "size": i, "mtime": 100.0 + i}
+                         for i, n in enumerate(names)}
+
+    def entries(self):
+        return self._entries
+
+
+def query(**args):
+    return ListingQuery(args, FIELDS, ("name",))
+
+
+def test_cursor_pages_follow_the_sort():
+    lister = Lister(Watcher(["a", "b", "c", "d", "e"]))
+    first = lister.page(query(sort="mtime", limit="2"))
+    assert [r["name"] for r in first["items"]] == ["a", "b"]
+    second = lister.page(query(sort="mtime", limit="2", cursor=first["next_cursor"]))
+    assert [r["name"] for r in second["items"]] == ["c", "d"]
+
+
+@pytest.mark.parametrize("sort,key", [("mtime", ["a"]), ("size", ["a", "b"]), ("name", [1.5, "a"]),
+                                      ("name", [3]), ("mtime", [True, "a"])])
+def test_cursor_of_another_sort_is_rejected(sort, key):
+    with pytest.raises(ListingError):
+        query(sort=sort, cursor=encode_cursor(key))
+
+
+def test_garbage_cursor_is_rejected():
+    with pytest.raises(ListingError):
+        decode_cursor("!!not-base64!!")
@@ -0,0 +1,33 @@
+import log_search
+import log_tail
+
+
+def test_read_since_advances_through_a_line_longer_than_max_bytes(tmp_path):
+    path = tmp_path / "job.log"
+    path.write_bytes(b"x" * 2500)
+    first = log_tail.read_since(str(path), 0, max_bytes=1000)
+    assert (len(first["log"]), first["offset"]) == (1000, 1000)
+    with open(path, "ab") as f:
+        f.write(b"\nend\npart")
+    second = log_tail.read_since(str(path), first["offset"], first["file_id"], max_bytes=1000)
+    third = log_tail.read_since(str(path), second["offset"], second["file_id"], max_bytes=1000)
+    assert first["log"] + second["log"] + third["log"] == "x" * 2500 + "\nend\n"
+    assert third["offset"] == 2505  # the unfinished "part" waits for its newline
+
+
+def test_tail_lines_are_capped(tmp_path):
+    path = tmp_path / "job.log"
+    path.write_text("line\n" * (log_tail.MAX_LINES + 10))
+    assert log_tail.tail(str(path), 10 ** 9)["log"].count("\n") == log_tail.MAX_LINES
+
+
+def test_index_moves_past_an_overlong_line(tmp_path):
+    log_dir = tmp_path / "runs" / "run1" / "log"
+    log_dir.mkdir(parents=True)
+    (log_dir / "job_P.log").write_bytes(b"HEAD " + b"y" * 200000 + b" TAIL\nsecond line\n")
+    index = log_search.LogSearchIndex([str(tmp_path / "runs")], db_path=str(tmp_path / "index.db"),
+                                      max_bytes_per_pass=1000)
+    while index.refresh():
+        pass
+    assert [hit["line"] for hit in index.search("second")] == [2]
+    assert [hit["line"] for hit in index.search("head", context=0)] == [1]
@@ -0,0 +1,124 @@
+import email
+import hashlib
+import os
+import socketserver
+import threading
+import tracemalloc
+import pytest
+from mailer import BulkMailer
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+    """
+    Just enough SMTP for smtplib without STARTTLS; every message's DATA is kept in `messages`
+    (only its size when keep_data is off).
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPSession)
+        self.messages = []
+        self.keep_data = True
+
+
+class SMTPSession(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        self.reply("220 stand-in ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            verb = line.split(b" ", 1)[0].strip().upper()
+            if verb == b"EHLO":
+                self.wfile.write(b"250-stand-in\r\n250 8BITMIME\r\n")
+            elif verb == b"DATA":
+                self.reply("354 go ahead")
+                lines, size = [], 0
+                for data_line in self.rfile:
+                    if data_line == b".\r\n":
+                        break
+                    size += len(data_line)
+                    if self.server.keep_data:
+                        lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                self.server.messages.append(b"".join(lines) if self.server.keep_data else size)
+                self.reply("250 queued")
+            elif verb == b"QUIT":
+                self.reply("221 bye")
+                return
+            else:  # HELO, MAIL, RCPT, RSET, NOOP
+                self.reply("250 ok")
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPStandIn()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def message(server, attachments, recipient="to@example.com"):
+    return {"smtp": {"server": "127.0.0.1", "port": server.server_address[1], "starttls": False},
+            "sender": "from@example.com", "recipients": [recipient], "subject": "report",
+            "body": "see attached", "attachments": attachments}
+
+
+def attachment_of(raw):
+    msg = email.message_from_bytes(raw)
+    (part,) = [p for p in msg.walk() if p.get_filename()]
+    return part.get_filename(), part.get_payload(decode=True)
+
+
+def test_large_attachment_arrives_intact(smtp_server, tmp_path):
+    path = tmp_path / "big.bin"
+    data = os.urandom(3 * 1024 * 1024 + 17)  # not a multiple of the 57-byte base64 line
+    path.write_bytes(data)
+    mail = BulkMailer(workers=2, retries=0)
+    summary = mail.send([message(smtp_server, [str(path)], f"user{i}@example.com") for i in range(3)])
+    mail.close()
+    assert summary["sent"] == 3 and summary["failed"] == 0
+    for raw in smtp_server.messages:
+        name, payload = attachment_of(raw)
+        assert name == "big.bin"
+        assert hashlib.sha256(payload).digest() == hashlib.sha256(data).digest()
+
+
+def test_attachment_is_streamed_not_held_in_memory(smtp_server, tmp_path):
+    path = tmp_path / "big.bin"
+    path.write_bytes(os.urandom(8 * 1024 * 1024))
+    smtp_server.keep_data = False
+    mail = BulkMailer(workers=1, retries=0)
+    tracemalloc.start()
+    try:
+        summary = mail.send([message(smtp_server, [str(path)])])
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        mail.close()
+    assert summary["sent"] == 1 and smtp_server.messages[0] > 10 * 1024 * 1024
+    assert peak < 2 * 1024 * 1024  # the encoded file alone would be ~11 MB
+
+
+def test_missing_attachment_fails_only_its_message(smtp_server, tmp_path):
+    mail = BulkMailer(workers=1, retries=0)
+    summary = mail.send([message(smtp_server, [str(tmp_path / "missing.pdf")]),
+                         message(smtp_server, [])])
+    mail.close()
+    assert (summary["sent"], summary["failed"]) == (1, 1)
+    assert "attachment" in summary["failures"][0]["error"]
+
+
+def test_lines_starting_with_a_dot_survive(smtp_server):
+    mail = BulkMailer(workers=1, retries=0)
+    msg = message(smtp_server, [])
+    msg["body"] = ".hidden\n.\nend"
+    mail.send([msg])
+    mail.close()
+    body = email.message_from_bytes(smtp_server.messages[0]).get_payload()[0].get_payload(decode=True)
+    assert body == b".hidden\n.\nend"
@@ -0,0 +1,89 @@
+import sys
+import textwrap
+import time
+import pytest
+from ps_pool import HelperPool, WorkerError
+
+# Line-JSON stand-in for the PowerShell worker: member@x.com is in GG_App_Users, crash-once@x.com
+# kills the process the first time it is asked (a marker file remembers), hang@x.com never answers
+STAND_IN = textwrap.dedent("""
+    import json, os, sys, time
+    marker = sys.argv[1]
+    print("banner line that is not JSON", flush=True)
+    for line in sys.stdin:
+        req = json.loads(line)
+        if "crash-once@x.com" in req["emails"] and not os.path.exists(marker):
+            open(marker, "w").close()
+            sys.exit(3)
+        if "hang@x.com" in req["emails"]:
+            time.sleep(60)
+        results = {e: e.startswith("member") and "GG_App_Users" in req["groups"] for e in req["emails"]}
+        print(json.dumps({"id": req["id"], "results": results, "pid": os.getpid()}), flush=True)
+""")
+
+
+@pytest.fixture
+def pool(tmp_path):
+    script = tmp_path / "fake_ad.py"
+    script.write_text(STAND_IN)
+    helpers = HelperPool(host=[sys.executable, str(script), str(tmp_path / "crashed")], size=2, timeout=2.0)
+    yield helpers
+    helpers.close()
+
+
+def worker_pids(pool):
+    return {w.proc.pid for w in pool._all}
+
+
+def test_lookups_go_through_a_reused_worker(pool):
+    assert pool.lookup("member@x.com", ["GG_App_Users"]) is True
+    assert pool.lookup("other@x.com", ["GG_App_Users"]) is False
+    assert pool.lookup_many(["member@x.com", "other@x.com"], ["Someone_Else"]) == \
+        {"member@x.com": False, "other@x.com": False}
+    assert len(pool._all) == 1
+
+
+def test_crashed_worker_is_replaced_and_the_call_retried(pool):
+    pool.lookup("member@x.com", ["GG_App_Users"])
+    first = worker_pids(pool)
+    assert pool.lookup_many(["crash-once@x.com", "member@x.com"], ["GG_App_Users"]) == \
+        {"crash-once@x.com": False, "member@x.com": True}
+    assert worker_pids(pool).isdisjoint(first)
+    assert len(pool._all) == 1
+
+
+def test_worker_that_died_while_idle_is_respawned(pool):
+    pool.lookup("member@x.com", ["GG_App_Users"])
+    (worker,) = pool._all
+    worker.proc.kill()
+    worker.proc.wait()
+    assert pool.lookup("member@x.com", ["GG_App_Users"]) is True
+    assert worker.proc.pid not in worker_pids(pool)
+
+
+def test_hung_worker_times_out_and_is_killed(pool):
+    pool.timeout = 0.3
+    with pytest.raises(WorkerError):
+        pool.lookup("hang@x.com", ["GG_App_Users"])
+    # Both attempts were killed; the next call starts a fresh worker and answers normally
+    assert not pool._all
+    pool.timeout = 2.0
+    assert pool.lookup("member@x.com", ["GG_App_Users"]) is True
+
+
+def test_close_stops_every_worker(pool):
+    pool.lookup_many(["member@x.com"], ["GG_App_Users"])
+    procs = [w.proc for w in pool._all]
+    pool.close()
+    assert all(p.poll() is not None for p in procs)
+
+
+def test_retired_pool_lets_running_calls_finish(pool):
+    pool.timeout = 0.3
+    pool.lookup("member@x.com", ["GG_App_Users"])
+    procs = [w.proc for w in pool._all]
+    pool.retire()
+    assert pool.lookup("member@x.com", ["GG_App_Users"]) is True
+    assert all(p.poll() is None for p in procs)
+    time.sleep(1)
+    assert all(p.poll() is not None for p in procs)
@@ -0,0 +1,101 @@
+import http.client
+import socket
+import threading
+import time
+import pytest
+from flask import Flask, request
+import serve
+
+
+def pool_name():
+    return threading.current_thread().name.split("-")[0]
+
+
+@pytest.fixture
+def server():
+    app = Flask("serve_test")
+
+    @app.route("/fast", methods=["GET", "POST"])
+    def fast():
+        return f"{pool_name()}:{len(request.get_data())}"
+
+    @app.route("/kill-delete", methods=["GET", "POST"])
+    def kill_delete():
+        return f"{pool_name()}:{len(request.get_data())}"
+
+    @app.route("/ignore-body", methods=["POST"])
+    def ignore_body():
+        return pool_name()
+
+    settings = dict(serve.DEFAULTS, keepalive_idle=1)
+    srv = serve.PooledWSGIServer("127.0.0.1", 0, app, "test", settings, slow_paths=["/kill-delete"])
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.drain()
+
+
+def get(conn, method, path, body=None):
+    conn.request(method, path, body=body)
+    res = conn.getresponse()
+    return res.read().decode(), res.getheader("Connection")
+
+
+def read_all(sock):
+    data = b""
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def test_keep_alive_requests_are_classified_one_by_one(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server.port)
+    assert get(conn, "GET", "/fast") == ("fast:0", None)
+    sock = conn.sock
+    assert get(conn, "GET", "/kill-delete") == ("slow:0", None)
+    assert get(conn, "POST", "/kill-delete", b"x" * 100000) == ("slow:100000", None)
+    assert get(conn, "GET", "/fast") == ("fast:0", None)
+    assert conn.sock is sock
+
+
+def test_unread_body_does_not_leak_into_the_next_request(server):
+    conn = http.client.HTTPConnection("127.0.0.1", server.port)
+    assert get(conn, "POST", "/ignore-body", b"GET /kill-delete HTTP/1.1\r\n\r\n" * 100)[0] == "fast"
+    assert get(conn, "GET", "/fast") == ("fast:0", None)
+
+
+def test_pipelined_requests_each_get_their_pool(server):
+    sock = socket.create_connection(("127.0.0.1", server.port))
+    sock.sendall(b"GET /fast HTTP/1.1\r\nHost: x\r\n\r\n"
+                 b"GET /kill-delete HTTP/1.1\r\nHost: x\r\n\r\n"
+                 b"GET /fast HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+    data = read_all(sock)
+    assert data.count(b"HTTP/1.1 200") == 3
+    assert [b for b in (b"fast:0", b"slow:0") if b in data] == [b"fast:0", b"slow:0"]
+
+
+def test_partial_request_line_goes_to_the_default_pool(server):
+    sock = socket.create_connection(("127.0.0.1", server.port))
+    sock.sendall(b"GET /fa")
+    time.sleep(0.1)
+    sock.sendall(b"st HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+    assert read_all(sock).endswith(b"\r\n\r\nslow:0")
+
+
+def test_idle_connections_hold_no_worker_and_are_closed(server):
+    silent = socket.create_connection(("127.0.0.1", server.port))
+    conn = http.client.HTTPConnection("127.0.0.1", server.port)
+    get(conn, "GET", "/fast")
+    time.sleep(0.2)
+    assert all(p.in_flight() == 0 for p in server.pools.values())
+    time.sleep(1.2)
+    assert silent.recv(10) == b""
+    assert conn.sock.recv(10) == b""
+
+
+def test_request_target_waits_for_the_whole_path():
+    assert serve.request_target(b"GET /kill-del") == (None, None)
+    assert serve.request_target(b"GET /logs?q=") == ("GET", "/logs")
+    assert serve.request_target(b"GET /fast HTT") == ("GET", "/fast")
@@ -0,0 +1,109 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from db_pool import SQLitePool
+
+
+def _digest(token):
+    # Only a hash is kept, so a copy of the store does not hand out usable tokens
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class MemoryTokenStore:
+    """
+    Tokens per key with a TTL, in this process only. At most `max_items` are kept; the oldest
+    is dropped first when a new one would go over.
+    """
+
+    def __init__(self, ttl=900, max_items=10000):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._items = OrderedDict()     # key -> (digest, expires)
+        self._lock = threading.Lock()
+
+    def put(self, key, token):
+        with self._lock:
+            self._items.pop(key, None)
+            self._items[key] = (_digest(token), time.time() + self.ttl)
+            self._purge()
+
+    def _purge(self):
+        # Same TTL for every entry, so insertion order is expiry order: only the front needs checking
+        now = time.time()
+        while self._items:
+            _, expires = next(iter(self._items.values()))
+            if expires > now and len(self._items) <= self.max_items:
+                break
+            self._items.popitem(last=False)
+
+    def verify(self, key, token):
+        """True if token is the current, unexpired token for key (does not consume it)."""
+        with self._lock:
+            item = self._items.get(key)
+        if item is None or item[1] <= time.time() or not token:
+            return False
+        return hmac.compare_digest(item[0], _digest(token))
+
+    def discard(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            self._purge()
+            return len(self._items)
+
+
+class SQLiteTokenStore:
+    """
+    The same store in a SQLite file, so every worker process (and a restart) sees the same
+    tokens. Expired rows are deleted on write, and the oldest rows go first above `max_items`.
+    """
+
+    def __init__(self, path, ttl=900, max_items=10000):
+        self.ttl = ttl
+        self.max_items = max_items
+        self.pool = SQLitePool.for_path(path)
+        with self.pool.connection() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, digest TEXT NOT NULL, "
+                       "expires REAL NOT NULL, created REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS tokens_expires ON tokens (expires)")
+
+    def put(self, key, token):
+        now = time.time()
+        with self.pool.connection() as db:
+            db.execute("INSERT OR REPLACE INTO tokens (key, digest, expires, created) VALUES (?, ?, ?, ?)",
+                       (key, _digest(token), now + self.ttl, now))
+            db.execute("DELETE FROM tokens WHERE expires <= ?", (now,))
+            db.execute("DELETE FROM tokens WHERE key IN (SELECT key FROM tokens ORDER BY expires DESC "
+                       "LIMIT -1 OFFSET ?)", (self.max_items,))
+
+    def verify(self, key, token):
+        if not token:
+            return False
+        with self.pool.connection() as db:
+            row = db.execute("SELECT digest FROM tokens WHERE key = ? AND expires > ?",
+                             (key, time.time())).fetchone()
+        return row is not None and hmac.compare_digest(row["digest"], _digest(token))
+
+    def discard(self, key):
+        with self.pool.connection() as db:
+            db.execute("DELETE FROM tokens WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self.pool.connection() as db:
+            return db.execute("SELECT COUNT(*) FROM tokens WHERE expires > ?", (time.time(),)).fetchone()[0]
+
+
+def token_store_from_config(settings):
+    """
+    {"backend": "memory"|"sqlite", "path": "reset_tokens.db", "ttl": 900, "max_items": 10000};
+    use sqlite when more than one worker process serves the app.
+    """
+    settings = settings or {}
+    ttl, max_items = settings.get('ttl', 900), settings.get('max_items', 10000)
+    if settings.get('backend', 'memory') == 'sqlite':
+        return SQLiteTokenStore(settings.get('path', 'reset_tokens.db'), ttl=ttl, max_items=max_items)
+    return MemoryTokenStore(ttl=ttl, max_items=max_items)
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from instrument import counter, span
+
+MOVES = counter("file_moves_total", "Files moved by transfer_file, by how and outcome.", ("mode", "result"))
+MOVED_BYTES = counter("file_moved_bytes_total", "Bytes moved by transfer_file.", ("mode",))
+TRANSFER_RETRIES = counter("transfer_retries_total", "Chunked transfer attempts that had to be retried.")
+
+# Suffixes of in-progress transfers; folder watchers skip these so a half-copied file is never a job
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".part.json"
+STATE_TMP_SUFFIX = STATE_SUFFIX + ".tmp"
+IGNORED_SUFFIXES = (PART_SUFFIX, STATE_SUFFIX, STATE_TMP_SUFFIX)
+
+# In-progress files nothing has written to for this long belong to a transfer that gave up
+ABANDONED_AFTER = 30 * 60
+
+
+class TransferError(Exception):
+    pass
+
+
+def transfer_options(config):
+    """Keyword arguments for transfer_file() from the optional "transfer" block of config.json."""
+    t = config.get('transfer', {})
+    mbps = t.get('bandwidth_mbps')
+    return {
+        "chunk_size": int(t.get('chunk_mb', 8) * 1024 * 1024),
+        "bandwidth": mbps * 1024 * 1024 / 8 if mbps else None,
+        "retries": t.get('retries', 5),
+        "verify": t.get('verify', True),
+    }
+
+
+def _load_state(state_path, src_stat, chunk_size):
+    """(chunk hashes, bytes) already written for this exact source file, or ([], 0) to start over."""
+    try:
+        with open(state_path, 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return [], 0
+    if (state.get("size") != src_stat.st_size or state.get("mtime") != src_stat.st_mtime
+            or state.get("chunk_size") != chunk_size):
+        return [], 0
+    chunks = state.get("chunks", [])
+    return chunks, min(len(chunks) * chunk_size, src_stat.st_size)
+
+
+def _save_state(state_path, src_stat, chunk_size, chunks):
+    tmp = state_path[:-len(STATE_SUFFIX)] + STATE_TMP_SUFFIX
+    with open(tmp, 'w') as f:
+        json.dump({"size": src_stat.st_size, "mtime": src_stat.st_mtime,
+                   "chunk_size": chunk_size, "chunks": chunks}, f)
+    os.replace(tmp, state_path)
+
+
+def _copy_chunks(src, part_path, state_path, src_stat, chunk_size, bandwidth):
+    """Appends the missing chunks to the .part file, recording each chunk's hash as it lands."""
+    chunks, done = _load_state(state_path, src_stat, chunk_size)
+    if not os.path.exists(part_path) or os.path.getsize(part_path) < done:
+        chunks, done = [], 0
+
+    started = time.monotonic()
+    sent = 0
+    with open(src, 'rb') as fin, open(part_path, 'r+b' if done else 'wb') as fout:
+        fin.seek(done)
+        fout.seek(done)
+        fout.truncate()  # Drop any partial chunk past the last good one
+        while True:
+            data = fin.read(chunk_size)
+            if not data:
+                break
+            fout.write(data)
+            fout.flush()
+            os.fsync(fout.fileno())
+            chunks.append(hashlib.sha256(data).hexdigest())
+            _save_state(state_path, src_stat, chunk_size, chunks)
+            sent += len(data)
+            if bandwidth:
+                # Sleep until we are back under the cap
+                ahead = sent / bandwidth - (time.monotonic() - started)
+                if ahead > 0:
+                    time.sleep(ahead)
+    return chunks, done
+
+
+def _verify(part_path, chunks, chunk_size):
+    """Re-reads the destination and compares every chunk with the source's hash."""
+    with open(part_path, 'rb') as f:
+        for i, expected in enumerate(chunks):
+            if hashlib.sha256(f.read(chunk_size)).hexdigest() != expected:
+                return i
+        if f.read(1):
+            return len(chunks)
+    return None
+
+
+def remove_abandoned(folder, max_age=ABANDONED_AFTER):
+    """
+    Deletes in-progress transfer files in `folder` untouched for max_age seconds (a transfer
+    that failed for good leaves them behind, and it may never resume into this folder).
+    Returns the names of the entries still there, live transfers included.
+    """
+    now = time.time()
+    left = []
+    with os.scandir(folder) as it:
+        entries = list(it)
+    for entry in entries:
+        if entry.name.endswith(IGNORED_SUFFIXES):
+            try:
+                if now - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+                    logging.warning(f"TRANSFER: removed abandoned {entry.path}")
+                    continue
+            except FileNotFoundError:
+                continue
+            except OSError as e:
+                logging.warning(f"TRANSFER: cannot remove abandoned {entry.path}: {e}")
+        left.append(entry.name)
+    return left
+
+
+def transfer_file(src, dest, chunk_size=8 * 1024 * 1024, bandwidth=None, retries=5,
+                  verify=True, remove_source=True):
+    """
+    Moves (or copies) src to dest safely across volumes and network shares.
+
+    Same-volume moves are a plain rename. Otherwise the data is streamed in chunks to
+    dest + ".part", with progress in dest + ".part.json" so a retry (in this call or a later one)
+    resumes after the last good chunk. Only when every chunk's checksum matches is the
+    .part file renamed to dest, so a reader never sees a partial file under the real name.
+    bandwidth is in bytes/second (None = unlimited). Returns a stats dict.
+    """
+    name = os.path.basename(src)
+    started = time.monotonic()
+    src_stat = os.stat(src)
+
+    if remove_source:
+        try:
+            os.rename(src, dest)
+            MOVES.inc(mode="rename", result="ok")
+            MOVED_BYTES.inc(src_stat.st_size, mode="rename")
+            logging.info(f"TRANSFER: {name} renamed in place ({src_stat.st_size / 1024**2:.1f} MB)")
+            return {"file": name, "bytes": src_stat.st_size, "seconds": 0.0, "resumed_bytes": 0, "renamed": True}
+        except OSError:
+            pass  # Different volume or share: stream it
+
+    part_path, state_path = dest + PART_SUFFIX, dest + STATE_SUFFIX
+    delay = 1.0
+    for attempt in range(retries + 1):
+        try:
+            with span("transfer_copy"):
+                chunks, resumed = _copy_chunks(src, part_path, state_path, src_stat, chunk_size, bandwidth)
+                bad = _verify(part_path, chunks, chunk_size) if verify else None
+            if bad is not None:
+                # Keep the good prefix and redo from the first bad chunk
+                _save_state(state_path, src_stat, chunk_size, chunks[:bad])
+                raise TransferError(f"checksum mismatch at chunk {bad}")
+            os.replace(part_path, dest)
+            os.remove(state_path)
+            break
+        except (OSError, TransferError) as e:
+            if attempt == retries:
+                MOVES.inc(mode="copy", result="failed")
+                logging.error(f"TRANSFER FAILED: {name} -> {dest} after {attempt + 1} attempts: {e}")
+                raise
+            TRANSFER_RETRIES.inc()
+            logging.warning(f"TRANSFER RETRY {attempt + 1}/{retries}: {name}: {e}")
+            time.sleep(delay)
+            delay = min(delay * 2, 30.0)
+
+    if remove_source:
+        os.remove(src)
+    MOVES.inc(mode="copy", result="ok")
+    MOVED_BYTES.inc(src_stat.st_size, mode="copy")
+    seconds = time.monotonic() - started
+    rate = src_stat.st_size / seconds / 1024**2 if seconds > 0 else 0.0
+    logging.info(f"TRANSFER: {name} {src_stat.st_size / 1024**2:.1f} MB in {seconds:.2f}s "
+                 f"({rate:.1f} MB/s, resumed at {resumed / 1024**2:.1f} MB)")
+    return {"file": name, "bytes": src_stat.st_size, "seconds": round(seconds, 3),
+            "resumed_bytes": resumed, "renamed": False}
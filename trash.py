@@ -0,0 +1,244 @@
+import errno
+import logging
+import os
+import stat
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from instrument import counter
+
+TRASH_DIR = ".agent-trash"
+
+FREED_BYTES = counter("trash_freed_bytes_total", "Bytes released by the trash reaper.")
+REAPED = counter("trash_items_total", "Items removed by the trash reaper, by outcome.", ("result",))
+
+
+def _mount_point(path):
+    """Normalized mount point (or drive root) holding path, which need not exist any more."""
+    path = os.path.normcase(os.path.abspath(path))
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+
+def trash_dir_for(folder, override=None):
+    """
+    Trash folder for items of `folder`, on the same volume so moving an item there is a rename:
+    the trash_folder override if it is on that volume, else a sibling of `folder`, outside the
+    watched folder so listings never show it. None if `folder` is the root of its volume and no
+    override is there, since every other folder on the volume would then be inside it.
+    """
+    folder = os.path.abspath(folder)
+    mount = _mount_point(folder)
+    if override and _mount_point(override) == mount:
+        return override
+    if os.path.normcase(folder) == mount:
+        return None
+    return os.path.join(os.path.dirname(folder), TRASH_DIR)
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except PermissionError:
+        os.chmod(path, stat.S_IWRITE)  # Read-only files (common in SAS work folders)
+        os.remove(path)
+
+
+def _remove_tree(path):
+    """Deletes a file or folder tree bottom-up; returns (bytes freed, entries removed, errors)."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return 0, 0, 0
+    if not stat.S_ISDIR(st.st_mode):
+        try:
+            _unlink(path)
+            return st.st_size, 1, 0
+        except OSError:
+            return 0, 0, 1
+
+    freed = removed = errors = 0
+    stack = [(path, False)]
+    while stack:
+        folder, visited = stack.pop()
+        if visited:
+            try:
+                os.rmdir(folder)
+                removed += 1
+            except OSError:
+                errors += 1
+            continue
+        stack.append((folder, True))
+        try:
+            with os.scandir(folder) as it:
+                entries = list(it)
+        except OSError:
+            errors += 1
+            continue
+        for e in entries:
+            try:
+                if e.is_dir(follow_symlinks=False):
+                    stack.append((e.path, False))
+                    continue
+                size = e.stat(follow_symlinks=False).st_size
+                _unlink(e.path)
+                freed += size
+                removed += 1
+            except FileNotFoundError:
+                continue
+            except OSError:
+                errors += 1
+    return freed, removed, errors
+
+
+class TrashReaper:
+    """
+    Instant deletes: items are renamed into a trash folder on their own volume (the request
+    returns right away; an item with no such folder is not deleted) and a background pool removes them, at most `io_workers` trees at a time.
+
+    Each trash() call is a batch with progress: {"batch_id", "state", "items", "moved",
+    "reaped", "bytes_freed", "entries_removed", "errors", ...}; state goes queued -> reaping ->
+    done (or failed if something could not be removed). Leftovers from a previous run are picked
+    up by recover().
+    """
+
+    def __init__(self, trash_override=None, io_workers=4, on_update=None, keep=200):
+        self.trash_override = trash_override
+        self.on_update = on_update
+        self.keep = keep
+        self.pool = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix="reaper")
+        self.bytes_freed = 0
+        self.freed_by_trash = {}     # trash folder -> bytes freed there
+        self.pending = 0
+        self._batches = OrderedDict()
+        self._lock = threading.Lock()
+
+    # --- Moving into the trash ---
+    def _move(self, path):
+        folder = os.path.dirname(os.path.abspath(path))
+        trash = trash_dir_for(folder, self.trash_override)
+        if trash is None:
+            raise OSError(errno.EXDEV, f"No trash folder for {folder}: it is the root of its volume, "
+                                       f"set trash_folder to a folder on that volume")
+        os.makedirs(trash, exist_ok=True)
+        target = os.path.join(trash, f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}-{os.path.basename(path)}")
+        try:
+            os.rename(path, target)
+        except OSError as e:
+            if e.errno == errno.EXDEV or getattr(e, 'winerror', None) == 17:
+                raise OSError(errno.EXDEV, f"Trash folder {trash} is not on the volume of {path}") from e
+            raise
+        return target, trash
+
+    def trash(self, paths, label=None):
+        """Moves every path into the trash now and queues the actual deletion; returns the batch."""
+        batch = {"batch_id": uuid.uuid4().hex, "label": label, "state": "queued", "items": len(paths),
+                 "moved": [], "failed": {}, "reaped": 0, "bytes_freed": 0, "entries_removed": 0,
+                 "errors": 0, "created": time.time(), "finished": None}
+        work = []
+        for path in paths:
+            name = os.path.basename(path)
+            try:
+                work.append(self._move(path))
+                batch["moved"].append(name)
+            except FileNotFoundError:
+                batch["failed"][name] = "not found"
+            except OSError as e:
+                batch["failed"][name] = str(e)
+        with self._lock:
+            self._batches[batch["batch_id"]] = batch
+            while len(self._batches) > self.keep:
+                self._batches.popitem(last=False)
+            self.pending += len(work)
+        if not work:
+            self._update(batch, state="done" if batch["moved"] or not batch["failed"] else "failed",
+                         finished=time.time())
+        for target, trash in work:
+            self.pool.submit(self._reap, batch, target, trash)
+        return self.get(batch["batch_id"])
+
+    def recover(self, roots):
+        """Queues whatever is left in the trash folders of the `roots` folders (e.g. after a restart)."""
+        leftovers = []
+        for trash in {trash_dir_for(r, self.trash_override) for r in roots if r} - {None}:
+            try:
+                leftovers += [(e.path, trash) for e in os.scandir(trash)]
+            except OSError:
+                continue
+        if not leftovers:
+            return None
+        batch = {"batch_id": uuid.uuid4().hex, "label": "recovered", "state": "queued", "items": len(leftovers),
+                 "moved": [os.path.basename(p) for p, _ in leftovers], "failed": {}, "reaped": 0,
+                 "bytes_freed": 0, "entries_removed": 0, "errors": 0, "created": time.time(), "finished": None}
+        with self._lock:
+            self._batches[batch["batch_id"]] = batch
+            self.pending += len(leftovers)
+        for target, trash in leftovers:
+            self.pool.submit(self._reap, batch, target, trash)
+        return batch
+
+    # --- Reaping ---
+    def _reap(self, batch, target, trash):
+        if batch["state"] == "queued":
+            self._update(batch, state="reaping")
+        try:
+            freed, removed, errors = _remove_tree(target)
+        except Exception as e:
+            freed, removed, errors = 0, 0, 1
+            logging.error(f"Reaper failed on {target}: {e}")
+        FREED_BYTES.inc(freed)
+        REAPED.inc(result="error" if errors else "ok")
+        with self._lock:
+            self.pending -= 1
+            self.bytes_freed += freed
+            self.freed_by_trash[trash] = self.freed_by_trash.get(trash, 0) + freed
+            batch["reaped"] += 1
+            batch["bytes_freed"] += freed
+            batch["entries_removed"] += removed
+            batch["errors"] += errors
+            finished = batch["reaped"] == len(batch["moved"])
+            if finished:
+                batch["state"] = "failed" if batch["errors"] or batch["failed"] else "done"
+                batch["finished"] = time.time()
+        self._notify(batch)
+
+    def _update(self, batch, **changes):
+        with self._lock:
+            batch.update(changes)
+        self._notify(batch)
+
+    def _notify(self, batch):
+        if self.on_update:
+            try:
+                self.on_update(self.get(batch["batch_id"]) or dict(batch))
+            except Exception as e:
+                logging.error(f"Trash listener failed: {e}")
+
+    # --- Reading ---
+    def get(self, batch_id):
+        with self._lock:
+            batch = self._batches.get(batch_id)
+            if batch is None:
+                return None
+            snapshot = dict(batch, moved=list(batch["moved"]), failed=dict(batch["failed"]))
+        snapshot["progress"] = round(snapshot["reaped"] / len(snapshot["moved"]), 3) if snapshot["moved"] else 1.0
+        return snapshot
+
+    def freed_on(self, mount):
+        """
+        Bytes freed by the reaper in trash folders on the filesystem of `mount` ('C:' or a mount
+        point path): a trash folder counts if the mount point holding it is the one holding
+        `mount`, so '/' leaves out /data and /data leaves out /data2.
+        """
+        if len(mount) == 2 and mount[1] == ':':
+            mount += os.sep  # 'C:' alone means the current folder on C:
+        mount = _mount_point(mount)
+        with self._lock:
+            items = list(self.freed_by_trash.items())
+        return sum(freed for trash, freed in items if _mount_point(trash) == mount)